@@ -1 +1 @@
-from .components import AutoReporter, AutoBuilder, AutoFilter, ManualGrader
\ No newline at end of file
+from .components import AutoReporter, AutoBuilder, AutoFilter, AutoTester, ContentStore, ManualGrader, Pipeline, ResultStore, Tracer
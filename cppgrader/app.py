@@ -1,45 +1,145 @@
 import argparse
-from .components import *
-from typing import List
+import importlib
+import logging
+import sys
+from typing import Dict, List
+
+from .components.Tracer import Tracer
 
 __version__ = '1.0'
 
+# --apps name -> component, loaded by name when the app runs
+APPS: Dict[str, str] = {'filter': 'AutoFilter',
+                        'builder': 'AutoBuilder',
+                        'tester': 'AutoTester',
+                        'reporter': 'AutoReporter',
+                        'grader': 'ManualGrader'}
+
+
+def load_component(name: str):
+    """Import a component of cppgrader.components
+
+    Args:
+        name (str): name of the component, e.g. AutoBuilder
+
+    Returns:
+        the class of the component
+    """
+    return getattr(importlib.import_module('.components.' + name, __package__), name)
+
+
+def setup_logging():
+    """Configure logging once for every app, colored only on a terminal
+    """
+    if sys.stderr.isatty():
+        import coloredlogs
+        coloredlogs.install(level='DEBUG')
+    else:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(name)s[%(process)d] %(levelname)s %(message)s')
 
-def main():
 
+def build_parser() -> argparse.ArgumentParser:
+    """Arguments of every app, the components read them from the parsed namespace
+
+    Returns:
+        argparse.ArgumentParser: parser
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--submission_dir', help='Path to submision directory', type=str, default='./submissions')
     parser.add_argument('-o', '--output_dir', help='Path to output directory', type=str, default='./output')
-    parser.add_argument('--report_name', help='Path to report, will generate <REPORT>.csv|md', type=str, default='REPORT')
+    parser.add_argument('--report_name', help='Path to report, will generate <REPORT>.csv|md|html|jsonl|-metrics.csv', type=str, default='REPORT')
+    parser.add_argument('--report_formats', help='Formats of the report, comma separated in md,csv,html,jsonl,metrics', type=str, default='md,csv,html,jsonl,metrics')
+    parser.add_argument('--top_errors', help='Number of most common compiler errors listed in the report, 0 to disable', type=int, default=10)
+    parser.add_argument('--max_log_size', help='Fold compiler outputs longer than this number of KB in the report, 0 for no limit', type=int, default=64)
     parser.add_argument('-c',
                         '--command',
                         help='Build command',
                         type=str,
                         default='g++ ./src/*.(c|cpp) -I ./include -o main -Wall -g -std=c++14')
+    parser.add_argument('-j', '--jobs', help='Number of builds to run in parallel', type=int, default=1)
+    parser.add_argument('--build_jobs', help='Number of compilers run by each CMake/Make build, 0 to share the cores between the --jobs builds', type=int, default=0)
+    parser.add_argument('--cmake_generator', help='CMake generator', type=str, choices=['Unix Makefiles', 'Ninja'], default=None)
+    parser.add_argument('--build_timeout', help='Kill a build step after this number of seconds, 0 for no timeout', type=float, default=600)
+    parser.add_argument('--output_limit', help='Keep at most this number of KB of output per build step', type=int, default=1024)
+    parser.add_argument('--build_cache', action='store_true', default=False, help='Reuse build results of unchanged submissions')
+    parser.add_argument('--cache_size', help='Size limit of the build cache and of the compile cache in MB', type=int, default=1024)
+    parser.add_argument('--compile_cache', action='store_true', default=False, help='Compile the build command one file at a time, reuse objects of identical files and share precompiled headers')
+    parser.add_argument('--native_build', action='store_true', default=False, help='Without CMakeLists.txt/Makefile, compile the sources of src/ in parallel and link once, unchanged objects are skipped')
     parser.add_argument('--keep_output', action='store_true', default=False, help='Keep output files, do not extract')
+    parser.add_argument('--stream_extract', action='store_true', default=False, help='Read archives directly into output directory, without extracting them next to submissions')
+    parser.add_argument('--incremental', action='store_true', default=False, help='Only reprocess and rebuild submissions whose canvas files changed since the last run')
+    parser.add_argument('--resume', action='store_true', default=False, help='Only build and test the submissions that have no result yet in the result store')
+    parser.add_argument('--pipeline', action='store_true', default=False, help='Build each submission as soon as it is filtered, while the next ones are extracted. Implies --stream_extract')
+    parser.add_argument('--dedup', action='store_true', default=False, help='Store identical files of the output directory once, as reflinks or hardlinks')
     parser.add_argument('--keep_file_structure', action='store_true', default=False, help='Keep structure of source files')
+    parser.add_argument('-t', '--test_dir', help='Path to test cases (<case>.in and <case>.out)', type=str, default=None)
+    parser.add_argument('--executable', help='Name of executable to test', type=str, default='main')
+    parser.add_argument('--timeout', help='Wall time limit of each test case in seconds', type=float, default=10)
+    parser.add_argument('--cpu_limit', help='CPU time limit of each test case in seconds, default to timeout', type=int, default=None)
+    parser.add_argument('--memory_limit', help='Memory limit of each test case in MB, 0 for unlimited', type=int, default=512)
+    parser.add_argument('--prefetch', help='Grader runs the executables of the next N submissions in background, their output is shown as soon as they are listed', type=int, default=0)
+    parser.add_argument('--grader_stdin', help='Path to the stdin of the executables run in background by the grader, default to empty stdin', type=str, default=None)
+    parser.add_argument('--grader_name', help='Name of the grade journal of this grader, graders grading at the same time need different names, default to user@host', type=str, default=None)
+    parser.add_argument('--trace', help='Save timed spans of every stage and student to this file, Chrome trace event format (chrome://tracing, Perfetto)', type=str, default=None)
+    parser.add_argument('--profile', help='Save a cProfile dump of every stage to this directory, <stage>.prof', type=str, default=None)
     parser.add_argument('-a',
                         '--apps',
                         type=str,
-                        default='filter,builder,reporter,grader',
-                        help='Apps to start, defualt to all(filter,builder,reporter,grader)')
+                        default='filter,builder,tester,reporter,grader',
+                        help='Apps to start, defualt to all(filter,builder,tester,reporter,grader)')
+    return parser
+
+
+def main():
+
+    parser = build_parser()
     args = parser.parse_args()
 
     apps: List[str] = args.apps.split(',')
+    for app in apps:
+        if app not in APPS:
+            parser.error('unknown app {}, choose in {}'.format(app, ','.join(APPS.keys())))
+    setup_logging()
+    # Stages are timed (and profiled) here, the apps add the spans of each student
+    tracer = Tracer(args.trace, args.profile)
+    if args.pipeline and 'filter' in apps and 'builder' in apps:
+        # Copy files to output_dir and build them at the same time, archives are extracted one student at a time
+        args.stream_extract = True
+        with tracer.stage('pipeline'):
+            App1 = load_component(APPS['filter'])(args, tracer=tracer)
+            App2 = load_component(APPS['builder'])(args, tracer=tracer)
+            load_component('Pipeline')(App1, App2)()
+        apps = [app for app in apps if app not in ['filter', 'builder']]
+
     # Copy files to output_dir
     if 'filter' in apps:
-        App1 = AutoFilter(args)
-        App1()
+        with tracer.stage('filter'):
+            App1 = load_component(APPS['filter'])(args, tracer=tracer)
+            App1()
 
     # Build submissions
     if 'builder' in apps:
-        App2 = AutoBuilder(args)
-        App2()
+        with tracer.stage('builder'):
+            App2 = load_component(APPS['builder'])(args, tracer=tracer)
+            App2(App1.dirty_targets if 'filter' in apps and args.incremental else None)
+
+    # Run test cases
+    if 'tester' in apps:
+        with tracer.stage('tester'):
+            App5 = load_component(APPS['tester'])(args)
+            App5()
 
-    # Generate report
+    # Generate report, from the results of this run or of a previous one
     if 'reporter' in apps:
-        App3 = AutoReporter(args)
-        App3(App1.failed_targets, App2.compiler_output)
+        with tracer.stage('reporter'):
+            store = load_component('ResultStore')(args.output_dir)
+            App3 = load_component(APPS['reporter'])(args, tracer=tracer)
+            with tracer.span('load results'):
+                results = (store.failures('filter'), store.view('build'), store.elapsed('build'), load_component(APPS['tester']).load_results(store) or None, store.metrics(),
+                           store.error_index(args.top_errors) if args.top_errors > 0 else None)
+            App3(*results)
+            store.close()
+    tracer.save()
 
     if 'grader' in apps:
         # Grading
@@ -49,7 +149,9 @@ def main():
             path_to_report: str = cmd if len(cmd) > 0 else './GRADES.csv'
             cmd = input('[ Info ] Grading dimensions? (default: Answer Interface):')
             dimension: List[str] = cmd.split(' ') if len(cmd) > 0 else ['Answer', 'Interface']
-            App4 = ManualGrader(args.output_dir, path_to_report, dimension)
+            App4 = load_component(APPS['grader'])(args.output_dir, path_to_report, dimension,
+                                prefetch=args.prefetch, path_to_stdin=args.grader_stdin, executable=args.executable, timeout=args.timeout,
+                                grader_name=args.grader_name, cpu_limit=args.cpu_limit, memory_limit=args.memory_limit)
             App4()
 
 
@@ -1,7 +1,21 @@
+import asyncio
 import subprocess
 import os
-from typing import Dict, List, Tuple
-from tqdm import tqdm
+import queue
+import shutil
+import time
+from typing import Dict, List, Mapping, Optional, Set, Tuple
+import logging
+
+from .BuildCache import BuildCache
+from .ContentStore import ContentStore
+from .CMakeSeed import CMakeSeed
+from .CompileCache import CompileCache, CompileCommand, discover_sources, expand_sources, parse_compile_command, parse_depfile
+from .Diagnostics import Diagnostic, count_diagnostics, parse_diagnostics, summarize_diagnostics
+from .ResultStore import ResultStore
+from .TaskRunner import TaskRunner
+from .Tracer import Tracer
+from .common import STATE_DIR_NAME, replace_file
 
 
 class AutoBuilder:
@@ -9,116 +23,572 @@ class AutoBuilder:
     """
     shell_executable: str = '/bin/zsh'
 
-    def __init__(self, args, shell_executable: str='/bin/zsh'):
-        self.task_dir: str = args.output_dir
-        self.original_working_dir: str = os.getcwd()
+    def __init__(self, args, shell_executable: str='/bin/zsh', tracer: Optional[Tracer] = None):
+        self.task_dir: str = os.path.abspath(args.output_dir)
         self.task_list: List[str] = list()
-        self.compiler_output: Dict[str, Tuple[int, str]] = dict()
+        # task_name -> (retcode, output) mapping, read from the store
+        self.compiler_output: Mapping[str, Tuple[int, str]] = dict()
+        # task_name -> wall time of the build in seconds
+        self.build_time: Dict[str, float] = dict()
+        # task_name -> {configure | compile | link -> wall time of the processes in seconds}
+        self.phase_time: Dict[str, Dict[str, float]] = dict()
+        # task_name -> executables written by the build, relative to the task directory
+        self.artifacts: Dict[str, Set[str]] = dict()
+        # Tasks with a step killed at build_timeout, their result depends on the load and is not cached
+        self.timed_out: Set[str] = set()
+        # Name of the executable, its size is recorded
+        self.executable_name: str = args.executable
         # Fullfill the build instruction
         self.compiler_command = args.command
         self.shell_executable = shell_executable
+        # Number of builds running at the same time
+        self.jobs: int = max(1, args.jobs)
+        # Processes are killed after build_timeout seconds, their output is capped to output_limit KB
+        self.runner: TaskRunner = TaskRunner(self.jobs, args.build_timeout if args.build_timeout > 0 else None, args.output_limit * 1024)
+        # Reuse the results of unchanged submissions
+        self.build_cache: Optional[BuildCache] = BuildCache(
+            self.task_dir, args.cache_size, ContentStore(self.task_dir) if args.dedup else None) if args.build_cache else None
+        self._toolchain: Optional[str] = None
+        # Reuse object files of identical translation units and share precompiled headers between submissions
+        self.compile_cache: Optional[CompileCache] = CompileCache(self.task_dir, args.cache_size) if args.compile_cache else None
+        # Compile the sources of src/ in parallel and link once, instead of running the command in zsh
+        self.native_build: bool = args.native_build
+        self.parsed_command: Optional[CompileCommand] = parse_compile_command(self.compiler_command) if args.compile_cache or args.native_build else None
+        self.pch_dir: Optional[str] = None
+        # CMake projects are configured in .cppgrader/build/<task>, each build uses build_jobs cores
+        self.cmake_generator: Optional[str] = args.cmake_generator
+        if self.cmake_generator == 'Ninja' and shutil.which('ninja') is None:
+            logging.warning('ninja not found, fallback to the default CMake generator')
+            self.cmake_generator = None
+        self.build_jobs: int = args.build_jobs if args.build_jobs > 0 else max(1, (os.cpu_count() or 1) // self.jobs)
+        self.cmake_seed: CMakeSeed = CMakeSeed(self.task_dir, self.cmake_generator)
+        # Results are written to the store as soon as a build finishes
+        self.store: ResultStore = ResultStore(self.task_dir)
+        # Only build the tasks that have no result yet
+        self.resume: bool = args.resume
+        # Spans of each build and of each process it runs
+        self.tracer: Tracer = tracer if tracer is not None else Tracer()
 
     @property
     def _build_instruction(self) -> List[str]:
         return [self.shell_executable, '-c', self.compiler_command]
 
+    def _build_dir(self, path_to_task: str) -> str:
+        return os.path.join(self.task_dir, STATE_DIR_NAME, 'build', os.path.basename(path_to_task))
+
+    def _cmake_instructions(self, path_to_task: str) -> List[List[str]]:
+        """Configure and build out of source, so that the submission is not polluted
+
+        Args:
+            path_to_task (str): path to the task directory
+
+        Returns:
+            List[List[str]]: configure and build instructions
+        """
+        path_to_build = self._build_dir(path_to_task)
+        generator = ['-G', self.cmake_generator] if self.cmake_generator is not None else []
+        return [['cmake', '-S', path_to_task, '-B', path_to_build] + generator,
+                ['cmake', '--build', path_to_build, '--parallel', str(self.build_jobs)]]
+
     @property
-    def _cmake_instructions(self) ->List[List[str]]:
-        return [
-        [self.shell_executable, '-c', 'cmake ./'], [self.shell_executable, '-c', 'make']]
-    
+    def _make_instruction(self) -> List[str]:
+        return ['make', '-j', str(self.build_jobs)]
+
+
     def _list_tasks(self):
         """List the output directory for unprocessed tasks
         """
-        for target in [f for f in os.listdir(self.task_dir) if not f.startswith('.')]:
+        for target in sorted([f for f in os.listdir(self.task_dir) if not f.startswith('.')]):
             if target[0] != '.':
                 self.task_list.append(target)
 
-    def _proble_cmake(self) -> bool:
+    def _proble_cmake(self, path_to_task: str) -> bool:
         """Check if the directory contains CMakeLists.txt
 
+        Args:
+            path_to_task (str): path to the task directory
+
         Returns:
             bool: exist -> True inexist -> False
         """
         content_list = [f for f in os.listdir(
-            os.getcwd()) if not f.startswith('.')]
+            path_to_task) if not f.startswith('.')]
         if 'CMakeLists.txt' in content_list:
             return True
         else:
             return False
 
-    def _probe_makefile(self) -> bool:
+    def _probe_makefile(self, path_to_task: str) -> bool:
         """Check if the directory contains Makefile
 
+        Args:
+            path_to_task (str): path to the task directory
+
         Returns:
             bool: exist -> True inexist -> False
         """
         content_list = [f for f in os.listdir(
-            os.getcwd()) if not f.startswith('.')]
+            path_to_task) if not f.startswith('.')]
         if 'Makefile' in content_list:
             return True
         else:
             return False
 
-    def _build_executable_cmake(self, retcode_tmp, output_tmp):
-        ret = subprocess.run(
-                    self._cmake_instructions[0], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        retcode_tmp += ret.returncode
-        output_tmp += str(ret.stderr + ret.stdout, encoding='UTF-8')
-
-        return self._build_executable_make(retcode_tmp, output_tmp)
-       
-    def _build_executable_make(self, retcode_tmp, output_tmp):
-        ret = subprocess.run(
-                    self._cmake_instructions[1], shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        retcode_tmp += ret.returncode
-        output_tmp += str(ret.stderr + ret.stdout, encoding='UTF-8')
-        
+    async def _run_instruction(self, instruction: List[str], path_to_task: str, phase: str = 'compile') -> Tuple[int, str]:
+        """Run an instruction inside the task directory, the working directory of the process is not changed
+
+        Args:
+            instruction (List[str]): instruction to run
+            path_to_task (str): path to the task directory
+            phase (str, optional): configure | compile | link, the wall time is added to the phase. Defaults to 'compile'.
+
+        Returns:
+            Tuple[int, str]: return code and stderr + stdout
+        """
+        ret = await self.runner.run(instruction, cwd=path_to_task)
+        phase_time = self.phase_time.setdefault(os.path.basename(path_to_task), dict())
+        phase_time[phase] = phase_time.get(phase, 0.0) + ret.elapsed
+        if ret.timed_out:
+            self.timed_out.add(os.path.basename(path_to_task))
+        self.tracer.add(phase, time.perf_counter() - ret.elapsed, ret.elapsed, os.path.basename(path_to_task), 'process',
+                        instruction=' '.join(instruction), retcode=ret.retcode, timed_out=ret.timed_out)
+        return ret.retcode, ret.output
+
+    def _copy_executables(self, path_to_build: str, path_to_task: str) -> List[str]:
+        """Copy the executables built out of source to the task directory, where the tester and the grader look for them
+
+        Args:
+            path_to_build (str): path to the build directory
+            path_to_task (str): path to the task directory
+
+        Returns:
+            List[str]: names of the executables copied
+        """
+        copied: List[str] = list()
+        for dirpath, dirnames, filenames in os.walk(path_to_build):
+            dirnames[:] = [d for d in dirnames if d != 'CMakeFiles']
+            for filename in filenames:
+                path_to_file = os.path.join(dirpath, filename)
+                if not os.access(path_to_file, os.X_OK) or os.path.islink(path_to_file):
+                    continue
+                with open(path_to_file, 'rb') as f:
+                    if f.read(4) != b'\x7fELF':
+                        continue
+                # A stale executable of the submission may be a hardlink of the content store
+                replace_file(path_to_file, os.path.join(path_to_task, filename))
+                copied.append(filename)
+        return copied
+
+    async def _build_executable_cmake(self, path_to_task, retcode_tmp, output_tmp):
+        loop = asyncio.get_event_loop()
+        path_to_build = self._build_dir(path_to_task)
+        os.makedirs(path_to_build, exist_ok=True)
+        await loop.run_in_executor(None, self.cmake_seed.prepare, self.toolchain)
+        await loop.run_in_executor(None, self.cmake_seed.apply, path_to_build)
+
+        configure_instruction, build_instruction = self._cmake_instructions(path_to_task)
+        retcode, output = await self._run_instruction(configure_instruction, path_to_task, 'configure')
+        retcode_tmp += retcode
+        output_tmp += output
+        if retcode_tmp == 0:
+            retcode, output = await self._run_instruction(build_instruction, path_to_task)
+            retcode_tmp += retcode
+            output_tmp += output
+
         if retcode_tmp != 0:
-            return self._build_executable_cmd(0, output_tmp + '\nMakefile failed, fallback to command')
+            return await self._build_executable_cmd(path_to_task, 0, output_tmp + '\nCMake failed, fallback to command')
+        copied = await loop.run_in_executor(None, self._copy_executables, path_to_build, path_to_task)
+        self.artifacts.setdefault(os.path.basename(path_to_task), set()).update(copied)
+        return retcode_tmp, output_tmp
+
+    async def _build_executable_make(self, path_to_task, retcode_tmp, output_tmp):
+        retcode, output = await self._run_instruction(self._make_instruction, path_to_task)
+        retcode_tmp += retcode
+        output_tmp += output
+
+        if retcode_tmp != 0:
+            return await self._build_executable_cmd(path_to_task, 0, output_tmp + '\nMakefile failed, fallback to command')
         return retcode_tmp, output_tmp
     
-    def _build_executable_cmd(self, retcode_tmp, output_tmp):
-        ret = subprocess.run(
-                    self._build_instruction, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        retcode_tmp += ret.returncode
-        output_tmp += str(ret.stderr + ret.stdout, encoding='UTF-8')
+    async def _build_executable_cmd(self, path_to_task, retcode_tmp, output_tmp):
+        if self.parsed_command is not None:
+            retcode, output = await self._build_executable_tu(path_to_task)
+        else:
+            retcode, output = await self._run_instruction(self._build_instruction, path_to_task)
+        retcode_tmp += retcode
+        output_tmp += output
         return retcode_tmp, output_tmp
 
-        
-    def _build_executable(self):
-        """Build executable for all submissions
+    def _object_up_to_date(self, path_to_task: str, path_to_object: str, signature: str) -> bool:
+        """Check if an object is newer than every file it depends on, and was built by the same command
+
+        Args:
+            path_to_task (str): path to the task directory
+            path_to_object (str): path to the object
+            signature (str): compiler and flags of the compilation
+
+        Returns:
+            bool: True if the object can be reused
+        """
+        try:
+            with open(path_to_object + '.cmd', 'r') as f:
+                if f.read() != signature:
+                    return False
+            object_mtime = os.stat(path_to_object).st_mtime
+            prerequisites = parse_depfile(path_to_object + '.d')
+            if prerequisites is None:
+                return False
+            for prerequisite in prerequisites:
+                if os.stat(os.path.join(path_to_task, prerequisite)).st_mtime > object_mtime:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    async def _compile_tu(self, path_to_task: str, source: str, path_to_object: str) -> Tuple[int, str]:
+        """Compile a translation unit to an object, skipped if the object is up to date. Goes through the
+        compile cache if enabled
+
+        Args:
+            path_to_task (str): path to the task directory
+            source (str): path to the source, relative to the task directory
+            path_to_object (str): path to the object
+
+        Returns:
+            Tuple[int, str]: return code and compiler output
+        """
+        command = self.parsed_command
+        flags = list(command.compile_flags)
+        if self.native_build and os.path.isdir(os.path.join(path_to_task, 'include')):
+            flags += ['-I', 'include']
+        # The cache key must not depend on the location of the submission, so that identical units are shared
+        key_flags = list(flags)
+        # Objects do not depend on the location of the submission, so that they can be shared
+        flags.append('-fdebug-prefix-map={}=.'.format(path_to_task))
+        signature = '\0'.join([command.compiler] + flags)
+        if self._object_up_to_date(path_to_task, path_to_object, signature):
+            with open(path_to_object + '.log', 'r', encoding='UTF-8') as f:
+                return 0, f.read()
+        depfile_flags = ['-MMD', '-MF', path_to_object + '.d', '-MT', path_to_object]
+
+        loop = asyncio.get_event_loop()
+        key: Optional[str] = None
+        if self.compile_cache is not None:
+            # The depfile is written by the preprocessor, so that it exists on cache hit. With -g, the output
+            # starts with a linemarker of the working directory, which is left out
+            path_to_preprocessed = path_to_object + '.ii'
+            retcode, output = await self._run_instruction([command.compiler] + flags + ['-fno-working-directory'] + depfile_flags + ['-E', source, '-o', path_to_preprocessed], path_to_task)
+            if retcode != 0:
+                if os.path.exists(path_to_preprocessed):
+                    os.remove(path_to_preprocessed)
+                return retcode, output
+            key = await loop.run_in_executor(None, self.compile_cache.object_key, path_to_preprocessed, command.compiler, key_flags, self.toolchain)
+            os.remove(path_to_preprocessed)
+            log = await loop.run_in_executor(None, self.compile_cache.get, key, path_to_object)
+            depfile_flags = list()
+        else:
+            log = None
+
+        if log is None:
+            pch_flags = ['-I', self.pch_dir] if self.pch_dir is not None else []
+            retcode, log = await self._run_instruction([command.compiler] + pch_flags + flags + depfile_flags + ['-c', source, '-o', path_to_object], path_to_task)
+            if retcode != 0:
+                return retcode, log
+            if key is not None:
+                await loop.run_in_executor(None, self.compile_cache.put, key, path_to_object, log)
+
+        with open(path_to_object + '.log', 'w', encoding='UTF-8') as f:
+            f.write(log)
+        with open(path_to_object + '.cmd', 'w') as f:
+            f.write(signature)
+        return 0, log
+
+    async def _build_executable_tu(self, path_to_task: str) -> Tuple[int, str]:
+        """Build the fallback command natively: compile the translation units in parallel, then link once
+
+        Args:
+            path_to_task (str): path to the task directory
+
+        Returns:
+            Tuple[int, str]: return code and compiler output
+        """
+        command = self.parsed_command
+        sources = discover_sources(path_to_task) if self.native_build else expand_sources(command.sources, path_to_task)
+        if len(sources) == 0:
+            return 1, 'No source file found\n'
+
+        path_to_objects = os.path.join(self.task_dir, STATE_DIR_NAME, 'objects', os.path.basename(path_to_task))
+        os.makedirs(path_to_objects, exist_ok=True)
+        objects = [os.path.join(path_to_objects, source.replace(os.sep, '__') + '.o') for source in sources]
+        # The number of running compilers is bounded by the runner
+        results = await asyncio.gather(*[self._compile_tu(path_to_task, source, path_to_object)
+                                         for source, path_to_object in zip(sources, objects)])
+        retcode_tmp = sum([retcode for retcode, _ in results])
+        output_tmp = ''.join([output for _, output in results])
+        if retcode_tmp != 0:
+            return retcode_tmp, output_tmp
+
+        retcode, output = await self._run_instruction([command.compiler] + objects + command.compile_flags + command.link_flags + ['-o', command.output], path_to_task, 'link')
+        if retcode == 0:
+            self.artifacts.setdefault(os.path.basename(path_to_task), set()).add(os.path.normpath(command.output))
+        return retcode, output_tmp + output
+
+    @property
+    def toolchain(self) -> str:
+        """Version of the compiler used by the build command, part of the build cache key
+
+        Returns:
+            str: output of '<compiler> --version'
+        """
+        if self._toolchain is None:
+            compiler = self.compiler_command.split(' ')[0]
+            try:
+                ret = subprocess.run([compiler, '--version'], cwd=self.task_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                self._toolchain = str(ret.stdout, encoding='UTF-8', errors='replace')
+            except OSError:
+                self._toolchain = compiler
+        return self._toolchain
+
+    def _effective_command(self, path_to_task: str) -> str:
+        """Describe the commands that will be used to build a task
+
+        Args:
+            path_to_task (str): path to the task directory
+
+        Returns:
+            str: the effective command, fallback command included
+        """
+        if self._proble_cmake(path_to_task):
+            instructions = self._cmake_instructions(path_to_task) + [self._build_instruction]
+        elif self._probe_makefile(path_to_task):
+            instructions = [self._make_instruction, self._build_instruction]
+        else:
+            instructions = [self._build_instruction]
+        # The command is not run in the shell in these modes, their results must not be mixed
+        if self.parsed_command is not None:
+            modes = [mode for mode, enabled in [('native_build', self.native_build), ('compile_cache', self.compile_cache is not None)] if enabled]
+            instructions.append(['#'] + modes)
+        return '\n'.join([' '.join(instruction) for instruction in instructions])
+
+    async def _build_task(self, task_name: str) -> Tuple[int, str, float]:
+        """Build a single submission
+
+        Args:
+            task_name (str): name of the task 5xxxxxxxxxxxNAME
+
+        Returns:
+            Tuple[int, str, float]: return code, compiler output and wall time
         """
-        pbar = tqdm(self.task_list)
-        os.chdir(self.original_working_dir)
+        retcode_tmp = 0
+        output_tmp = ''
+        path_to_task = os.path.join(self.task_dir, task_name)
+        start = time.perf_counter()
+        self.artifacts[task_name] = set()
+        self.timed_out.discard(task_name)
 
-        for task_name in pbar:
-            retcode_tmp = 0
-            output_tmp = ''
+        loop = asyncio.get_event_loop()
+        if self.build_cache is not None:
+            # Hashing and copying files would block the event loop
+            with self.tracer.span('build cache', task_name, 'cache') as span:
+                key = await loop.run_in_executor(None, self.build_cache.fingerprint, path_to_task, self._effective_command(path_to_task), self.toolchain)
+                cached = await loop.run_in_executor(None, self.build_cache.get, key, path_to_task)
+                span['hit'] = cached is not None
+            if cached is not None:
+                return cached[0], cached[1], time.perf_counter() - start
+            since = time.time()
 
-            pbar.set_description('Building {}'.format(task_name))
-            # Change current warding directory
-            os.chdir(os.path.join(self.task_dir, task_name))
+        if self._proble_cmake(path_to_task):  # CMakeLists.txt is found
+            retcode_tmp, output_tmp = await self._build_executable_cmake(path_to_task, retcode_tmp, output_tmp)
 
-            if self._proble_cmake():  # CMakeLists.txt is found
-                retcode_tmp, output_tmp = self._build_executable_cmake(retcode_tmp, output_tmp)
+        elif self._probe_makefile(path_to_task):  # Makefile is found
+            retcode_tmp, output_tmp = await self._build_executable_make(path_to_task, retcode_tmp, output_tmp)
+
+        else:
+            retcode_tmp, output_tmp = await self._build_executable_cmd(path_to_task, retcode_tmp, output_tmp)
 
-            elif self._probe_makefile():  # Makefile is found
-                retcode_tmp, output_tmp = self._build_executable_make(retcode_tmp, output_tmp)
+        if self.build_cache is not None and task_name not in self.timed_out:
+            # A no-op make leaves the executable older than the build, it is still its result
+            if retcode_tmp == 0 and os.path.isfile(os.path.join(path_to_task, self.executable_name)):
+                self.artifacts[task_name].add(self.executable_name)
+            await loop.run_in_executor(None, self.build_cache.put, key, path_to_task, retcode_tmp, output_tmp, since, sorted(self.artifacts[task_name]))
 
-            else:
-                retcode_tmp, output_tmp = self._build_executable_cmd(retcode_tmp, output_tmp)
+        return retcode_tmp, output_tmp, time.perf_counter() - start
 
-            self.compiler_output[task_name] = (retcode_tmp, output_tmp)
+    def _build_metrics(self, task_name: str, diagnostics: List[Diagnostic]) -> Dict[str, float]:
+        """Collect the metrics of a build
+
+        Args:
+            task_name (str): name of the task 5xxxxxxxxxxxNAME
+            diagnostics (List[Diagnostic]): diagnostics in the compiler output
+
+        Returns:
+            Dict[str, float]: phase times, number of warnings and errors, size of the executable (-1 if missing)
+        """
+        metrics: Dict[str, float] = dict()
+        for phase in ['configure', 'compile', 'link']:
+            metrics[phase + '_time'] = self.phase_time.get(task_name, dict()).get(phase, 0.0)
+        metrics['warnings'] = count_diagnostics(diagnostics, ['warning'])
+        metrics['errors'] = count_diagnostics(diagnostics)
+        path_to_executable = os.path.join(self.task_dir, task_name, self.executable_name)
+        metrics['binary_size'] = os.path.getsize(path_to_executable) if os.path.isfile(path_to_executable) else -1
+        return metrics
+
+    async def _build_and_save(self, task_name: str) -> str:
+        """Build a task and write its result, metrics and diagnostics to the store
+
+        Args:
+            task_name (str): name of the task 5xxxxxxxxxxxNAME
+
+        Returns:
+            str: name of the task
+        """
+        with self.tracer.span('build', task_name, 'build') as span:
+            retcode_tmp, output_tmp, elapsed = await self._build_task(task_name)
+            span['retcode'] = retcode_tmp
+        with self.tracer.span('save result', task_name, 'build'):
+            self.store.put(task_name, 'build', retcode_tmp, output_tmp, elapsed)
+            diagnostics = parse_diagnostics(output_tmp)
+            self.store.put_metrics(task_name, 'build', self._build_metrics(task_name, diagnostics))
+            self.store.put_diagnostics(task_name, summarize_diagnostics(diagnostics))
+        self.build_time[task_name] = elapsed
+        return task_name
 
-            # Change back
-            os.chdir(self.original_working_dir)
+    async def _build_all(self, tasks_to_build: List[str]):
+        """Build tasks concurrently, at most self.jobs at the same time. Each result is written to the store when
+        the build finishes
 
-    def run(self):
+        Args:
+            tasks_to_build (List[str]): tasks to build
+        """
+        # A build starts when it gets a slot, so that its wall time does not include the wait for the others
+        slots = asyncio.Semaphore(self.jobs)
+
+        async def build(task_name: str) -> str:
+            async with slots:
+                return await self._build_and_save(task_name)
+
+        from tqdm import tqdm
+        with tqdm(total=len(tasks_to_build)) as pbar:
+            for future in asyncio.as_completed([build(task_name) for task_name in tasks_to_build]):
+                task_name = await future
+                pbar.set_description('Built {} in {:.2f}s'.format(task_name, self.build_time[task_name]))
+                pbar.update()
+
+    async def _build_stream(self, task_queue: queue.Queue, skipped: Set[str]):
+        """Build the tasks of a queue as they arrive, at most self.jobs at the same time. The queue is not read
+        while every slot is busy, so that a bounded queue holds back its producer
+
+        Args:
+            task_queue (queue.Queue): names of the tasks, None ends the stream
+            skipped (Set[str]): tasks that are not built
+        """
+        loop = asyncio.get_event_loop()
+        slots = asyncio.Semaphore(self.jobs)
+        pending: List[asyncio.Future] = list()
+
+        from tqdm import tqdm
+        with tqdm() as pbar:
+            async def build(task_name: str):
+                try:
+                    await self._build_and_save(task_name)
+                    pbar.set_description('Built {} in {:.2f}s'.format(task_name, self.build_time[task_name]))
+                    pbar.update()
+                finally:
+                    slots.release()
+
+            while True:
+                await slots.acquire()
+                task_name: Optional[str] = await loop.run_in_executor(None, task_queue.get)
+                if task_name is None:
+                    break
+                if task_name in skipped:
+                    slots.release()
+                    continue
+                # The previous result of the task must not survive an interrupted build
+                self.store.remove('build', [task_name])
+                pending.append(asyncio.ensure_future(build(task_name)))
+            await asyncio.gather(*pending)
+
+    def _build_executable(self, dirty_tasks: Optional[List[str]] = None):
+        """Build executable for all submissions, self.jobs builds are running at the same time
+
+        Args:
+            dirty_tasks (Optional[List[str]], optional): Tasks that changed since the last run, the result of the
+                others is reused if it exists. Defaults to None (build everything, unless resuming).
+        """
+        if dirty_tasks is not None:
+            self.store.remove('build', dirty_tasks)
+        elif not self.resume:
+            self.store.remove('build')
+        built = self.store.students('build')
+        # Submissions that disappeared from the output directory
+        self.store.remove('build', [task_name for task_name in built if task_name not in self.task_list])
+        tasks_to_build: List[str] = [task_name for task_name in self.task_list if task_name not in built]
+        if len(tasks_to_build) < len(self.task_list):
+            logging.info('{} of {} submissions to build'.format(len(tasks_to_build), len(self.task_list)))
+
+        asyncio.run(self._build_all(tasks_to_build))
+
+        self.compiler_output = self.store.view('build')
+        self.build_time = self.store.elapsed('build')
+
+    def _prepare(self):
+        """Check the build command and precompile the headers shared by every build
+        """
+        if (self.compile_cache is not None or self.native_build) and self.parsed_command is None:
+            logging.warning('Build command is not a single compiler invocation, fallback to {}'.format(self.shell_executable))
+        if self.compile_cache is not None and self.parsed_command is not None:
+            with self.tracer.span('precompile headers'):
+                self.pch_dir = self.compile_cache.prepare_pch(self.parsed_command.compiler, self.parsed_command.compile_flags, self.toolchain)
+
+    def run(self, dirty_tasks: Optional[List[str]] = None):
         """Run builder
+
+        Args:
+            dirty_tasks (Optional[List[str]], optional): Tasks that changed since the last run. Defaults to None.
+        """
+        self._list_tasks()
+        self._prepare()
+        self._build_executable(dirty_tasks)
+        self._finish()
+
+    def run_stream(self, task_queue: queue.Queue, incremental: bool = False):
+        """Run builder on the tasks of a queue while they are produced, e.g. by the filter
+
+        Args:
+            task_queue (queue.Queue): names of the tasks, None ends the stream
+            incremental (bool, optional): only the tasks of the queue changed, the result of the others is kept.
+                Defaults to False (everything is rebuilt, unless resuming).
         """
+        self._prepare()
+        skipped: Set[str] = set()
+        if incremental:
+            pass
+        elif self.resume:
+            skipped = set(self.store.students('build'))
+        else:
+            self.store.remove('build')
+        asyncio.run(self._build_stream(task_queue, skipped))
+
+        # Submissions that disappeared from the output directory
         self._list_tasks()
-        self._build_executable()
+        self.store.remove('build', [task_name for task_name in self.store.students('build') if task_name not in self.task_list])
+        self.compiler_output = self.store.view('build')
+        self.build_time = self.store.elapsed('build')
+        self._finish()
+
+    def _finish(self):
+        """Save the caches and log the slowest build
+        """
+        with self.tracer.span('save caches'):
+            if self.build_cache is not None:
+                self.build_cache.save()
+            if self.compile_cache is not None:
+                self.compile_cache.evict()
+        if len(self.build_time) > 0:
+            slowest = max(self.build_time, key=self.build_time.get)
+            logging.info('Built {} submissions with {} jobs, slowest: {} ({:.2f}s)'.format(
+                len(self.build_time), self.jobs, slowest, self.build_time[slowest]))
 
-    def __call__(self):
-        self.run()
+    def __call__(self, dirty_tasks: Optional[List[str]] = None):
+        self.run(dirty_tasks)
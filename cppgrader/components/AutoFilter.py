@@ -1,14 +1,70 @@
 import os
 import shutil
+import time
 import zipfile
-import rarfile
-from tqdm import tqdm
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
 import logging
-import coloredlogs
+
+from .ContentStore import ContentStore
+from .ResultStore import ResultStore
+from .Tracer import Tracer
+from .common import STATE_DIR_NAME, hash_file
 
 logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG')
+
+# Magic bytes of supported archives
+ARCHIVE_SIGNATURES: List[Tuple[bytes, str]] = [
+    (b'PK\x03\x04', 'zip'),
+    (b'PK\x05\x06', 'zip'),  # Empty archive
+    (b'PK\x07\x08', 'zip'),  # Spanned archive
+    (b'Rar!\x1a\x07\x00', 'rar'),  # RAR 1.5 - 4.x
+    (b'Rar!\x1a\x07\x01\x00', 'rar'),  # RAR 5.0
+]
+
+
+def detect_archive_type(path_to_file: str) -> Optional[str]:
+    """Detect the type of archive from its magic bytes, the file is read only once
+
+    Args:
+        path_to_file (str): path to file
+
+    Returns:
+        Optional[str]: 'zip', 'rar' or None if the file is not an archive
+    """
+    with open(path_to_file, 'rb') as f:
+        header: bytes = f.read(8)
+    for signature, archive_type in ARCHIVE_SIGNATURES:
+        if header.startswith(signature):
+            return archive_type
+    return None
+
+
+def extract_archive(path_to_archive: str, path_to_dir: str, archive_type: str) -> Tuple[str, Optional[str], float, float]:
+    """Extract an archive to a directory, runs in a worker process
+
+    Args:
+        path_to_archive (str): path to archive
+        path_to_dir (str): path to destination
+        archive_type (str): 'zip' or 'rar'
+
+    Returns:
+        Tuple[str, Optional[str], float, float]: path to archive, error message or None if the archive is extracted,
+            time.perf_counter() at the start and wall time of the extraction
+
+    Bug:
+        Usually dont work for rar files because for compatibility issues
+    """
+    start = time.perf_counter()
+    try:
+        with open_archive(path_to_archive, archive_type) as f:
+            f.extractall(path_to_dir)
+    except Exception as err:
+        shutil.rmtree(path_to_dir, ignore_errors=True)
+        return path_to_archive, '{}: {}'.format(type(err).__name__, err), start, time.perf_counter() - start
+    return path_to_archive, None, start, time.perf_counter() - start
+
 
 def canvas_extract_name(target_name: str) -> str:
     """ Extract name from target -> 5xxxxxxxxxxxNAME
@@ -58,11 +114,59 @@ def canvas_test_submission_format(path_to_dir: str) -> List[int]:
 
     return ret
 
+def canvas_test_archive_format(member_names: List[str]) -> Tuple[List[int], str]:
+    """Check if the submission is of correct format from the member names of its archive, without extracting it.
+    Same rules as canvas_test_submission_format
+
+    Args:
+        member_names (List[str]): names of archive members, directories end with '/'
+
+    Returns:
+        Tuple[List[int], str]: format (see canvas_test_submission_format), prefix of the root of submission in the archive
+    """
+    def components(name: str) -> List[str]:
+        return [c for c in name.replace('\\', '/').split('/') if c != '']
+
+    members: List[List[str]] = [components(name) for name in member_names if len(components(name)) > 0]
+    content_list: List[str] = sorted(set([c[0] for c in members if ((not c[0].startswith('.')) and (not c[0].startswith('__MACOSX')))]))
+    ret: List[int] = [0,0]
+    root: str = ''
+    # If the archive contains only one folder, step in
+    if len(content_list) == 1 and any([len(c) > 1 and c[0] == content_list[0] for c in members]):
+        root = content_list[0] + '/'
+        content_list = sorted(set([c[1] for c in members if len(c) > 1 and c[0] == content_list[0] and not c[1].startswith('.')]))
+        ret[0] = 1
+
+    if 'CMakeLists.txt' in content_list or 'Makefile' in content_list:
+        ret[1] = 1
+
+    return ret, root
+
+
+def open_archive(path_to_archive: str, archive_type: str):
+    """Open an archive for reading
+
+    Args:
+        path_to_archive (str): path to archive
+        archive_type (str): 'zip' or 'rar'
+
+    Returns:
+        zipfile.ZipFile | rarfile.RarFile
+    """
+    if archive_type == 'zip':
+        return zipfile.ZipFile(path_to_archive)
+    elif archive_type == 'rar':
+        import rarfile
+        return rarfile.RarFile(path_to_archive)
+    else:
+        raise NotImplementedError(archive_type)
+
+
 class AutoFilter:
     """Filter files
     """
 
-    def __init__(self, args):
+    def __init__(self, args, tracer: Optional[Tracer] = None):
         self.submission_dir: str = args.submission_dir  # Submission directory
         # Example:
         # Submission director
@@ -86,91 +190,140 @@ class AutoFilter:
         self.failed_targets: Dict[str, str] = dict()
         self.keep_output = args.keep_output  # Whether to keep output file
         self.keep_file_structure = args.keep_file_structure
+        self.jobs: int = max(1, args.jobs)  # Number of archives extracted in parallel
+        self.stream_extract: bool = args.stream_extract  # Read archive members directly into output_dir
+        # Only reprocess the students whose canvas files changed since the last run
+        self.incremental: bool = args.incremental
+        self.manifest_path: str = os.path.join(self.output_dir, STATE_DIR_NAME, 'manifest.json')
+        # student_name -> {filename -> {size, mtime, sha1}} mapping
+        self.manifest: Dict[str, Dict[str, Dict]] = dict()
+        # Students that are (re)processed by this run
+        self.dirty_targets: List[str] = list()
+        # student_name -> wall time of the filter in seconds
+        self.filter_time: Dict[str, float] = dict()
+        # Spans of the extraction and of the copy of each student
+        self.tracer: Tracer = tracer if tracer is not None else Tracer()
+        # Identical files of different students are stored once and linked
+        self.content_store: Optional[ContentStore] = ContentStore(self.output_dir) if args.dedup else None
 
         self._extract_name = canvas_extract_name
         self._remove_prefix = canvas_remove_prefix
         self._test_submission_format = canvas_test_submission_format
 
     def _create_output_dir(self):
-        """Create the output directory, will override the directory
+        """Create the output directory, will override the directory but keep the state of cppgrader
         """
 
         if os.path.exists(self.output_dir):
-            if not self.keep_output:
+            if self.incremental:
+                logging.info("incremental==True, refresh changed submissions only")
+            elif not self.keep_output:
                 logging.info("Output folder exists, override")
-                shutil.rmtree(self.output_dir)
-                os.mkdir(self.output_dir)
+                for content in os.listdir(self.output_dir):
+                    if content == STATE_DIR_NAME:
+                        continue
+                    if os.path.isdir(os.path.join(self.output_dir, content)):
+                        shutil.rmtree(os.path.join(self.output_dir, content))
+                    else:
+                        os.remove(os.path.join(self.output_dir, content))
             else:
                 logging.info("keep_output==True, keep")
                 pass
         else:
             os.mkdir(self.output_dir)
 
-    def _preprocess_zip(self, path_to_zipfile: str):
-        """Extract zip file to their related directory
-        /path/5xxxxxxxxxxxNAME_*_*_*_.zip will be extract to /path/5xxxxxxxxxxxNAME_*_*_*_(dir)
+    def _load_manifest(self) -> Dict[str, Dict[str, Dict]]:
+        """Load the manifest of the previous run
 
-        Args:
-            path_to_zipfile (str): path to strfile
+        Returns:
+            Dict[str, Dict[str, Dict]]: student_name -> {filename -> {size, mtime, sha1}}
         """
-
-        dir_related: str = os.path.splitext(
-            os.path.basename(path_to_zipfile))[0]
-
-        if os.path.exists(dir_related):
-            shutil.rmtree(dir_related)
-            os.mkdir(dir_related)
-        f = zipfile.ZipFile(path_to_zipfile)
-        try:
-            if not os.path.exists(os.path.join(self.submission_dir, dir_related)):
-                f.extractall(os.path.join(self.submission_dir, dir_related))
-            else:
-                logging.warning("{path_to_zipfile} is uncompressed manually")
-        except Exception as err:
-            logging.warning("{path_to_zipfile} could not be processed")
-            shutil.rmtree(os.path.join(self.submission_dir, dir_related))
-            self.failed_targets[path_to_zipfile] = err
-
-    def _preprocess_rar(self, path_to_rarfile):
-        """Extract rar file to their related directory
-
-        Args:
-            path_to_rarfile (str): Path to rarfile
-
-        Bug:
-            Usually dont work because for compatibility issues
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                logging.warning("Manifest {} is broken, reprocess everything".format(self.manifest_path))
+        return dict()
+
+    def _save_manifest(self):
+        """Save the manifest of this run
         """
-
-        dir_related: str = os.path.splitext(
-            os.path.basename(path_to_rarfile))[0]
-
-        if os.path.exists(dir_related):
-            shutil.rmtree(dir_related)
-            os.mkdir(dir_related)
-        f = rarfile.RarFile(path_to_rarfile)
-        try:
-            f.extractall(os.path.join(self.submission_dir, dir_related))
-        except Exception as err:
-            logging.warning("{path_to_rarfile} could not be processed".format())
-            shutil.rmtree(os.path.join(self.submission_dir, dir_related))
-            self.failed_targets[path_to_rarfile] = err
-
-    def _preprocess_tar(self, path_to_tarball: str):
-        raise NotImplementedError
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def _scan_submission(self):
+        """Record size, mtime and hash of every canvas file and find the students whose files changed.
+        The hash is only recomputed when the size or the mtime of a file changed
+        """
+        previous_manifest = self._load_manifest()
+        self.manifest = dict()
+        for target in sorted([f for f in os.listdir(self.submission_dir) if not f.startswith('.')]):
+            target_path = os.path.join(self.submission_dir, target)
+            if not os.path.isfile(target_path):
+                continue  # Directories are extracted from archives
+            name = self._extract_name(target)
+            stat = os.stat(target_path)
+            record = previous_manifest.get(name, dict()).get(target)
+            if record is None or record['size'] != stat.st_size or record['mtime'] != stat.st_mtime:
+                record = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': hash_file(target_path).hexdigest()}
+            self.manifest.setdefault(name, dict())[target] = record
+
+        def digest(files: Dict[str, Dict]) -> Dict[str, str]:
+            return {filename: files[filename]['sha1'] for filename in files}
+
+        self.dirty_targets = [name for name in sorted(self.manifest.keys())
+                              if name not in previous_manifest
+                              or digest(previous_manifest[name]) != digest(self.manifest[name])
+                              or not os.path.exists(os.path.join(self.output_dir, name))]
+
+        for name in previous_manifest:
+            if name not in self.manifest and os.path.exists(os.path.join(self.output_dir, name)):
+                logging.info("{} has no submission anymore, remove".format(name))
+                shutil.rmtree(os.path.join(self.output_dir, name))
+
+        for name in self.dirty_targets:
+            if os.path.exists(os.path.join(self.output_dir, name)):
+                shutil.rmtree(os.path.join(self.output_dir, name))
+        logging.info("{} of {} submissions changed".format(len(self.dirty_targets), len(self.manifest)))
 
     def _preprocess(self):
-        """Extract all zip/rar files
+        """Extract all zip/rar files in a process pool
+        /path/5xxxxxxxxxxxNAME_*_*_*_.zip will be extract to /path/5xxxxxxxxxxxNAME_*_*_*_(dir)
         """
 
         target_list: List[str] = [f for f in os.listdir(
             self.submission_dir) if not f.startswith('.')]
+        archives: List[Tuple[str, str, str]] = list()
         for target in target_list:
             target_path = os.path.join(self.submission_dir, target)
             if os.path.isfile(target_path):
-                if zipfile.is_zipfile(target_path):
-                    self._preprocess_zip(target_path)
-                if rarfile.is_rarfile(target_path):
-                    self._preprocess_rar(target_path)
+                archive_type = detect_archive_type(target_path)
+                if archive_type is None:
+                    continue
+                dir_related: str = os.path.join(self.submission_dir, os.path.splitext(target)[0])
+                if self.incremental:
+                    if self._extract_name(target) not in self.dirty_targets:
+                        continue
+                    # The directory was extracted from a previous version of the archive
+                    shutil.rmtree(dir_related, ignore_errors=True)
+                if os.path.exists(dir_related):
+                    logging.warning("{} is uncompressed manually".format(target_path))
+                    continue
+                archives.append((target_path, dir_related, archive_type))
+
+        from tqdm import tqdm
+        with tqdm(total=len(archives), desc='Extracting') as pbar, ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(extract_archive, *archive) for archive in archives]
+            for future in as_completed(futures):
+                path_to_archive, err, start, elapsed = future.result()
+                self.tracer.add('extract', start, elapsed, self._extract_name(os.path.basename(path_to_archive)), 'filter', archive=path_to_archive, error=err)
+                if err is not None:
+                    logging.warning("{} could not be processed".format(path_to_archive))
+                    self.failed_targets[path_to_archive] = err
+                pbar.update()
 
     def _map_submission(self):
         """Map submission to student names(IDs)
@@ -181,8 +334,12 @@ class AutoFilter:
         for target in target_list:
             ext = os.path.splitext(target)[-1]
 
+            if self.stream_extract:
+                # Archives are read directly, ignore the directories extracted by a previous run
+                if target + '.zip' in target_list or target + '.rar' in target_list:
+                    continue
             # Ignore hidden files, compressed files
-            if target[0] == '.' or ext in ['.rar', '.zip']:
+            elif target[0] == '.' or ext in ['.rar', '.zip']:
                 continue
 
             # Extract names from submission
@@ -214,8 +371,8 @@ class AutoFilter:
         shutil.rmtree(path_to_dir)
         os.mkdir(path_to_dir)
 
-    def _filter_process_plain(self, student_name: str, path_to_file: str, remove_prefix: bool = False):
-        """Process uncompressed files
+    def _plain_destination(self, student_name: str, path_to_file: str, remove_prefix: bool = False) -> Optional[str]:
+        """Decide where an uncompressed file goes
 
         Args:
             student_name (str): student's name 5xxxxxxxxxxxNAME
@@ -223,7 +380,7 @@ class AutoFilter:
             remove_prefix (bool, optional): if the canvas prefix exist (and should be removed). Defaults to False.
 
         Returns:
-            bool: if the file is filtered out
+            Optional[str]: path to destination file, None if the file is filtered out
         """
         ext: str = os.path.splitext(path_to_file)[-1]
 
@@ -233,34 +390,59 @@ class AutoFilter:
             prefix_removed_filename: str = self._remove_prefix(
                 path_to_file)
             if ext in ['.cpp', '.c', 'cxx']:
-                shutil.copy(path_to_file, os.path.join(
-                    self.output_dir, student_name, 'src', prefix_removed_filename))
+                return os.path.join(self.output_dir, student_name, 'src', prefix_removed_filename)
 
             elif ext in ['.hpp', '.h']:
-                shutil.copy(path_to_file, os.path.join(
-                    self.output_dir, student_name, 'include', prefix_removed_filename))
+                return os.path.join(self.output_dir, student_name, 'include', prefix_removed_filename)
 
             elif ext in ['.txt', '.md', '.pdf', '.word', '.tex', '.exe', '.out', '.bin', '']:
-                shutil.copy(path_to_file, os.path.join(
-                    self.output_dir, student_name, prefix_removed_filename))
+                return os.path.join(self.output_dir, student_name, prefix_removed_filename)
             else:
-                return False
+                return None
         else:
+            filename: str = os.path.basename(path_to_file)
             if ext in ['.cpp', '.c']:
-                shutil.copy(path_to_file, os.path.join(
-                    self.output_dir, student_name, 'src'))
+                return os.path.join(self.output_dir, student_name, 'src', filename)
 
             elif ext in ['.hpp', '.h']:
-                shutil.copy(path_to_file, os.path.join(
-                    self.output_dir, student_name, 'include'))
+                return os.path.join(self.output_dir, student_name, 'include', filename)
 
             elif ext in ['.txt', '.md', '.pdf', 'rtf', '.tex', '.exe', '.out', '.bin', 'doc', 'docx', 'html','']:
-                shutil.copy(path_to_file, os.path.join(
-                    self.output_dir, student_name))
+                return os.path.join(self.output_dir, student_name, filename)
             else:
-                return False
+                return None
+
+    def _filter_process_plain(self, student_name: str, path_to_file: str, remove_prefix: bool = False):
+        """Process uncompressed files
+
+        Args:
+            student_name (str): student's name 5xxxxxxxxxxxNAME
+            path_to_file (str): path to file
+            remove_prefix (bool, optional): if the canvas prefix exist (and should be removed). Defaults to False.
+
+        Returns:
+            bool: if the file is filtered out
+        """
+        path_to_destination: Optional[str] = self._plain_destination(student_name, path_to_file, remove_prefix)
+        if path_to_destination is None:
+            return False
+        self._copy_file(path_to_file, path_to_destination)
         return True
 
+    def _copy_file(self, path_to_src: str, path_to_destination: str) -> str:
+        """Copy a file to the output directory, through the content store if enabled
+
+        Args:
+            path_to_src (str): path to source
+            path_to_destination (str): path to destination
+
+        Returns:
+            str: path to destination
+        """
+        if self.content_store is not None:
+            return self.content_store.put_file(path_to_src, path_to_destination)
+        return shutil.copy(path_to_src, path_to_destination)
+
     def _filter_process_dir(self, student_name: str, path_to_dir: str) -> bool:
         """Process a directory
 
@@ -288,6 +470,9 @@ class AutoFilter:
             for content in content_list:
                 if (os.path.isdir(os.path.join(path_to_dir, content))):
                     shutil.copytree(os.path.join(path_to_dir, content), os.path.join(
+                        self.output_dir, student_name, content), copy_function=self._copy_file if self.content_store is not None else shutil.copy2)
+                elif self.content_store is not None:
+                    self.content_store.put_file(os.path.join(path_to_dir, content), os.path.join(
                         self.output_dir, student_name, content))
                 else:
                     shutil.copyfile(os.path.join(path_to_dir, content), os.path.join(
@@ -301,28 +486,164 @@ class AutoFilter:
                             student_name, os.path.join(path_to_dir, filename))
             return False
 
-    def _filter_all(self):
+    def _filter_process_archive(self, student_name: str, path_to_archive: str) -> bool:
+        """Process an archive without extracting it, the members that are kept are streamed to their final location
+
+        Args:
+            student_name (str): student's name 5xxxxxxxxxxxNAME
+            path_to_archive (str): path to archive
+
+        Returns:
+            bool: If the submission is of correct format(has CMakeLists.txt)
+        """
+        if self.keep_output and os.path.exists(os.path.join(self.output_dir, student_name)):
+            logging.info('Keeping {}'.format(os.path.join(self.output_dir, student_name)))
+            return True
+
+        archive_type: Optional[str] = detect_archive_type(path_to_archive)
+        if archive_type is None:
+            return self._filter_process_plain(student_name, path_to_archive, remove_prefix=True)
+
+        try:
+            with open_archive(path_to_archive, archive_type) as f:
+                members = [info for info in f.infolist() if not info.is_dir()]
+                ret, root = canvas_test_archive_format([info.filename for info in f.infolist()])
+                correct_format: bool = ret[1] > 0 or self.keep_file_structure > 0
+
+                if correct_format:  # Is of correct format
+                    self._clean_dir(os.path.join(self.output_dir, student_name))
+
+                for info in members:
+                    name: str = info.filename.replace('\\', '/')
+                    components: List[str] = [c for c in name.split('/') if c != '']
+                    if len(components) == 0 or '..' in components or name.startswith('/'):
+                        continue
+                    if components[0].startswith('__MACOSX'):
+                        continue
+
+                    if correct_format:
+                        if not name.startswith(root):
+                            continue
+                        components = [c for c in name[len(root):].split('/') if c != '']
+                        if components[0].startswith('.'):
+                            continue
+                        path_to_destination: Optional[str] = os.path.join(self.output_dir, student_name, *components)
+                    else:  # Incorrect format
+                        if components[-1].startswith('.'):
+                            continue
+                        path_to_destination = self._plain_destination(student_name, components[-1])
+                        if path_to_destination is None:
+                            continue
+
+                    os.makedirs(os.path.dirname(path_to_destination), exist_ok=True)
+                    if self.content_store is not None:
+                        with f.open(info) as src:
+                            self.content_store.put_stream(src, path_to_destination)
+                        continue
+                    with f.open(info) as src, open(path_to_destination, 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+        except Exception as err:
+            logging.warning("{} could not be processed".format(path_to_archive))
+            self.failed_targets[path_to_archive] = '{}: {}'.format(type(err).__name__, err)
+            return False
+
+        return correct_format
+
+    def _filter_all(self, on_filtered: Optional[Callable[[str], None]] = None):
         """Apply filters to submission
+
+        Args:
+            on_filtered (Optional[Callable[[str], None]], optional): called with the name of each student once
+                their files are in the output directory. Defaults to None.
         """
-        pbar = tqdm(self.target_mapping.keys())
+        names: List[str] = [name for name in self.target_mapping.keys() if not self.incremental or name in self.dirty_targets]
+        from tqdm import tqdm
+        pbar = tqdm(names)
         for name in pbar:
             pbar.set_description('Processing {}'.format(name))
-            for target in self.target_mapping[name]:
-                if os.path.isdir(target):
-                    self._filter_process_dir(name, target)
-                else:
-                    # For students who submitted seperated files, prefix must be removed
-                    self._filter_process_plain(
-                        name, target, remove_prefix=True)
+            start = time.perf_counter()
+            with self.tracer.span('copy', name, 'filter') as span:
+                span['files'] = len(self.target_mapping[name])
+                if self.content_store is not None:
+                    self.content_store.reset(name)
+                for target in self.target_mapping[name]:
+                    if os.path.isdir(target):
+                        self._filter_process_dir(name, target)
+                    elif self.stream_extract and os.path.splitext(target)[-1] in ['.rar', '.zip']:
+                        self._filter_process_archive(name, target)
+                    else:
+                        # For students who submitted seperated files, prefix must be removed
+                        self._filter_process_plain(
+                            name, target, remove_prefix=True)
+                if self.content_store is not None:
+                    self.content_store.save(name)
+            self.filter_time[name] = time.perf_counter() - start
+            if on_filtered is not None:
+                on_filtered(name)
+
+    def _save_results(self):
+        """Record the students processed by this run in the result store, with the files that could not be processed
+        """
+        store = ResultStore(self.output_dir)
+        if self.incremental:
+            store.remove('filter', [name for name in store.students('filter') if name not in self.manifest])
+        else:
+            store.remove('filter')
+        failures: Dict[str, List[str]] = dict()
+        for target in self.failed_targets:
+            failures.setdefault(self._extract_name(os.path.basename(target)), list()).append('{}\n{}'.format(target, self.failed_targets[target]))
+        for name in sorted(set(self.dirty_targets) | set(failures.keys())):
+            store.put(name, 'filter', int(name in failures), '\n'.join(failures.get(name, [])), self.filter_time.get(name, 0.0))
+            store.put_metrics(name, 'filter', self._filter_metrics(name, len(failures.get(name, []))))
+        store.close()
+
+    def _filter_metrics(self, student_name: str, failures: int) -> Dict[str, float]:
+        """Collect the metrics of the filter for a student
+
+        Args:
+            student_name (str): student's name 5xxxxxxxxxxxNAME
+            failures (int): number of submitted files that could not be processed
 
-    def run(self):
+        Returns:
+            Dict[str, float]: wall time, number of submitted files, number and size of the kept files, failures
+        """
+        files, size = 0, 0
+        for dirpath, _, filenames in os.walk(os.path.join(self.output_dir, student_name)):
+            for filename in filenames:
+                files += 1
+                size += os.path.getsize(os.path.join(dirpath, filename))
+        return {'time': self.filter_time.get(student_name, 0.0),
+                'submitted_files': len(self.target_mapping.get(student_name, [])),
+                'kept_files': files,
+                'kept_bytes': size,
+                'failures': failures}
+
+    def run(self, on_filtered: Optional[Callable[[str], None]] = None):
         """Run the filter
+
+        Args:
+            on_filtered (Optional[Callable[[str], None]], optional): called with the name of each student once
+                their files are in the output directory, e.g. to start their build. Defaults to None.
         """
         self._create_output_dir()
-        self._preprocess()
+        with self.tracer.span('scan'):
+            if self.incremental:
+                self._scan_submission()
+            else:
+                self.dirty_targets = sorted(set([self._extract_name(f) for f in os.listdir(self.submission_dir) if not f.startswith('.')]))
+        if not self.stream_extract:
+            with self.tracer.span('extract'):
+                self._preprocess()
         self._map_submission()
         self._create_alldir()
-        self._filter_all()
+        with self.tracer.span('copy'):
+            self._filter_all(on_filtered)
+        with self.tracer.span('save results'):
+            if self.incremental:
+                self._save_manifest()
+            self._save_results()
+            if self.content_store is not None:
+                self.content_store.collect()
         logging.info("The unprocessed files are:")
         for target_name in self.failed_targets:
             print('>', target_name)
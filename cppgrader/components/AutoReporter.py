@@ -1,65 +1,267 @@
+import csv
 import datetime
-from typing import Dict, Tuple
+import html
+import json
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
 import uuid
 import os
 import logging
-import coloredlogs
+
+from .AutoTester import TestResult
+from .Tracer import Tracer
 
 logger = logging.getLogger(__name__)
-coloredlogs.install(level='DEBUG')
+
+HTML_HEADER = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Grader report</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+td, th {{ border: 1px solid #ccc; padding: 2px 8px; }}
+.fail {{ color: #b00; }}
+pre {{ background: #f6f6f6; padding: 8px; overflow-x: auto; }}
+summary {{ cursor: pointer; }}
+</style>
+</head>
+<body>
+<h1>Grader report</h1>
+<p>Time: {}<br>Total Submissions: {}</p>
+'''
+
+# Columns of the metrics report, per stage
+METRICS_COLUMNS = [('filter', ['status', 'time', 'submitted_files', 'kept_files', 'kept_bytes', 'failures']),
+                   ('build', ['status', 'time', 'configure_time', 'compile_time', 'link_time', 'warnings', 'errors', 'binary_size']),
+                   ('test', ['passed', 'cases'])]
+
+
+def fold_log(output: str, limit: int) -> str:
+    """Fold the middle of a log longer than limit characters, the head (where the first error usually is) and
+    the tail are kept
+
+    Args:
+        output (str): log
+        limit (int): maximum number of characters kept, 0 for no limit
+
+    Returns:
+        str: folded log
+    """
+    if limit <= 0 or len(output) <= limit:
+        return output
+    head = output[:limit * 3 // 4]
+    tail = output[len(output) - limit // 4:]
+    return '{}\n[ {} characters folded ]\n{}'.format(head, len(output) - len(head) - len(tail), tail)
+
+
 class AutoReporter:
     """Creating a report
+
+    Sections are written one student at a time, the compiler output of a student is read only when it is
+    written, so that the report of a large class never has to be held in memory.
     """
 
-    def __init__(self, args):
+    def __init__(self, args, tracer: Optional[Tracer] = None):
         self.unique_id = str(uuid.uuid1()).split('-')[0]
         self.report_md_path = os.path.join(os.getcwd(), args.report_name + '-' + self.unique_id + '.md')
         self.report_csv_path = os.path.join(os.getcwd(), args.report_name + '-' + self.unique_id + '.csv')
+        self.report_html_path = os.path.join(os.getcwd(), args.report_name + '-' + self.unique_id + '.html')
+        self.report_jsonl_path = os.path.join(os.getcwd(), args.report_name + '-' + self.unique_id + '.jsonl')
+        self.report_metrics_path = os.path.join(os.getcwd(), args.report_name + '-' + self.unique_id + '-metrics.csv')
+        self.formats: List[str] = args.report_formats.split(',')
+        # Longer compiler outputs are folded, in characters
+        self.max_log_size: int = args.max_log_size * 1024
+        self._task_names: List[str] = list()
+        self._error_index: List[Dict] = list()
+        self._statuses: Dict[str, int] = dict()
+        # Spans of each report
+        self.tracer: Tracer = tracer if tracer is not None else Tracer()
+
+    @staticmethod
+    def _read_statuses(compiler_output: Mapping[str, Tuple[int, str]]) -> Dict[str, int]:
+        # Result store views read the statuses without the outputs
+        if hasattr(compiler_output, 'statuses'):
+            return compiler_output.statuses()
+        return {task_name: compiler_output[task_name][0] for task_name in compiler_output}
 
-    def _gen_markdown(self, failed_targets: Dict[str, str], compiler_output: Dict[str, Tuple[int, str]]):
+    def _gen_markdown(self, failed_targets: Dict[str, str], compiler_output: Mapping[str, Tuple[int, str]], build_time: Optional[Dict[str, float]] = None, test_results: Optional[Dict[str, List[TestResult]]] = None):
         """Generate markdown file
 
         Args:
             failed_targets (Dict[str, str]): Failed targets
-            compiler_output (Dict[str, Tuple[int, str]]): Compiler output
+            compiler_output (Mapping[str, Tuple[int, str]]): Compiler output
+            build_time (Optional[Dict[str, float]], optional): Wall time of each build. Defaults to None.
+            test_results (Optional[Dict[str, List[TestResult]]], optional): Results of test cases. Defaults to None.
 
         """
+        build_time = build_time if build_time is not None else dict()
         logging.info("[ Info ] Generating report at {}".format(self.report_md_path))
         with open(self.report_md_path, 'w') as f:
             f.writelines(['# Grader report\n\n',
                           'Time: {}\n'.format(
                               datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
                           'Total Submissions: {}\n'.format(
-                              len(compiler_output.keys())),
+                              len(self._task_names)),
                           '\n## Unprocessed submissions:\n\n'])
-            f.writelines(['**{}**\n\n```\n{}\n```\n\n'.format(target,
-                                                              failed_targets[target]) for target in failed_targets.keys()])
+            for target in failed_targets.keys():
+                f.write('**{}**\n\n```\n{}\n```\n\n'.format(target, failed_targets[target]))
             f.writelines(['\n## Compiler summary\n\n'])
-            f.writelines(['|  name  |  status  |\n', '| ------ | ------- |\n'])
-            f.writelines(['| **{}** |    {}    |\n'.format(task_name, str(
-                compiler_output[task_name][0] == 0)) for task_name in sorted(compiler_output.keys())])
+            f.writelines(['|  name  |  status  |  time(s)  |\n', '| ------ | ------- | ------- |\n'])
+            for task_name in self._task_names:
+                f.write('| **{}** |    {}    |    {}    |\n'.format(task_name, str(self._statuses[task_name] == 0),
+                                                                  '{:.2f}'.format(build_time[task_name]) if task_name in build_time else '-'))
+            if test_results:
+                f.writelines(['\n## Test summary\n\n'])
+                f.writelines(['|  name  |  passed  |  cases  |\n', '| ------ | ------- | ------- |\n'])
+                for task_name in sorted(test_results.keys()):
+                    f.write('| **{}** |    {}/{}    |    {}    |\n'.format(task_name, sum([r.status == 'PASS' for r in test_results[task_name]]), len(test_results[task_name]),
+                                                                         ' '.join(['{}:{}({:.2f}s)'.format(r.case, r.status, r.time) for r in test_results[task_name]])))
+            if self._error_index:
+                f.writelines(['\n## Common errors\n\n'])
+                f.writelines(['|  students  |  error  |  affected  |\n', '| ------ | ------- | ------- |\n'])
+                for entry in self._error_index:
+                    f.write('| {} | `{}` | {} |\n'.format(len(entry['students']), entry['message'].replace('|', '\\|').replace('`', "'"), ' '.join(entry['students'])))
             f.writelines(['\n## Compiler output\n\n'])
-            f.writelines(['**{}**: {}\n\n```\n{}\n```\n\n'.format(task_name, str(compiler_output[task_name]
-                                                                                 [0] == 0), compiler_output[task_name][1]) for task_name in sorted(compiler_output.keys())])
+            for task_name in self._task_names:
+                retcode, output = compiler_output[task_name]
+                f.writelines(['**{}**: {}\n\n```\n'.format(task_name, str(retcode == 0)), fold_log(output, self.max_log_size), '\n```\n\n'])
 
-    def _gen_csv(self, failed_targets: Dict[str, str], compiler_output: Dict[str, Tuple[int, str]]):
+    def _gen_html(self, failed_targets: Dict[str, str], compiler_output: Mapping[str, Tuple[int, str]], build_time: Optional[Dict[str, float]] = None, test_results: Optional[Dict[str, List[TestResult]]] = None):
+        """Generate HTML report, the output of each student is a collapsed section
+
+        Args:
+            failed_targets (Dict[str, str]): Failed targets
+            compiler_output (Mapping[str, Tuple[int, str]]): Compiler output
+            build_time (Optional[Dict[str, float]], optional): Wall time of each build. Defaults to None.
+            test_results (Optional[Dict[str, List[TestResult]]], optional): Results of test cases. Defaults to None.
+        """
+        build_time = build_time if build_time is not None else dict()
+        test_results = test_results if test_results is not None else dict()
+        logging.info("[ Info ] Generating report(html) at {}".format(self.report_html_path))
+        with open(self.report_html_path, 'w', encoding='UTF-8') as f:
+            f.write(HTML_HEADER.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), len(self._task_names)))
+            f.write('<h2>Unprocessed submissions</h2>\n')
+            for target in failed_targets.keys():
+                f.write('<details><summary class="fail">{}</summary><pre>{}</pre></details>\n'.format(html.escape(target), html.escape(failed_targets[target])))
+            f.write('<h2>Summary</h2>\n<table>\n<tr><th>name</th><th>status</th><th>time(s)</th>{}</tr>\n'.format('<th>passed</th>' if test_results else ''))
+            for task_name in self._task_names:
+                passed = ''
+                if test_results:
+                    results = test_results.get(task_name, [])
+                    passed = '<td>{}/{}</td>'.format(sum([r.status == 'PASS' for r in results]), len(results))
+                f.write('<tr><td><a href="#{0}">{0}</a></td><td class="{1}">{2}</td><td>{3}</td>{4}</tr>\n'.format(
+                    html.escape(task_name), '' if self._statuses[task_name] == 0 else 'fail', str(self._statuses[task_name] == 0),
+                    '{:.2f}'.format(build_time[task_name]) if task_name in build_time else '-', passed))
+            f.write('</table>\n')
+            if self._error_index:
+                f.write('<h2>Common errors</h2>\n<table>\n<tr><th>students</th><th>error</th></tr>\n')
+                for entry in self._error_index:
+                    f.write('<tr><td>{}</td><td><details><summary><code>{}</code></summary>{}</details></td></tr>\n'.format(
+                        len(entry['students']), html.escape(entry['message']),
+                        ' '.join(['<a href="#{0}">{0}</a>'.format(html.escape(student)) for student in entry['students']])))
+                f.write('</table>\n')
+            f.write('<h2>Compiler output</h2>\n')
+            for task_name in self._task_names:
+                retcode, output = compiler_output[task_name]
+                f.writelines(['<details id="{}"><summary class="{}">{}: {}</summary>'.format(html.escape(task_name), '' if retcode == 0 else 'fail', html.escape(task_name), str(retcode == 0)),
+                              '<pre>', html.escape(fold_log(output, self.max_log_size)), '</pre>'])
+                if task_name in test_results:
+                    f.write('<p>{}</p>'.format(' '.join(['{}:{}({:.2f}s)'.format(html.escape(r.case), r.status, r.time) for r in test_results[task_name]])))
+                f.write('</details>\n')
+            f.write('</body>\n</html>\n')
+
+    def _gen_csv(self, failed_targets: Dict[str, str], compiler_output: Mapping[str, Tuple[int, str]], build_time: Optional[Dict[str, float]] = None, test_results: Optional[Dict[str, List[TestResult]]] = None):
         """Generate CSV report
 
         Args:
             failed_targets (Dict[str, str]): Failed targets
-            compiler_output (Dict[str, Tuple[int, str]]): Compiler output
+            compiler_output (Mapping[str, Tuple[int, str]]): Compiler output
+            test_results (Optional[Dict[str, List[TestResult]]], optional): Results of test cases, add passed and cases columns. Defaults to None.
         """
         logging.info("[ Info ] Generating report(csv) at {}".format(self.report_csv_path))
         with open(self.report_csv_path, 'w') as f:
-            f.writelines(['name,status,\n'])
-            f.writelines(['{},{},\n'.format(task_name, int(compiler_output[task_name][0] == 0)) for task_name in sorted(compiler_output.keys())])
+            if test_results:
+                f.writelines(['name,status,passed,cases,\n'])
+                f.writelines(['{},{},{},{},\n'.format(task_name, int(self._statuses[task_name] == 0),
+                                                     sum([r.status == 'PASS' for r in test_results.get(task_name, [])]), len(test_results.get(task_name, []))) for task_name in self._task_names])
+            else:
+                f.writelines(['name,status,\n'])
+                f.writelines(['{},{},\n'.format(task_name, int(self._statuses[task_name] == 0)) for task_name in self._task_names])
+
+    def _records(self, failed_targets: Dict[str, str], build_time: Dict[str, float], test_results: Dict[str, List[TestResult]], metrics: Dict[str, Dict[str, Dict[str, float]]]) -> Iterator[Dict]:
+        """Yield the record of every student, with the metrics of every stage. Compiler outputs are not read
+
+        Yields:
+            Dict: {name, filter: {status, metrics...}, build: {status, time, metrics...}, test: {passed, cases, results}}
+        """
+        for task_name in sorted(set(self._task_names) | set(failed_targets.keys())):
+            record: Dict = {'name': task_name}
+            student_metrics = metrics.get(task_name, dict())
+            record['filter'] = dict(status=int(task_name not in failed_targets), **student_metrics.get('filter', dict()))
+            if task_name in self._statuses:
+                record['build'] = dict(status=int(self._statuses[task_name] == 0), time=build_time.get(task_name), **student_metrics.get('build', dict()))
+            if task_name in test_results:
+                results = test_results[task_name]
+                record['test'] = {'passed': sum([r.status == 'PASS' for r in results]), 'cases': len(results),
+                                  'results': [{'case': r.case, 'status': r.status, 'time': r.time} for r in results]}
+            yield record
+
+    def _gen_jsonl(self, records: List[Dict]):
+        """Generate JSON Lines report, one student per line
+
+        Args:
+            records (List[Dict]): records of the students
+        """
+        logging.info("[ Info ] Generating report(jsonl) at {}".format(self.report_jsonl_path))
+        with open(self.report_jsonl_path, 'w', encoding='UTF-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    def _gen_metrics_csv(self, records: List[Dict]):
+        """Generate CSV report with one column per metric, empty if the stage did not run
+
+        Args:
+            records (List[Dict]): records of the students
+        """
+        logging.info("[ Info ] Generating report(metrics csv) at {}".format(self.report_metrics_path))
+        with open(self.report_metrics_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name'] + ['{}_{}'.format(stage, column) for stage, columns in METRICS_COLUMNS for column in columns])
+            for record in records:
+                writer.writerow([record['name']] + [record.get(stage, dict()).get(column, '') for stage, columns in METRICS_COLUMNS for column in columns])
+
+    def run(self, failed_targets: Dict[str, str], compiler_output: Mapping[str, Tuple[int, str]], build_time: Optional[Dict[str, float]] = None, test_results: Optional[Dict[str, List[TestResult]]] = None, metrics: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None, error_index: Optional[List[Dict]] = None):
+        # Sorted once for every report
+        self._statuses = self._read_statuses(compiler_output)
+        self._task_names = sorted(self._statuses.keys())
+        # Errors shared by the most students, printed once
+        self._error_index = error_index if error_index is not None else list()
 
-    def run(self, *args, **kwargs):
         # Generate Markdown report
-        self._gen_markdown(*args, **kwargs)
+        if 'md' in self.formats:
+            with self.tracer.span('markdown'):
+                self._gen_markdown(failed_targets, compiler_output, build_time, test_results)
 
         # Generate CSV report
-        self._gen_csv(*args, **kwargs)
+        if 'csv' in self.formats:
+            with self.tracer.span('csv'):
+                self._gen_csv(failed_targets, compiler_output, build_time, test_results)
+
+        # Generate HTML report
+        if 'html' in self.formats:
+            with self.tracer.span('html'):
+                self._gen_html(failed_targets, compiler_output, build_time, test_results)
+
+        # Generate machine-readable reports
+        if 'jsonl' in self.formats or 'metrics' in self.formats:
+            records = list(self._records(failed_targets, build_time or dict(), test_results or dict(), metrics or dict()))
+            if 'jsonl' in self.formats:
+                with self.tracer.span('jsonl'):
+                    self._gen_jsonl(records)
+            if 'metrics' in self.formats:
+                with self.tracer.span('metrics'):
+                    self._gen_metrics_csv(records)
 
-    def __call__(self, failed_targets: Dict[str, str], compiler_output: Dict[str, Tuple[int, str]]):
-        self.run(failed_targets, compiler_output)
+    def __call__(self, failed_targets: Dict[str, str], compiler_output: Mapping[str, Tuple[int, str]], build_time: Optional[Dict[str, float]] = None, test_results: Optional[Dict[str, List[TestResult]]] = None, metrics: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None, error_index: Optional[List[Dict]] = None):
+        self.run(failed_targets, compiler_output, build_time, test_results, metrics, error_index)
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import signal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import logging
+
+from .ResultStore import ResultStore
+from .TaskRunner import TaskRunner, limit_resources
+
+
+class TestResult(NamedTuple):
+    """Result of a test case
+    """
+    case: str  # Name of the case, without extension
+    status: str  # PASS | FAIL | TLE | RE | NOEXEC
+    time: float  # Wall time in seconds
+
+
+def compare_output(output: str, expected: str) -> bool:
+    """Compare the output of a program with the expected output, trailing whitespaces and blank lines are ignored
+
+    Args:
+        output (str): Output of the program
+        expected (str): Expected output
+
+    Returns:
+        bool: True if the outputs match
+    """
+    def normalize(text: str) -> List[str]:
+        return [line.rstrip() for line in text.rstrip().splitlines()]
+
+    return normalize(output) == normalize(expected)
+
+
+class AutoTester:
+    """Run built executables against test cases
+
+    The test directory contains pairs of input/expected output:
+    Test directory
+    ├── 1.in
+    ├── 1.out
+    ├── ...
+    └── ...
+    """
+
+    def __init__(self, args):
+        self.task_dir: str = os.path.abspath(args.output_dir)
+        self.test_dir: Optional[str] = args.test_dir
+        self.executable_name: str = args.executable
+        self.timeout: float = args.timeout  # Wall time limit per case in seconds
+        self.cpu_limit: int = args.cpu_limit if args.cpu_limit is not None else max(1, int(args.timeout))  # seconds
+        self.memory_limit: int = args.memory_limit  # MB
+        self.jobs: int = max(1, args.jobs)
+        self.runner: TaskRunner = TaskRunner(self.jobs, self.timeout, args.output_limit * 1024)
+        self.task_list: List[str] = list()
+        self.case_list: List[str] = list()
+        # task_name -> [TestResult] mapping
+        self.test_results: Dict[str, List[TestResult]] = dict()
+        # Results are written to the store as soon as a case finishes
+        self.store: ResultStore = ResultStore(self.task_dir)
+        # Only run the cases that have no result yet
+        self.resume: bool = args.resume
+
+    @staticmethod
+    def load_results(store: ResultStore) -> Dict[str, List[TestResult]]:
+        """Read the results of the last run from the store
+
+        Args:
+            store (ResultStore): result store
+
+        Returns:
+            Dict[str, List[TestResult]]: task_name -> [TestResult] mapping
+        """
+        return {task_name: [TestResult(*case) for case in cases] for task_name, cases in store.cases().items()}
+
+    def _list_tasks(self):
+        """List the output directory for built tasks
+        """
+        self.task_list = sorted([f for f in os.listdir(self.task_dir) if not f.startswith('.')])
+
+    def _list_cases(self):
+        """List the test cases that have both .in and .out files
+        """
+        content_list = os.listdir(self.test_dir)
+        self.case_list = sorted([os.path.splitext(f)[0] for f in content_list
+                                 if f.endswith('.in') and os.path.splitext(f)[0] + '.out' in content_list])
+
+    def _set_limits(self):
+        """Set resource limits, runs in the child process before exec
+        """
+        limit_resources(self.cpu_limit, self.memory_limit)
+
+    async def _run_case(self, task_name: str, case: str) -> TestResult:
+        """Run the executable of a task against a test case
+
+        Args:
+            task_name (str): name of the task 5xxxxxxxxxxxNAME
+            case (str): name of the case
+
+        Returns:
+            TestResult: Result
+        """
+        path_to_task = os.path.join(self.task_dir, task_name)
+        path_to_exe = os.path.join(path_to_task, self.executable_name)
+        if not os.access(path_to_exe, os.X_OK):
+            return TestResult(case, 'NOEXEC', 0.0)
+
+        with open(os.path.join(self.test_dir, case + '.in'), 'rb') as stdin:
+            ret = await self.runner.run([path_to_exe], cwd=path_to_task, stdin=stdin, preexec_fn=self._set_limits)
+
+        if ret.timed_out or ret.retcode == -signal.SIGXCPU or ret.retcode == -signal.SIGKILL:
+            return TestResult(case, 'TLE', ret.elapsed)
+        if ret.retcode != 0:
+            return TestResult(case, 'RE', ret.elapsed)
+        with open(os.path.join(self.test_dir, case + '.out'), 'r', encoding='UTF-8', errors='replace') as f:
+            expected = f.read()
+        if ret.truncated == 0 and compare_output(str(ret.stdout, encoding='UTF-8', errors='replace'), expected):
+            return TestResult(case, 'PASS', ret.elapsed)
+        return TestResult(case, 'FAIL', ret.elapsed)
+
+    async def _run_all(self, cases_to_run: List[Tuple[str, str]]):
+        """Run cases, self.jobs processes are running at the same time. Each result is written to the store
+        when the case finishes
+
+        Args:
+            cases_to_run (List[Tuple[str, str]]): (task_name, case) pairs
+        """
+        async def run_case(task_name: str, case: str) -> str:
+            result = await self._run_case(task_name, case)
+            self.store.put_case(task_name, result.case, result.status, result.time)
+            return task_name
+
+        from tqdm import tqdm
+        with tqdm(total=len(cases_to_run)) as pbar:
+            for future in asyncio.as_completed([run_case(task_name, case) for task_name, case in cases_to_run]):
+                pbar.set_description('Tested {}'.format(await future))
+                pbar.update()
+
+    def run(self):
+        """Run tester
+        """
+        if self.test_dir is None or not os.path.isdir(self.test_dir):
+            logging.info('No test directory, skip testing')
+            return
+        self._list_tasks()
+        self._list_cases()
+        if not self.resume:
+            self.store.remove('test')
+        # Results of submissions or cases that do not exist anymore
+        previous_results = self.load_results(self.store)
+        self.store.remove('test', [task_name for task_name in previous_results if task_name not in self.task_list])
+        done = set([(task_name, result.case) for task_name in previous_results for result in previous_results[task_name]])
+        cases_to_run = [(task_name, case) for task_name in self.task_list for case in self.case_list if (task_name, case) not in done]
+        logging.info('Testing {} submissions against {} cases, {} runs'.format(len(self.task_list), len(self.case_list), len(cases_to_run)))
+        asyncio.run(self._run_all(cases_to_run))
+
+        results = self.load_results(self.store)
+        for task_name in self.task_list:
+            self.test_results[task_name] = [result for result in results.get(task_name, []) if result.case in self.case_list]
+            passed = sum([result.status == 'PASS' for result in self.test_results[task_name]])
+            self.store.put(task_name, 'test', int(passed != len(self.test_results[task_name])),
+                           '{}/{} passed'.format(passed, len(self.test_results[task_name])),
+                           sum([result.time for result in self.test_results[task_name]]))
+
+    def __call__(self):
+        self.run()
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from .common import STATE_DIR_NAME, hash_file, is_source, replace_file
+from .ContentStore import ContentStore
+
+IGNORED_DIRS: List[str] = ['CMakeFiles']
+# Files generated (or overwritten) by an in-source CMake configure
+CMAKE_GENERATED: List[str] = ['Makefile', 'cmake_install.cmake', 'CTestTestfile.cmake']
+
+
+class BuildCache:
+    """Content-addressed cache of build results
+
+    The cache lives in <output_dir>/.cppgrader/build_cache:
+    ├── index.json   key -> {retcode, artifacts, size, last_used}
+    └── <key>
+        ├── output.log
+        └── <artifacts>
+    """
+    index_name: str = 'index.json'
+
+    def __init__(self, path_to_output: str, size_limit: int = 1024, content_store: Optional[ContentStore] = None):
+        """
+        Args:
+            path_to_output (str): output directory
+            size_limit (int, optional): maximum size of the cache in MB. Defaults to 1024.
+            content_store (Optional[ContentStore], optional): digests of the files materialized by the filter, reused instead of hashing the files again. Defaults to None.
+        """
+        self.cache_dir: str = os.path.join(path_to_output, STATE_DIR_NAME, 'build_cache')
+        self.size_limit: int = size_limit * 1024 * 1024
+        self.content_store: Optional[ContentStore] = content_store
+        self.index: Dict[str, Dict] = dict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Load the index, a broken index is discarded
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path_to_index = os.path.join(self.cache_dir, self.index_name)
+        if os.path.exists(path_to_index):
+            try:
+                with open(path_to_index, 'r') as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                logging.warning('Build cache index {} is broken, discard'.format(path_to_index))
+                self.index = dict()
+
+    @staticmethod
+    def _is_source(filename: str) -> bool:
+        return is_source(filename)
+
+    @staticmethod
+    def _walk(path_to_task: str):
+        """Walk the task directory, skipping hidden and CMake generated directories
+
+        Yields:
+            Tuple[str, str]: relative path and absolute path of files
+        """
+        for dirpath, dirnames, filenames in os.walk(path_to_task):
+            dirnames[:] = sorted([d for d in dirnames if not d.startswith('.') and d not in IGNORED_DIRS])
+            for filename in sorted(filenames):
+                if not filename.startswith('.'):
+                    path_to_file = os.path.join(dirpath, filename)
+                    yield os.path.relpath(path_to_file, path_to_task), path_to_file
+
+    def fingerprint(self, path_to_task: str, build_command: str, toolchain: str) -> str:
+        """Compute the cache key of a task
+
+        Args:
+            path_to_task (str): path to the task directory
+            build_command (str): effective build command
+            toolchain (str): compiler version
+
+        Returns:
+            str: hex digest
+        """
+        hasher = hashlib.sha1()
+        hasher.update(build_command.encode('UTF-8') + b'\0')
+        hasher.update(toolchain.encode('UTF-8') + b'\0')
+        for relpath, path_to_file in self._walk(path_to_task):
+            filename = os.path.basename(relpath)
+            if filename in CMAKE_GENERATED and os.path.exists(os.path.join(os.path.dirname(path_to_file), 'CMakeLists.txt')):
+                continue
+            if self._is_source(filename):
+                digest = self.content_store.digest(path_to_file) if self.content_store is not None else None
+                if digest is None:
+                    digest = hash_file(path_to_file).hexdigest()
+                hasher.update(relpath.encode('UTF-8') + b'\0')
+                hasher.update(digest.encode('UTF-8') + b'\0')
+        return hasher.hexdigest()
+
+    def get(self, key: str, path_to_task: str) -> Optional[Tuple[int, str]]:
+        """Look up the cache, restore artifacts to the task directory on hit
+
+        Args:
+            key (str): cache key
+            path_to_task (str): path to the task directory
+
+        Returns:
+            Optional[Tuple[int, str]]: (retcode, output) on hit, None on miss
+        """
+        with self._lock:
+            entry = self.index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry['last_used'] = time.time()
+        path_to_entry = os.path.join(self.cache_dir, key)
+        try:
+            for relpath in entry['artifacts']:
+                os.makedirs(os.path.dirname(os.path.join(path_to_task, relpath)), exist_ok=True)
+                # The executable of the submission may be a hardlink of the content store
+                replace_file(os.path.join(path_to_entry, relpath), os.path.join(path_to_task, relpath))
+            with open(os.path.join(path_to_entry, 'output.log'), 'r', encoding='UTF-8') as f:
+                output = f.read()
+        except OSError:
+            # The entry is damaged, treat as a miss
+            with self._lock:
+                self.index.pop(key, None)
+                self.misses += 1
+            shutil.rmtree(path_to_entry, ignore_errors=True)
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry['retcode'], output
+
+    def list_artifacts(self, path_to_task: str, since: float) -> List[str]:
+        """List executables produced by a build
+
+        Args:
+            path_to_task (str): path to the task directory
+            since (float): timestamp of the beginning of the build
+
+        Returns:
+            List[str]: relative paths of executables modified after since
+        """
+        artifacts: List[str] = list()
+        for relpath, path_to_file in self._walk(path_to_task):
+            if self._is_source(os.path.basename(relpath)):
+                continue
+            stat = os.stat(path_to_file)
+            if stat.st_mtime >= since and os.access(path_to_file, os.X_OK):
+                artifacts.append(relpath)
+        return artifacts
+
+    def put(self, key: str, path_to_task: str, retcode: int, output: str, since: float, produced: Optional[List[str]] = None):
+        """Store the result of a build
+
+        Args:
+            key (str): cache key
+            path_to_task (str): path to the task directory
+            retcode (int): return code of the build
+            output (str): compiler output
+            since (float): timestamp of the beginning of the build
+            produced (Optional[List[str]], optional): relative paths of the executables the builder knows it wrote,
+                e.g. copied from an out of source build directory with their original mtime. They are stored along
+                with the executables modified after since. Defaults to None.
+        """
+        path_to_entry = os.path.join(self.cache_dir, key)
+        shutil.rmtree(path_to_entry, ignore_errors=True)
+        os.makedirs(path_to_entry)
+        artifacts = self.list_artifacts(path_to_task, since)
+        for relpath in produced if produced is not None else []:
+            if relpath not in artifacts and os.path.isfile(os.path.join(path_to_task, relpath)):
+                artifacts.append(relpath)
+        size = 0
+        for relpath in artifacts:
+            os.makedirs(os.path.dirname(os.path.join(path_to_entry, relpath)), exist_ok=True)
+            shutil.copy2(os.path.join(path_to_task, relpath), os.path.join(path_to_entry, relpath))
+            size += os.path.getsize(os.path.join(path_to_entry, relpath))
+        with open(os.path.join(path_to_entry, 'output.log'), 'w', encoding='UTF-8') as f:
+            f.write(output)
+        size += os.path.getsize(os.path.join(path_to_entry, 'output.log'))
+
+        with self._lock:
+            self.index[key] = {'retcode': retcode, 'artifacts': artifacts, 'size': size, 'last_used': time.time()}
+            self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in size_limit, must be called with the lock held
+        """
+        total = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index.keys(), key=lambda k: self.index[k]['last_used']):
+            if total <= self.size_limit:
+                break
+            total -= self.index.pop(key)['size']
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def save(self):
+        """Write the index to disk
+        """
+        with self._lock:
+            path_to_index = os.path.join(self.cache_dir, self.index_name)
+            with open(path_to_index + '.tmp', 'w') as f:
+                json.dump(self.index, f)
+            os.replace(path_to_index + '.tmp', path_to_index)
+        logging.info('Build cache: {} hits, {} misses'.format(self.hits, self.misses))
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import Optional
+import logging
+
+from .common import STATE_DIR_NAME
+
+# Entries of CMakeCache.txt that belong to the seed project, not to the toolchain
+PROJECT_ENTRIES = ['CMAKE_CACHEFILE_DIR', 'CMAKE_HOME_DIRECTORY', 'CMAKE_PROJECT_', 'CMAKE_FIND_PACKAGE_REDIRECTS_DIR']
+
+
+class CMakeSeed:
+    """Configure an empty project once per toolchain and generator, and seed the build directory of every
+    submission with the result, so that compiler identification and try-compile checks do not run again
+    for each student. The seeds live in <output_dir>/.cppgrader/cmake_seed/<key>:
+    ├── CMakeCache.txt  Toolchain entries only
+    └── CMakeFiles
+        └── <cmake version>
+    """
+
+    def __init__(self, path_to_output: str, generator: Optional[str] = None):
+        """
+        Args:
+            path_to_output (str): output directory
+            generator (Optional[str], optional): CMake generator. Defaults to None (CMake's default).
+        """
+        self.seed_root: str = os.path.join(path_to_output, STATE_DIR_NAME, 'cmake_seed')
+        self.generator: Optional[str] = generator
+        self.path_to_seed: Optional[str] = None
+        self._lock = threading.Lock()
+        self._prepared: bool = False
+
+    def _generator_args(self):
+        return ['-G', self.generator] if self.generator is not None else []
+
+    def prepare(self, toolchain: str):
+        """Configure the seed project if it does not exist yet. Thread safe, the seed is built once
+
+        Args:
+            toolchain (str): compiler version
+        """
+        with self._lock:
+            if self._prepared:
+                return
+            self._prepared = True
+            try:
+                ret = subprocess.run(['cmake', '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            except OSError:
+                logging.warning('cmake not found, configure results are not cached')
+                return
+            # CMake picks the compilers from CC and CXX
+            key = hashlib.sha1('\0'.join([toolchain, str(ret.stdout, encoding='UTF-8', errors='replace'), self.generator or '',
+                                          os.environ.get('CC', ''), os.environ.get('CXX', '')]).encode('UTF-8')).hexdigest()
+            path_to_seed = os.path.join(self.seed_root, key)
+            if os.path.exists(os.path.join(path_to_seed, 'CMakeCache.txt')):
+                self.path_to_seed = path_to_seed
+                return
+
+            with tempfile.TemporaryDirectory() as tmp:
+                path_to_source = os.path.join(tmp, 'src')
+                path_to_build = os.path.join(tmp, 'build')
+                os.mkdir(path_to_source)
+                with open(os.path.join(path_to_source, 'CMakeLists.txt'), 'w') as f:
+                    f.write('cmake_minimum_required(VERSION 3.5)\nproject(seed C CXX)\n')
+                ret = subprocess.run(['cmake', '-S', path_to_source, '-B', path_to_build] + self._generator_args(),
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                if ret.returncode != 0:
+                    logging.warning('Could not configure the CMake seed project, configure results are not cached')
+                    return
+
+                os.makedirs(os.path.join(path_to_seed, 'CMakeFiles'), exist_ok=True)
+                path_to_cmake_files = os.path.join(path_to_build, 'CMakeFiles')
+                for name in os.listdir(path_to_cmake_files):
+                    # CMakeFiles/<cmake version> holds the compiler identification and the ABI checks
+                    if name[0].isdigit() and os.path.isdir(os.path.join(path_to_cmake_files, name)):
+                        shutil.copytree(os.path.join(path_to_cmake_files, name), os.path.join(path_to_seed, 'CMakeFiles', name))
+                with open(os.path.join(path_to_build, 'CMakeCache.txt'), 'r') as f:
+                    entries = [line for line in f.readlines()
+                               if line.startswith('CMAKE_') and not any([line.startswith(prefix) for prefix in PROJECT_ENTRIES])]
+                with open(os.path.join(path_to_seed, 'CMakeCache.txt'), 'w') as f:
+                    f.writelines(entries)
+            logging.info('Configured CMake seed in {}'.format(path_to_seed))
+            self.path_to_seed = path_to_seed
+
+    def apply(self, path_to_build: str):
+        """Seed a build directory that was never configured
+
+        Args:
+            path_to_build (str): path to the build directory
+        """
+        if self.path_to_seed is None or os.path.exists(os.path.join(path_to_build, 'CMakeCache.txt')):
+            return
+        # Leftovers of a configure that failed
+        shutil.rmtree(os.path.join(path_to_build, 'CMakeFiles'), ignore_errors=True)
+        shutil.copytree(os.path.join(self.path_to_seed, 'CMakeFiles'), os.path.join(path_to_build, 'CMakeFiles'))
+        shutil.copyfile(os.path.join(self.path_to_seed, 'CMakeCache.txt'), os.path.join(path_to_build, 'CMakeCache.txt'))
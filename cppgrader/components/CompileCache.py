@@ -0,0 +1,296 @@
+import glob
+import hashlib
+import itertools
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import List, NamedTuple, Optional, Tuple
+import logging
+
+from .common import STATE_DIR_NAME, hash_file
+
+# Headers precompiled once per flag set, the most included by students
+PCH_HEADERS: List[str] = ['bits/stdc++.h', 'iostream', 'vector', 'string', 'algorithm', 'cmath', 'cstdio', 'cstring']
+# Extensions of the files compiled to objects
+TRANSLATION_UNIT_EXTENSIONS: List[str] = ['.c', '.cc', '.cpp', '.cxx', '.c++']
+# Options followed by an argument
+OPTIONS_WITH_ARGUMENT: List[str] = ['-o', '-I', '-D', '-U', '-L', '-l', '-include', '-isystem', '-x', '-MF', '-MT']
+# Shell syntax that can not be handled without a shell
+SHELL_OPERATORS = re.compile(r'[;&|<>`$]')
+
+
+class CompileCommand(NamedTuple):
+    """A compiler command split in compile and link stages
+    """
+    compiler: str
+    sources: List[str]  # Patterns of source files, zsh alternatives like *.(c|cpp) allowed
+    output: str
+    compile_flags: List[str]
+    link_flags: List[str]
+
+
+def parse_compile_command(command: str) -> Optional[CompileCommand]:
+    """Parse a single compiler invocation like 'g++ ./src/*.(c|cpp) -I ./include -o main -Wall -g -std=c++14'
+
+    Args:
+        command (str): Build command
+
+    Returns:
+        Optional[CompileCommand]: parsed command, None if the command is not a single compiler invocation
+    """
+    # Alternatives of glob patterns like *.(c|cpp) are not pipes
+    if SHELL_OPERATORS.search(re.sub(r'\([^()]*\)', '', command)):
+        return None
+    try:
+        tokens: List[str] = shlex.split(command)
+    except ValueError:
+        return None
+    if len(tokens) == 0 or tokens[0].startswith('-'):
+        return None
+
+    sources: List[str] = list()
+    output: str = 'a.out'
+    compile_flags: List[str] = list()
+    link_flags: List[str] = list()
+    index = 1
+    while index < len(tokens):
+        token = tokens[index]
+        if token in OPTIONS_WITH_ARGUMENT and index + 1 < len(tokens):
+            argument = tokens[index + 1]
+            index += 2
+            if token == '-o':
+                output = argument
+            elif token in ['-L', '-l']:
+                link_flags += [token, argument]
+            else:
+                compile_flags += [token, argument]
+            continue
+        if token in ['-c', '-E', '-S']:
+            return None  # Not a build of executable
+        if token.startswith('-l') or token.startswith('-L') or token.startswith('-Wl,') or token in ['-static', '-shared']:
+            link_flags.append(token)
+        elif token.startswith('-'):
+            compile_flags.append(token)
+            if token == '-pthread':
+                link_flags.append(token)
+        else:
+            sources.append(token)
+        index += 1
+
+    if len(sources) == 0:
+        return None
+    return CompileCommand(tokens[0], sources, output, compile_flags, link_flags)
+
+
+def expand_sources(patterns: List[str], path_to_task: str) -> List[str]:
+    """Expand source patterns relative to the task directory, zsh alternatives like *.(c|cpp) are supported
+
+    Args:
+        patterns (List[str]): Patterns
+        path_to_task (str): path to the task directory
+
+    Returns:
+        List[str]: relative paths to sources, sorted
+    """
+    sources: List[str] = list()
+    for pattern in patterns:
+        parts = re.split(r'\(([^()]*)\)', pattern)
+        # Odd parts are alternatives
+        choices = [[part] if position % 2 == 0 else part.split('|') for position, part in enumerate(parts)]
+        for combination in itertools.product(*choices):
+            for path in glob.glob(os.path.join(path_to_task, ''.join(combination))):
+                relpath = os.path.relpath(path, path_to_task)
+                if os.path.isfile(path) and relpath not in sources:
+                    sources.append(relpath)
+    return sorted(sources)
+
+
+def discover_sources(path_to_task: str) -> List[str]:
+    """List the translation units of a task laid out by AutoFilter (src/ and include/). If there is no src/
+    directory (e.g. --keep_file_structure), every translation unit of the task is used
+
+    Args:
+        path_to_task (str): path to the task directory
+
+    Returns:
+        List[str]: relative paths to sources, sorted
+    """
+    path_to_src = os.path.join(path_to_task, 'src')
+    root = path_to_src if os.path.isdir(path_to_src) else path_to_task
+    sources: List[str] = list()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.') and d != 'CMakeFiles']
+        sources += [os.path.relpath(os.path.join(dirpath, filename), path_to_task) for filename in filenames
+                    if os.path.splitext(filename)[-1].lower() in TRANSLATION_UNIT_EXTENSIONS]
+    return sorted(sources)
+
+
+def parse_depfile(path_to_depfile: str) -> Optional[List[str]]:
+    """Read the prerequisites of a make rule written by -MMD
+
+    Args:
+        path_to_depfile (str): path to the depfile
+
+    Returns:
+        Optional[List[str]]: prerequisites, None if the depfile is missing or broken
+    """
+    try:
+        with open(path_to_depfile, 'r', encoding='UTF-8', errors='replace') as f:
+            content = f.read()
+    except OSError:
+        return None
+    # Only the first rule matters, -MP would add phony targets after it
+    content = content.replace('\\\n', ' ')
+    rule = content.split('\n')[0]
+    if ': ' not in rule:
+        return None
+    prerequisites = rule.split(': ', 1)[1].replace('\\ ', '\0').split()
+    return [prerequisite.replace('\0', ' ') for prerequisite in prerequisites]
+
+
+class CompileCache:
+    """Cache of object files keyed by preprocessed translation units, and precompiled headers shared by all
+    students. The cache lives in <output_dir>/.cppgrader/compile_cache:
+    ├── objects
+    │   ├── <key>.o
+    │   └── <key>.log  Diagnostics of the compilation
+    └── pch
+        └── <flags_key>  -I this directory to use the precompiled headers
+            ├── iostream  Wrapper that includes the real header
+            └── iostream.gch
+    """
+
+    def __init__(self, path_to_output: str, size_limit: int = 1024):
+        """
+        Args:
+            path_to_output (str): output directory
+            size_limit (int, optional): maximum size of the objects in MB. Defaults to 1024.
+        """
+        self.cache_dir: str = os.path.join(path_to_output, STATE_DIR_NAME, 'compile_cache')
+        self.objects_dir: str = os.path.join(self.cache_dir, 'objects')
+        self.pch_root: str = os.path.join(self.cache_dir, 'pch')
+        self.size_limit: int = size_limit * 1024 * 1024
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.pch_root, exist_ok=True)
+
+    def prepare_pch(self, compiler: str, compile_flags: List[str], toolchain: str) -> Optional[str]:
+        """Build the precompiled headers for a flag set, once. GCC only uses a .gch built with compatible flags,
+        otherwise it falls back to the wrapper header
+
+        Args:
+            compiler (str): compiler
+            compile_flags (List[str]): flags of the compilation
+            toolchain (str): compiler version
+
+        Returns:
+            Optional[str]: directory to add to the include path, None if no header could be precompiled
+        """
+        # Include directories of students do not change the precompiled headers
+        flags = [flag for position, flag in enumerate(compile_flags)
+                 if flag != '-I' and (position == 0 or compile_flags[position - 1] != '-I') and not flag.startswith('-I')]
+        key = hashlib.sha1('\0'.join([toolchain, compiler] + flags).encode('UTF-8')).hexdigest()
+        pch_dir = os.path.join(self.pch_root, key)
+        if os.path.exists(os.path.join(pch_dir, '.done')):
+            return pch_dir
+
+        os.makedirs(pch_dir, exist_ok=True)
+        built = 0
+        with tempfile.TemporaryDirectory() as tmp:
+            for header in PCH_HEADERS:
+                path_to_wrapper = os.path.join(pch_dir, header)
+                os.makedirs(os.path.dirname(path_to_wrapper), exist_ok=True)
+                # The .gch is built from a separate header so that the wrapper is never its primary source
+                path_to_source = os.path.join(tmp, 'pch.h')
+                with open(path_to_source, 'w') as f:
+                    f.write('#include <{}>\n'.format(header))
+                ret = subprocess.run([compiler] + flags + ['-x', 'c++-header', path_to_source, '-o', path_to_wrapper + '.gch'],
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                if ret.returncode != 0:
+                    logging.debug('Could not precompile <{}>'.format(header))
+                    continue
+                with open(path_to_wrapper, 'w') as f:
+                    f.write('#include_next <{}>\n'.format(header))
+                built += 1
+        with open(os.path.join(pch_dir, '.done'), 'w') as f:
+            f.write(str(built))
+        logging.info('Precompiled {} headers in {}'.format(built, pch_dir))
+        return pch_dir if built > 0 else None
+
+    @staticmethod
+    def object_key(path_to_preprocessed: str, compiler: str, compile_flags: List[str], toolchain: str) -> str:
+        """Compute the cache key of a translation unit
+
+        Args:
+            path_to_preprocessed (str): path to the preprocessed translation unit
+            compiler (str): compiler
+            compile_flags (List[str]): flags of the compilation
+            toolchain (str): compiler version
+
+        Returns:
+            str: hex digest
+        """
+        hasher = hashlib.sha1('\0'.join([toolchain, compiler] + compile_flags).encode('UTF-8') + b'\0')
+        return hash_file(path_to_preprocessed, hasher).hexdigest()
+
+    def get(self, key: str, path_to_object: str) -> Optional[str]:
+        """Look up an object, copy it to path_to_object on hit
+
+        Args:
+            key (str): cache key
+            path_to_object (str): destination
+
+        Returns:
+            Optional[str]: diagnostics of the compilation on hit, None on miss
+        """
+        path_to_cached = os.path.join(self.objects_dir, key + '.o')
+        try:
+            shutil.copyfile(path_to_cached, path_to_object)
+            with open(os.path.join(self.objects_dir, key + '.log'), 'r', encoding='UTF-8') as f:
+                log = f.read()
+            os.utime(path_to_cached)  # Mark as recently used
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return log
+
+    def put(self, key: str, path_to_object: str, log: str):
+        """Store an object
+
+        Args:
+            key (str): cache key
+            path_to_object (str): object to store
+            log (str): diagnostics of the compilation
+        """
+        path_to_cached = os.path.join(self.objects_dir, key + '.o')
+        with open(os.path.join(self.objects_dir, key + '.log'), 'w', encoding='UTF-8') as f:
+            f.write(log)
+        shutil.copyfile(path_to_object, path_to_cached + '.tmp')
+        os.replace(path_to_cached + '.tmp', path_to_cached)
+
+    def evict(self):
+        """Remove least recently used objects until the cache fits in size_limit
+        """
+        entries: List[Tuple[float, int, str]] = list()
+        for filename in os.listdir(self.objects_dir):
+            if filename.endswith('.o'):
+                stat = os.stat(os.path.join(self.objects_dir, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename[:-2]))
+        total = sum([entry[1] for entry in entries])
+        for _, size, key in sorted(entries):
+            if total <= self.size_limit:
+                break
+            total -= size
+            for ext in ['.o', '.log']:
+                if os.path.exists(os.path.join(self.objects_dir, key + ext)):
+                    os.remove(os.path.join(self.objects_dir, key + ext))
+        logging.info('Compile cache: {} hits, {} misses'.format(self.hits, self.misses))
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import BinaryIO, Dict, List, Optional, Set
+import logging
+
+from .common import STATE_DIR_NAME, hash_file, is_source
+
+# ioctl of Linux that clones a file on copy-on-write filesystems (btrfs, xfs, ...)
+FICLONE: int = 0x40049409
+# Archive members smaller than this are hashed in memory, before anything is written
+SPOOL_SIZE: int = 1 << 20
+
+
+def reflink(path_to_src: str, path_to_dst: str):
+    """Clone a file, the copy shares the blocks of the source until one of them is modified
+
+    Args:
+        path_to_src (str): path to source
+        path_to_dst (str): path to destination, must not exist
+
+    Raises:
+        OSError: the filesystem or the platform does not support reflinks
+    """
+    import fcntl
+    with open(path_to_src, 'rb') as src, open(path_to_dst, 'xb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(path_to_dst)
+            raise
+
+
+class ContentStore:
+    """Content-addressed store of the files of the output directory. Each file is hashed once, stored once
+    and materialized in the student directories as a reflink where the filesystem supports it, as a hardlink
+    otherwise, copied as a last resort.
+
+    Hardlinked files share their inode (and their mtime) with the store and with the other students: they are
+    read-only, and must be replaced (written to a new file and renamed), never modified in place. Only sources,
+    headers and build scripts are hardlinked, the builds and the programs may write the other files. A file
+    keeps the mtime of its object, so it is only hardlinked if the builds made before can not look newer: its
+    content did not change since the last run, or its object was stored by this run. The others are copied.
+
+    The store lives in <output_dir>/.cppgrader/content:
+    ├── objects/<sha1[:2]>/<sha1>
+    └── index/<student>.json   path relative to output_dir -> [sha1, size, mtime_ns]
+
+    The index lets downstream stages (build cache) reuse the digests instead of hashing the files again.
+    """
+
+    def __init__(self, path_to_output: str):
+        """
+        Args:
+            path_to_output (str): output directory
+        """
+        self.path_to_output: str = os.path.abspath(path_to_output)
+        self.objects_dir: str = os.path.join(self.path_to_output, STATE_DIR_NAME, 'content', 'objects')
+        self.index_dir: str = os.path.join(self.path_to_output, STATE_DIR_NAME, 'content', 'index')
+        # If the filesystem supports reflinks, found on first use
+        self.reflinks: Optional[bool] = None
+        # student -> {path relative to output_dir -> [sha1, size, mtime_ns]}
+        self._indexes: Dict[str, Dict[str, List]] = dict()
+        # student -> index of the last run, replaced by reset
+        self._previous: Dict[str, Dict[str, List]] = dict()
+        # Objects stored by this run, newer than every build made before
+        self._created: Set[str] = set()
+        self._lock = threading.Lock()
+        # Statistics of this run
+        self.methods: Dict[str, int] = {'reflink': 0, 'hardlink': 0, 'copy': 0}
+        self.files: int = 0
+        self.stored_bytes: int = 0
+        self.materialized_bytes: int = 0
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _relpath(self, path_to_file: str) -> str:
+        return os.path.relpath(os.path.abspath(path_to_file), self.path_to_output)
+
+    def _store(self, src: BinaryIO, digest: str, executable: bool):
+        """Write an object if it does not exist yet, atomically
+
+        Args:
+            src (BinaryIO): content, read from its current position
+            digest (str): sha1 of the content
+            executable (bool): if the object is executable
+        """
+        path_to_object = self._object_path(digest)
+        if os.path.exists(path_to_object):
+            return
+        os.makedirs(os.path.dirname(path_to_object), exist_ok=True)
+        fd, path_to_tmp = tempfile.mkstemp(dir=os.path.dirname(path_to_object), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        # Objects are shared by hardlinks, they must not be modified in place
+        os.chmod(path_to_tmp, 0o555 if executable else 0o444)
+        os.replace(path_to_tmp, path_to_object)
+        with self._lock:
+            self._created.add(digest)
+        self.stored_bytes += os.path.getsize(path_to_object)
+
+    def _linkable(self, digest: str, relpath: str) -> bool:
+        """Check if a file can be a hardlink of its object
+
+        Args:
+            digest (str): sha1 of the content
+            relpath (str): path relative to output_dir
+
+        Returns:
+            bool: True if the file is only read and the mtime of the object can not hide a change from the builds
+        """
+        if not is_source(os.path.basename(relpath)):
+            return False
+        with self._lock:
+            if digest in self._created:
+                return True
+            previous = self._previous.get(relpath.split(os.sep)[0], dict()).get(relpath)
+        return previous is not None and previous[0] == digest
+
+    def _materialize(self, digest: str, path_to_destination: str):
+        """Create a file with the content of an object, with the best method that works
+
+        Args:
+            digest (str): sha1 of the content
+            path_to_destination (str): path to destination, replaced if it exists
+        """
+        path_to_object = self._object_path(digest)
+        relpath = self._relpath(path_to_destination)
+        # Never write into an existing file, it may be a hardlink of another object
+        if os.path.lexists(path_to_destination):
+            os.remove(path_to_destination)
+        # A reflink is a new inode with a new mtime, it is always safe
+        methods = ['reflink'] if self.reflinks is not False else []
+        if self._linkable(digest, relpath):
+            methods.append('hardlink')
+        methods.append('copy')
+        for method in methods:
+            try:
+                if method == 'reflink':
+                    reflink(path_to_object, path_to_destination)
+                    os.chmod(path_to_destination, os.stat(path_to_object).st_mode | 0o200)
+                elif method == 'hardlink':
+                    os.link(path_to_object, path_to_destination)
+                else:
+                    shutil.copy(path_to_object, path_to_destination)
+                    os.chmod(path_to_destination, os.stat(path_to_object).st_mode | 0o200)
+            except OSError:
+                if method == 'copy':
+                    raise
+                if method == 'reflink' and self.reflinks is None:
+                    self.reflinks = False
+                    logging.info('Content store: reflinks are not supported, sources are hardlinked, other files copied')
+                continue
+            if method == 'reflink' and self.reflinks is None:
+                self.reflinks = True
+                logging.info('Content store: files are materialized by reflink')
+            break
+        stat = os.stat(path_to_destination)
+        with self._lock:
+            self.methods[method] += 1
+            self._indexes.setdefault(relpath.split(os.sep)[0], dict())[relpath] = [digest, stat.st_size, stat.st_mtime_ns]
+        self.files += 1
+        self.materialized_bytes += stat.st_size
+
+    def put_file(self, path_to_src: str, path_to_destination: str) -> str:
+        """Copy a file to the output directory through the store, can be used as copy_function of shutil.copytree
+
+        Args:
+            path_to_src (str): path to source
+            path_to_destination (str): path to destination, under the output directory
+
+        Returns:
+            str: path to destination
+        """
+        if os.path.isdir(path_to_destination):
+            path_to_destination = os.path.join(path_to_destination, os.path.basename(path_to_src))
+        digest = hash_file(path_to_src).hexdigest()
+        if not os.path.exists(self._object_path(digest)):
+            with open(path_to_src, 'rb') as src:
+                self._store(src, digest, os.access(path_to_src, os.X_OK))
+        self._materialize(digest, path_to_destination)
+        return path_to_destination
+
+    def put_stream(self, src: BinaryIO, path_to_destination: str) -> str:
+        """Write a stream (e.g. an archive member) to the output directory through the store
+
+        Args:
+            src (BinaryIO): content
+            path_to_destination (str): path to destination, under the output directory
+
+        Returns:
+            str: path to destination
+        """
+        hasher = hashlib.sha1()
+        # Small members stay in memory, nothing is written if the object already exists
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=self.objects_dir) as spool:
+            for chunk in iter(lambda: src.read(1 << 20), b''):
+                hasher.update(chunk)
+                spool.write(chunk)
+            digest = hasher.hexdigest()
+            spool.seek(0)
+            self._store(spool, digest, False)
+        self._materialize(digest, path_to_destination)
+        return path_to_destination
+
+    def reset(self, student: str):
+        """Forget the index of a student, before their directory is filled again. The index of the last run is
+        kept to find the files that did not change
+
+        Args:
+            student (str): student's name 5xxxxxxxxxxxNAME
+        """
+        previous = self._load(student)
+        with self._lock:
+            self._previous[student] = previous
+            self._indexes[student] = dict()
+
+    def save(self, student: str):
+        """Write the index of a student, so that other stages (and processes) can read the digests
+
+        Args:
+            student (str): student's name 5xxxxxxxxxxxNAME
+        """
+        with self._lock:
+            index = self._indexes.get(student, dict())
+        os.makedirs(self.index_dir, exist_ok=True)
+        path_to_index = os.path.join(self.index_dir, student + '.json')
+        with open(path_to_index + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(path_to_index + '.tmp', path_to_index)
+
+    def _load(self, student: str) -> Dict[str, List]:
+        with self._lock:
+            if student not in self._indexes:
+                try:
+                    with open(os.path.join(self.index_dir, student + '.json'), 'r') as f:
+                        self._indexes[student] = json.load(f)
+                except (OSError, ValueError):
+                    self._indexes[student] = dict()
+            return self._indexes[student]
+
+    def digest(self, path_to_file: str) -> Optional[str]:
+        """Find the sha1 of a file materialized by the store, without reading it
+
+        Args:
+            path_to_file (str): path to file, under the output directory
+
+        Returns:
+            Optional[str]: hex digest, None if the file is unknown or changed since it was materialized
+        """
+        relpath = self._relpath(path_to_file)
+        entry = self._load(relpath.split(os.sep)[0]).get(relpath)
+        if entry is None:
+            return None
+        digest, size, mtime_ns = entry
+        try:
+            stat = os.stat(path_to_file)
+            if stat.st_size != size:
+                return None
+            # A hardlink is still the object, a reflink or a copy must not have been touched
+            if os.path.samestat(stat, os.stat(self._object_path(digest))) or stat.st_mtime_ns == mtime_ns:
+                return digest
+        except OSError:
+            pass
+        return None
+
+    def collect(self):
+        """Remove the indexes of the students that are gone and the objects that no index refers to, then log
+        the statistics of this run
+        """
+        referenced = set()
+        if os.path.isdir(self.index_dir):
+            for filename in os.listdir(self.index_dir):
+                student = os.path.splitext(filename)[0]
+                if not filename.endswith('.json') or not os.path.isdir(os.path.join(self.path_to_output, student)):
+                    os.remove(os.path.join(self.index_dir, filename))
+                    with self._lock:
+                        self._indexes.pop(student, None)
+                    continue
+                referenced.update([entry[0] for entry in self._load(student).values()])
+        removed = 0
+        if os.path.isdir(self.objects_dir):
+            for dirpath, _, filenames in os.walk(self.objects_dir):
+                for filename in filenames:
+                    if filename not in referenced:
+                        os.remove(os.path.join(dirpath, filename))
+                        removed += 1
+        logging.info('Content store: {} files ({:.1f}MB, {} reflinked, {} hardlinked, {} copied), {:.1f}MB written, {} distinct objects, {} unused objects removed'.format(
+            self.files, self.materialized_bytes / (1 << 20), self.methods['reflink'], self.methods['hardlink'], self.methods['copy'],
+            self.stored_bytes / (1 << 20), len(referenced), removed))
@@ -0,0 +1,90 @@
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+# 'file:line:col: severity: message', the column is optional
+DIAGNOSTIC_PATTERN = re.compile(r'^(?P<file>[^\s:][^:\n]*):(?P<line>\d+):(?:(?P<column>\d+):)? '
+                                r'(?P<severity>fatal error|error|warning|note): (?P<message>.*)$', re.MULTILINE)
+# 'main.cpp:(.text+0x1f): undefined reference to `foo()'' from the linker, 'main.cpp:3: ...' with debug info
+LINKER_PATTERN = re.compile(r'^(?P<file>[^\s:][^:\n]*):(?:\d+|\(.*?\)): (?P<message>(?:undefined reference to|multiple definition of) .*)$', re.MULTILINE)
+# Severities counted as errors
+ERROR_SEVERITIES: List[str] = ['error', 'fatal error']
+
+
+class Diagnostic(NamedTuple):
+    """A diagnostic of GCC/Clang or of the linker
+    """
+    file: str
+    line: int  # 0 for the linker
+    severity: str  # fatal error | error | warning | note
+    message: str
+    key: str  # Normalized message, identical for the same mistake in different submissions
+
+
+def normalize_message(severity: str, message: str) -> str:
+    """Normalize a diagnostic message so that the same mistake gets the same key in every submission
+
+    Args:
+        severity (str): severity
+        message (str): message
+
+    Returns:
+        str: key
+    """
+    message = message.replace('‘', "'").replace('’', "'").replace('`', "'")
+    # Line numbers, columns and addresses differ between submissions
+    message = re.sub(r'0x[0-9a-fA-F]+|\d+', 'N', message)
+    message = re.sub(r'\s+', ' ', message).strip()
+    return '{}: {}'.format('error' if severity in ERROR_SEVERITIES else severity, message)
+
+
+def parse_diagnostics(output: str) -> List[Diagnostic]:
+    """Parse the diagnostics in a compiler output
+
+    Args:
+        output (str): compiler output
+
+    Returns:
+        List[Diagnostic]: diagnostics, in order of appearance for each kind
+    """
+    diagnostics: List[Diagnostic] = list()
+    for match in DIAGNOSTIC_PATTERN.finditer(output):
+        severity, message = match.group('severity'), match.group('message').strip()
+        diagnostics.append(Diagnostic(match.group('file'), int(match.group('line')), severity, message, normalize_message(severity, message)))
+    for match in LINKER_PATTERN.finditer(output):
+        message = match.group('message').strip()
+        diagnostics.append(Diagnostic(match.group('file'), 0, 'error', message, normalize_message('error', message)))
+    return diagnostics
+
+
+def summarize_diagnostics(diagnostics: List[Diagnostic]) -> List[Dict]:
+    """Deduplicate the diagnostics of a submission by key, notes are dropped
+
+    Args:
+        diagnostics (List[Diagnostic]): diagnostics of a submission
+
+    Returns:
+        List[Dict]: {key, severity, file, line, message, count}, first occurrence of each key
+    """
+    summary: Dict[str, Dict] = dict()
+    for diagnostic in diagnostics:
+        if diagnostic.severity == 'note':
+            continue
+        if diagnostic.key in summary:
+            summary[diagnostic.key]['count'] += 1
+        else:
+            summary[diagnostic.key] = {'key': diagnostic.key, 'severity': diagnostic.severity, 'file': diagnostic.file,
+                                       'line': diagnostic.line, 'message': diagnostic.message, 'count': 1}
+    return list(summary.values())
+
+
+def count_diagnostics(diagnostics: List[Diagnostic], severities: Optional[List[str]] = None) -> int:
+    """
+    Args:
+        diagnostics (List[Diagnostic]): diagnostics
+        severities (Optional[List[str]], optional): severities to count. Defaults to ERROR_SEVERITIES.
+
+    Returns:
+        int: number of diagnostics with one of the severities
+    """
+    severities = severities if severities is not None else ERROR_SEVERITIES
+    return sum([diagnostic.severity in severities for diagnostic in diagnostics])
@@ -1,35 +1,171 @@
+import asyncio
+import functools
 import subprocess
 import os
-from typing import List, Dict
+import fcntl
+import getpass
+import glob
+import json
+import re
+import socket
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, NamedTuple, Optional, Tuple
 import sys
 import time
-import replit
+
+from .TaskRunner import TaskRunner, limit_resources
+
+# Output of a prefetched run kept for display, in bytes of stdout and of stderr each. The rest is read and dropped
+PREFETCH_OUTPUT_LIMIT: int = 1 << 16
+
+
+class PrefetchResult(NamedTuple):
+    """Result of an executable run in background on the default stdin
+    """
+    retcode: Optional[int]  # None if the executable could not be started
+    output: str  # stdout, then stderr
+    elapsed: float  # Wall time in seconds
+    timed_out: bool
+
+
+def read_grade_report(path_to_report: str) -> Dict[str, List[float]]:
+    """Read a grade report
+
+    Args:
+        path_to_report (str): path to grade report, Name,<dimensions...>
+
+    Returns:
+        Dict[str, List[float]]: student -> scores, empty if the report does not exist
+    """
+    grades: Dict[str, List[float]] = dict()
+    if os.path.exists(path_to_report):
+        with open(path_to_report, 'r') as f:
+            for line in f.readlines()[1:]: # Discard the first line
+                line_tokenized = line.strip().split(',')
+                grades[line_tokenized[0]] = [float(score) for score in line_tokenized[1:] if score != '']
+    return grades
+
+
+def read_grade_times(path_to_report: str) -> Dict[str, float]:
+    """Read the time of the grades of a report, kept next to it in <report>.times.json
+
+    Args:
+        path_to_report (str): path to grade report
+
+    Returns:
+        Dict[str, float]: student -> time of the event that gave the grade, empty if unknown
+    """
+    try:
+        with open(path_to_report + '.times.json', 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def read_journal(path_to_journal: str) -> List[Dict]:
+    """Read the grade events of a journal, a line torn by a crash is skipped
+
+    Args:
+        path_to_journal (str): path to journal, one JSON event per line
+
+    Returns:
+        List[Dict]: {time, grader, student, scores}
+    """
+    events: List[Dict] = list()
+    with open(path_to_journal, 'r') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                print('[ Warning ] Skipping a broken line of {}'.format(path_to_journal))
+    return events
+
 
 class ManualGrader:
     __doc__ = "Use '<' or ',' for previous submission\n" \
               "    '>' or '.' for next submission\n" \
               "'grade \{score1\} \{score2\}' or 'g \{score1\} \{score2\}' to grade\n" \
               "Type the name of executable to execute\n" \
+              "'r' or 'result' to wait for the output of the prefetched run\n" \
               "'ls' and 'cd' commands are available\n" \
-              "'save' to save and 'quit' to quit\n" \
+              "Grades are journaled as soon as they are given\n" \
+              "'save' to write the grade report and 'quit' to quit\n" \
               "\nMethods:\n\n\trun()"
     path_to_output: str = ''
 
-    def __init__(self, path_to_output: str = './output', path_to_report: str = './GRADES.csv', dimension: List[str] = ['Answer', 'Interface']):
+    def __init__(self, path_to_output: str = './output', path_to_report: str = './GRADES.csv', dimension: List[str] = ['Answer', 'Interface'],
+                 prefetch: int = 0, path_to_stdin: Optional[str] = None, executable: str = 'main', timeout: float = 10,
+                 grader_name: Optional[str] = None, cpu_limit: Optional[int] = None, memory_limit: int = 512):
+        """
+        Args:
+            path_to_output (str, optional): output directory. Defaults to './output'.
+            path_to_report (str, optional): path to grade report. Defaults to './GRADES.csv'.
+            dimension (List[str], optional): grading dimensions. Defaults to ['Answer', 'Interface'].
+            prefetch (int, optional): number of next submissions whose executable is run in background, their output
+                is shown as soon as they are listed. Defaults to 0 (disabled).
+            path_to_stdin (Optional[str], optional): stdin of the prefetched runs. Defaults to None (empty stdin).
+            executable (str, optional): name of the executable to prefetch. Defaults to 'main'.
+            timeout (float, optional): prefetched runs are killed after this number of seconds. Defaults to 10.
+            grader_name (Optional[str], optional): name of the journal of this grader, graders grading at the same
+                time need different names. Defaults to None (user@host).
+            cpu_limit (Optional[int], optional): CPU time limit of the prefetched runs in seconds. Defaults to None (timeout).
+            memory_limit (int, optional): memory limit of the prefetched runs in MB, 0 for unlimited. Defaults to 512.
+        """
         self.path_to_output: str = path_to_output
         self.path_to_grade_report: str = path_to_report
         self.dimension: List[str] = dimension
         self.grades: Dict[str, List[float]] = dict()
+        # Every grade is appended to <report>.<grader>.journal and fsynced, the journals are compacted into the report
+        self.grader_name: str = grader_name if grader_name is not None else '{}@{}'.format(getpass.getuser(), socket.gethostname())
+        self.path_to_journal: str = '{}.{}.journal'.format(self.path_to_grade_report, re.sub(r'[^\w@.-]', '_', self.grader_name))
+        self._journal = None
+        # Number of events journaled since the last compaction
+        self._journaled: int = 0
+        # student -> latest event given in this session since the last compaction, kept even if the journal failed
+        self._given: Dict[str, Dict] = dict()
         self._restor_grades()
+        self.prefetch: int = max(0, prefetch)
+        self.executable: str = executable
+        self.timeout: float = timeout
+        self.path_to_stdin: Optional[str] = path_to_stdin
+        # Same limits as the tester, the runs are killed with their children after timeout seconds
+        self._set_limits = functools.partial(limit_resources, cpu_limit if cpu_limit is not None else max(1, int(timeout)), memory_limit)
+        # task_name -> run of the executable in background
+        self._prefetched: Dict[str, Future] = dict()
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(max_workers=self.prefetch) if self.prefetch > 0 else None
+        # path -> content of the directory, submissions do not change while grading
+        self._listing: Dict[str, List[str]] = dict()
+
+    @property
+    def _journal_paths(self) -> List[str]:
+        """
+        Returns:
+            List[str]: journals of every grader of the report
+        """
+        return sorted(glob.glob(glob.escape(self.path_to_grade_report) + '.*.journal'))
+
+    def _replay(self) -> Tuple[Dict[str, List[float]], Dict[str, float]]:
+        """Rebuild the grades from the report, the events of every journal and the events of this session. The
+        latest event of a student wins, an event older than the grade in the report is ignored
+
+        Returns:
+            Tuple[Dict[str, List[float]], Dict[str, float]]: student -> scores, student -> time of the grade
+        """
+        grades = read_grade_report(self.path_to_grade_report)
+        times = read_grade_times(self.path_to_grade_report)
+        events: List[Dict] = list(self._given.values())
+        for path_to_journal in self._journal_paths:
+            events += read_journal(path_to_journal)
+        for event in sorted(events, key=lambda event: event['time']):
+            if event['time'] >= times.get(event['student'], float('-inf')):
+                grades[event['student']] = event['scores']
+                times[event['student']] = event['time']
+        return grades, times
 
     def _restor_grades(self):
-        """Restore the grades from self.path_to_grade_report
+        """Restore the grades from self.path_to_grade_report and the journals
         """
-        if os.path.exists(self.path_to_grade_report):
-            with open(self.path_to_grade_report, 'r') as f:
-                for line in f.readlines()[1:]: # Discard the first line
-                    line_tokenized = line.split(',')
-                    self.grades[line_tokenized[0]] = [float(score) for score in line_tokenized[1:]]
+        self.grades, _ = self._replay()
 
     @property
     def _output_path_exist(self) -> bool:
@@ -57,23 +193,113 @@ class ManualGrader:
             self.path_to_output, task_name, executable_name)
         p = subprocess.Popen(['/bin/zsh', '-c', path_to_exe],
                              stdin=sys.stdin, stderr=subprocess.PIPE, stdout=sys.stdout)
-        while p.poll() is None:
-            time.sleep(0.1)
+        # Drains stderr while waiting, so that a verbose executable never blocks
+        p.communicate()
+
+    def _run_in_background(self, path_to_exe: str) -> PrefetchResult:
+        """Run an executable on the default stdin, runs in a thread of the executor
+
+        Args:
+            path_to_exe (str): path to executable
+
+        Returns:
+            PrefetchResult: exit status and output
+        """
+        start = time.perf_counter()
+        # Each thread runs its own event loop, and so its own runner
+        runner = TaskRunner(1, self.timeout, PREFETCH_OUTPUT_LIMIT)
+        try:
+            with open(self.path_to_stdin if self.path_to_stdin is not None else os.devnull, 'rb') as stdin:
+                ret = asyncio.run(runner.run([path_to_exe], cwd=os.path.dirname(path_to_exe), stdin=stdin, preexec_fn=self._set_limits))
+        except OSError as err:
+            return PrefetchResult(None, '{}: {}'.format(type(err).__name__, err), time.perf_counter() - start, False)
+        text = str(ret.stdout + ret.stderr, encoding='UTF-8', errors='replace')
+        if ret.truncated > 0:
+            text += '\n[ {} bytes of output truncated ]'.format(ret.truncated)
+        return PrefetchResult(None if ret.timed_out else ret.retcode, text, ret.elapsed, ret.timed_out)
+
+    def _prefetch(self, task_list: List[str], idx: int):
+        """Start the executables of the current submission and of the next self.prefetch ones, if not started yet
+
+        Args:
+            task_list (List[str]): submissions
+            idx (int): index of the current submission
+        """
+        if self._executor is None:
+            return
+        for task_name in task_list[idx:idx + self.prefetch + 1]:
+            path_to_exe = os.path.join(self.path_to_output, task_name, self.executable)
+            if task_name not in self._prefetched and os.path.isfile(path_to_exe):
+                self._prefetched[task_name] = self._executor.submit(self._run_in_background, os.path.abspath(path_to_exe))
+
+    def _show_prefetched(self, task_name: str, wait: bool = False):
+        """Print the output of the prefetched run of a submission
+
+        Args:
+            task_name (str): name of the submission
+            wait (bool, optional): wait for the run if it is not finished. Defaults to False.
+        """
+        future: Optional[Future] = self._prefetched.get(task_name)
+        if future is None:
+            if wait:
+                print('[ Error ] No prefetched run')
+            return
+        if not future.done() and not wait:
+            print("[ Info ] {} is running in background, 'r' to wait for its output".format(self.executable))
+            return
+        result: PrefetchResult = future.result()
+        print('\n---- Prefetched run of {} ----\n'.format(self.executable))
+        print(result.output)
+        if result.timed_out:
+            print('---- Killed after {:.1f}s ----\n'.format(result.elapsed))
+        else:
+            print('---- Exit code {} in {:.2f}s ----\n'.format(result.retcode, result.elapsed))
+
+    @staticmethod
+    def _clear():
+        # replit takes a while to import, it is only needed once the grading starts
+        import replit
+        replit.clear()
 
     def _make_grade(self, task_name, grade):
         try:
             self.grades[task_name] = [float(score) for score in grade]
         except ValueError:
             print('[ Error ] Value error')
+            return
+        self._append_journal(task_name, self.grades[task_name])
 
-    def _list_submission_dir(self, path_to_dir):
-        if os.path.exists(path_to_dir):
-            content_list = os.listdir(path_to_dir)
-            print('>', '\n> '.join(content_list))
-            return content_list
-        else:
-            print('[ Error ] Directory does not exist')
-            return []
+    def _append_journal(self, task_name: str, scores: List[float]):
+        """Append a grade to the journal, it is on disk when the function returns
+
+        Args:
+            task_name (str): name of the submission
+            scores (List[float]): scores
+        """
+        event = {'time': time.time(), 'grader': self.grader_name, 'student': task_name, 'scores': scores}
+        self._given[task_name] = event
+        if self._journal is None:
+            self._journal = open(self.path_to_journal, 'a')
+            # The last line may have been torn by a crash, the next event must not be appended to it
+            if self._journal.tell() > 0:
+                with open(self.path_to_journal, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        self._journal.write('\n')
+        self._journal.write(json.dumps(event) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journaled += 1
+
+    def _list_submission_dir(self, path_to_dir, refresh: bool = False):
+        if refresh or path_to_dir not in self._listing:
+            if not os.path.exists(path_to_dir):
+                print('[ Error ] Directory does not exist')
+                return []
+            self._listing[path_to_dir] = os.listdir(path_to_dir)
+        content_list = self._listing[path_to_dir]
+        print('>', '\n> '.join(content_list))
+        return content_list
 
     def run(self):
         if not self._output_path_exist:
@@ -97,13 +323,16 @@ class ManualGrader:
 
             if task_list[idx] in self.grades.keys(): # Print current grades
                 print('Current Grades: ', ' '.join([str(score) for score in self.grades[task_list[idx]]]))
+
+            self._prefetch(task_list, idx) # Run the next submissions in background
+            self._show_prefetched(task_list[idx])
             
             cmd: List[str] = input('% ').split(' ') # Get keyboard input
             if cmd[0] == '>' or cmd[0] == '.' or cmd[0] == '\x1b[C' or cmd[0] == '\x1b[B': # Move to next submission
                 if idx < task_list_len - 1:
                     idx += 1 # increase index
                     dir_tmp = '' # reset Tmp directory
-                    replit.clear()# Clear terminal output
+                    self._clear()# Clear terminal output
                     continue
                 else:
                     print('[ Info ] End of submissions')
@@ -113,7 +342,7 @@ class ManualGrader:
                 if idx > 0:
                     idx -= 1 # decrease index
                     dir_tmp = '' # reset Tmp directory
-                    replit.clear()# Clear terminal output
+                    self._clear()# Clear terminal output
                     continue
                 else:
                     print('[ Info ] Begin of submissions')
@@ -126,6 +355,8 @@ class ManualGrader:
                     print('\n\n---- Begin ----\n')
                     self._execute(task_list[idx], os.path.join(dir_tmp, cmd[0]))
                     print('\n---- End ----\n\n')
+                    # The executable may have written files
+                    self._listing.pop(os.path.join(self.path_to_output, task_list[idx], dir_tmp), None)
 
                 else:
                     print('[ Error ] Not a file')
@@ -144,15 +375,20 @@ class ManualGrader:
             if cmd[0] == 'ls': # Usage similar to 'ls'
                 if len(cmd) > 1:
                     self._list_submission_dir(os.path.join(
-                        self.path_to_output, task_list[idx], dir_tmp, cmd[1]))
+                        self.path_to_output, task_list[idx], dir_tmp, cmd[1]), refresh=True)
                 else:
+                    self._listing.pop(os.path.join(self.path_to_output, task_list[idx], dir_tmp), None)
                     continue
 
+            if cmd[0] == 'result' or cmd[0] == 'r': # Wait for the prefetched run
+                self._show_prefetched(task_list[idx], wait=True)
+                continue
+
             if cmd[0] == 'grade' or cmd[0] == 'g': # Grade, can accept multiple input score
                 if len(cmd) > 1:
                     self._make_grade(task_list[idx], cmd[1:])
                     if idx < task_list_len - 1: idx += 1 # Next submission
-                    replit.clear()# Clear terminal output
+                    self._clear()# Clear terminal output
                     continue
                 else:
                     print('[ Error ] Insufficient argument')
@@ -169,19 +405,61 @@ class ManualGrader:
                 print(self.__doc__)
 
     def save(self):
+        """Compact the journals into the grade report, then remove the journal of this grader. The report is
+        rebuilt from the disk, so that the grades of other graders are merged. The time of each grade is kept in
+        <report>.times.json, so that the journals that are not compacted yet can not override a newer grade.
+        Nothing is done if this grader has no journal
+        """
+        if self._journaled == 0 and len(self._given) == 0 and not os.path.exists(self.path_to_journal):
+            return
         print('[ Info ] Saving grade report to: {}'.format(self.path_to_grade_report))
-        with open(self.path_to_grade_report, 'w') as f:
-            f.writelines(['Name,', ','.join(self.dimension), '\n'])
-            for task_name in self.grades.keys():
-                f.writelines([task_name, ',', ','.join([str(score)
-                                                        for score in self.grades[task_name]]),'\n'])
+        # Graders compacting at the same time are serialized
+        with open(self.path_to_grade_report + '.lock', 'w') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            self.grades, times = self._replay()
+            # Written before the report: after a crash in between, the journals of the new grades are still replayed
+            with open(self.path_to_grade_report + '.times.json.tmp', 'w') as f:
+                json.dump(times, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.path_to_grade_report + '.times.json.tmp', self.path_to_grade_report + '.times.json')
+            with open(self.path_to_grade_report + '.tmp', 'w') as f:
+                f.writelines(['Name,', ','.join(self.dimension), '\n'])
+                for task_name in self.grades.keys():
+                    f.writelines([task_name, ',', ','.join([str(score)
+                                                            for score in self.grades[task_name]]),'\n'])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.path_to_grade_report + '.tmp', self.path_to_grade_report)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.path_to_journal):
+                os.remove(self.path_to_journal)
+            self._journaled = 0
+            self._given = dict()
+
 
+    def close(self):
+        """Close the journal, cancel the prefetched runs that have not started, the running ones end within the timeout
+        """
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._executor is not None:
+            for future in self._prefetched.values():
+                future.cancel()
+            self._executor.shutdown(wait=False)
 
     def __call__(self, *args, **kwargs):
         try:
             self.run(*args, **kwargs)
-        except:
+        except KeyboardInterrupt:
+            print('\n[ Info ] Interrupted')
+        finally:
+            # The grades are already in the journal, if this fails they are compacted by the next save
             self.save()
+            self.close()
 
 
 if __name__ == '__main__':
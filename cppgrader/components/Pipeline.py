@@ -0,0 +1,51 @@
+import queue
+import threading
+from typing import Optional
+
+from .AutoBuilder import AutoBuilder
+from .AutoFilter import AutoFilter
+
+
+class Pipeline:
+    """Run the filter and the builder at the same time: each student is built as soon as their files are in
+    the output directory, so that the extraction of the next archives overlaps the compilation.
+
+    The filter runs in a thread and hands the students to the builder through a bounded queue. The builder
+    keeps the main thread, where asyncio can wait for its subprocesses. The filter is held back when the queue
+    is full, so that it never runs far ahead of the builds.
+    """
+
+    def __init__(self, filter_app: AutoFilter, builder_app: AutoBuilder, depth: Optional[int] = None):
+        """
+        Args:
+            filter_app (AutoFilter): filter
+            builder_app (AutoBuilder): builder
+            depth (Optional[int], optional): number of filtered students waiting for a build. Defaults to twice the builds running at the same time.
+        """
+        self.filter_app: AutoFilter = filter_app
+        self.builder_app: AutoBuilder = builder_app
+        self.depth: int = depth if depth is not None else 2 * builder_app.jobs
+        self._error: Optional[BaseException] = None
+
+    def _filter(self, task_queue: queue.Queue):
+        try:
+            self.filter_app.run(on_filtered=task_queue.put)
+        except BaseException as err:
+            self._error = err
+        finally:
+            # End of the stream, the builder waits for the running builds and returns
+            task_queue.put(None)
+
+    def run(self):
+        """Run the pipeline, the exception of the filter is raised once the builds are finished
+        """
+        task_queue: queue.Queue = queue.Queue(maxsize=self.depth)
+        thread = threading.Thread(target=self._filter, args=(task_queue,), name='filter', daemon=True)
+        thread.start()
+        self.builder_app.run_stream(task_queue, self.filter_app.incremental)
+        thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __call__(self):
+        self.run()
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+from .common import STATE_DIR_NAME
+
+
+class StageView(Mapping):
+    """Read-only student -> (status, output) mapping over the results of a stage. Outputs are read from the
+    database on access, so that huge compiler logs are never all in memory
+    """
+
+    def __init__(self, store: 'ResultStore', stage: str):
+        self._store = store
+        self._stage = stage
+
+    def __getitem__(self, student: str) -> Tuple[int, str]:
+        row = self._store.get(student, self._stage)
+        if row is None:
+            raise KeyError(student)
+        return row[0], row[1]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store.students(self._stage))
+
+    def __len__(self) -> int:
+        return self._store.count(self._stage)
+
+    def statuses(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: student -> status, without reading the outputs
+        """
+        return self._store.statuses(self._stage)
+
+
+class ResultStore:
+    """Results of every stage, written as soon as they are known so that a stage can run alone or resume
+    after a crash. Stored in <output_dir>/.cppgrader/results.db:
+    results: one row per student per stage (filter, build, test)
+    tests: one row per student per test case
+    metrics: named numbers of a stage, e.g. configure_time or binary_size of the build
+    diagnostics: distinct compiler diagnostics of each build, indexed by normalized key
+    """
+
+    def __init__(self, path_to_output: str):
+        """
+        Args:
+            path_to_output (str): output directory
+        """
+        self.db_path: str = os.path.join(path_to_output, STATE_DIR_NAME, 'results.db')
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # Autocommit, every result is durable once put returns
+        self._conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                               'student TEXT NOT NULL, stage TEXT NOT NULL, status INTEGER NOT NULL, output TEXT NOT NULL, '
+                               'elapsed REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (student, stage))')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS tests ('
+                               'student TEXT NOT NULL, name TEXT NOT NULL, status TEXT NOT NULL, elapsed REAL NOT NULL, '
+                               'PRIMARY KEY (student, name))')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS metrics ('
+                               'student TEXT NOT NULL, stage TEXT NOT NULL, name TEXT NOT NULL, value REAL NOT NULL, '
+                               'PRIMARY KEY (student, stage, name))')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS diagnostics ('
+                               'student TEXT NOT NULL, key TEXT NOT NULL, severity TEXT NOT NULL, file TEXT NOT NULL, '
+                               'line INTEGER NOT NULL, message TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (student, key))')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS diagnostics_key ON diagnostics (key)')
+
+    def put(self, student: str, stage: str, status: int, output: str = '', elapsed: float = 0.0):
+        """Record the result of a stage for a student, replacing the previous one
+
+        Args:
+            student (str): student's name 5xxxxxxxxxxxNAME
+            stage (str): filter | build | test
+            status (int): 0 for success
+            output (str, optional): log of the stage. Defaults to ''.
+            elapsed (float, optional): wall time in seconds. Defaults to 0.0.
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                               (student, stage, status, output, elapsed, time.time()))
+
+    def get(self, student: str, stage: str) -> Optional[Tuple[int, str, float]]:
+        """
+        Returns:
+            Optional[Tuple[int, str, float]]: status, output and elapsed, None if the student has no result
+        """
+        with self._lock:
+            return self._conn.execute('SELECT status, output, elapsed FROM results WHERE student = ? AND stage = ?',
+                                      (student, stage)).fetchone()
+
+    def students(self, stage: str) -> List[str]:
+        """
+        Returns:
+            List[str]: students that have a result for the stage, sorted
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT student FROM results WHERE stage = ? ORDER BY student', (stage,))]
+
+    def count(self, stage: str) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM results WHERE stage = ?', (stage,)).fetchone()[0]
+
+    def remove(self, stage: str, students: Optional[List[str]] = None):
+        """Forget the results of a stage, metrics, test cases and diagnostics included
+
+        Args:
+            stage (str): filter | build | test
+            students (Optional[List[str]], optional): Students to forget. Defaults to None (everyone).
+        """
+        with self._lock:
+            if students is None:
+                self._conn.execute('DELETE FROM results WHERE stage = ?', (stage,))
+                self._conn.execute('DELETE FROM metrics WHERE stage = ?', (stage,))
+                if stage == 'test':
+                    self._conn.execute('DELETE FROM tests')
+                if stage == 'build':
+                    self._conn.execute('DELETE FROM diagnostics')
+                return
+            for student in students:
+                self._conn.execute('DELETE FROM results WHERE stage = ? AND student = ?', (stage, student))
+                self._conn.execute('DELETE FROM metrics WHERE stage = ? AND student = ?', (stage, student))
+                if stage == 'test':
+                    self._conn.execute('DELETE FROM tests WHERE student = ?', (student,))
+                if stage == 'build':
+                    self._conn.execute('DELETE FROM diagnostics WHERE student = ?', (student,))
+
+    def view(self, stage: str) -> StageView:
+        """
+        Returns:
+            StageView: student -> (status, output) mapping
+        """
+        return StageView(self, stage)
+
+    def statuses(self, stage: str) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: student -> status of the stage
+        """
+        with self._lock:
+            return {row[0]: row[1] for row in self._conn.execute('SELECT student, status FROM results WHERE stage = ?', (stage,))}
+
+    def elapsed(self, stage: str) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: student -> wall time of the stage
+        """
+        with self._lock:
+            return {row[0]: row[1] for row in self._conn.execute('SELECT student, elapsed FROM results WHERE stage = ?', (stage,))}
+
+    def failures(self, stage: str) -> Dict[str, str]:
+        """
+        Returns:
+            Dict[str, str]: student -> output, for the students that failed the stage
+        """
+        with self._lock:
+            return {row[0]: row[1] for row in self._conn.execute(
+                'SELECT student, output FROM results WHERE stage = ? AND status != 0 ORDER BY student', (stage,))}
+
+    def put_metrics(self, student: str, stage: str, metrics: Dict[str, float]):
+        """Record metrics of a stage for a student
+
+        Args:
+            student (str): student's name 5xxxxxxxxxxxNAME
+            stage (str): filter | build | test
+            metrics (Dict[str, float]): name -> value
+        """
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?)',
+                                   [(student, stage, name, value) for name, value in metrics.items()])
+
+    def metrics(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Returns:
+            Dict[str, Dict[str, Dict[str, float]]]: student -> stage -> name -> value
+        """
+        metrics: Dict[str, Dict[str, Dict[str, float]]] = dict()
+        with self._lock:
+            for student, stage, name, value in self._conn.execute('SELECT student, stage, name, value FROM metrics'):
+                # Counts and sizes are stored as REAL
+                metrics.setdefault(student, dict()).setdefault(stage, dict())[name] = int(value) if value.is_integer() else value
+        return metrics
+
+    def put_diagnostics(self, student: str, diagnostics: List[Dict]):
+        """Replace the diagnostics of a student's build
+
+        Args:
+            student (str): student's name 5xxxxxxxxxxxNAME
+            diagnostics (List[Dict]): {key, severity, file, line, message, count}, one per key
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM diagnostics WHERE student = ?', (student,))
+            self._conn.executemany('INSERT OR REPLACE INTO diagnostics VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   [(student, d['key'], d['severity'], d['file'], d['line'], d['message'], d['count']) for d in diagnostics])
+
+    def error_index(self, limit: int = 10, severities: Tuple[str, ...] = ('error', 'fatal error')) -> List[Dict]:
+        """Find the diagnostics that affect the most students
+
+        Args:
+            limit (int, optional): number of diagnostics. Defaults to 10.
+            severities (Tuple[str, ...], optional): severities to index. Defaults to errors.
+
+        Returns:
+            List[Dict]: {key, message, students}, the message is an example, students are sorted
+        """
+        with self._lock:
+            placeholders = ', '.join(['?'] * len(severities))
+            rows = self._conn.execute('SELECT key, MIN(message), GROUP_CONCAT(student, char(10)) FROM diagnostics '
+                                      'WHERE severity IN ({}) GROUP BY key ORDER BY COUNT(*) DESC, key LIMIT ?'.format(placeholders),
+                                      tuple(severities) + (limit,)).fetchall()
+        return [{'key': key, 'message': message, 'students': sorted(students.split('\n'))} for key, message, students in rows]
+
+    def put_case(self, student: str, name: str, status: str, elapsed: float):
+        """Record the result of a test case
+
+        Args:
+            student (str): student's name 5xxxxxxxxxxxNAME
+            name (str): name of the case
+            status (str): PASS | FAIL | TLE | RE | NOEXEC
+            elapsed (float): wall time in seconds
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO tests VALUES (?, ?, ?, ?)', (student, name, status, elapsed))
+
+    def cases(self) -> Dict[str, List[Tuple[str, str, float]]]:
+        """
+        Returns:
+            Dict[str, List[Tuple[str, str, float]]]: student -> [(case, status, elapsed)], ordered by case
+        """
+        results: Dict[str, List[Tuple[str, str, float]]] = dict()
+        with self._lock:
+            for student, name, status, elapsed in self._conn.execute('SELECT student, name, status, elapsed FROM tests ORDER BY student, name'):
+                results.setdefault(student, list()).append((name, status, elapsed))
+        return results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
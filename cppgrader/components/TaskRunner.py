@@ -0,0 +1,154 @@
+import asyncio
+import os
+import resource
+import signal
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+
+class TaskResult(NamedTuple):
+    """Result of a process run by TaskRunner
+    """
+    retcode: int
+    stdout: bytes
+    stderr: bytes
+    elapsed: float  # Wall time in seconds
+    timed_out: bool
+    truncated: int  # Number of output bytes dropped because of output_limit
+
+    @property
+    def output(self) -> str:
+        """stderr + stdout decoded, with a note if the process timed out or the output was truncated
+        """
+        output = str(self.stderr + self.stdout, encoding='UTF-8', errors='replace')
+        if self.truncated > 0:
+            output += '\n[ {} bytes of output truncated ]'.format(self.truncated)
+        if self.timed_out:
+            output += '\n[ Killed after {:.1f}s ]'.format(self.elapsed)
+        return output
+
+
+def limit_resources(cpu_limit: int, memory_limit: int):
+    """Set the resource limits of an executable under test, runs in the child process before exec
+
+    Args:
+        cpu_limit (int): CPU time limit in seconds, SIGXCPU then SIGKILL one second later
+        memory_limit (int): address space limit in MB, 0 for unlimited
+    """
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+    if memory_limit > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit * 1024 * 1024, memory_limit * 1024 * 1024))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+
+async def _read_capped(stream: asyncio.StreamReader, limit: int) -> Tuple[bytes, int]:
+    """Read a stream until EOF, keeping at most limit bytes. The rest is drained so that the process never blocks
+
+    Args:
+        stream (asyncio.StreamReader): stream to read
+        limit (int): maximum number of bytes kept
+
+    Returns:
+        Tuple[bytes, int]: bytes kept, number of bytes dropped
+    """
+    chunks: List[bytes] = list()
+    size, dropped = 0, 0
+    while True:
+        chunk = await stream.read(1 << 16)
+        if not chunk:
+            break
+        keep = chunk[:max(0, limit - size)]
+        if len(keep) > 0:
+            chunks.append(keep)
+            size += len(keep)
+        dropped += len(chunk) - len(keep)
+    return b''.join(chunks), dropped
+
+
+class TaskRunner:
+    """Run subprocesses with asyncio, with bounded concurrency, timeouts and output size caps
+
+    Each process is started in a new session, the whole process group is killed on timeout so that the
+    children of make or of a shell do not survive.
+    """
+
+    def __init__(self, jobs: int = 1, timeout: Optional[float] = None, output_limit: int = 1 << 20):
+        """
+        Args:
+            jobs (int, optional): maximum number of processes running at the same time. Defaults to 1.
+            timeout (Optional[float], optional): default timeout in seconds, None for no timeout. Defaults to None.
+            output_limit (int, optional): maximum number of bytes kept for stdout and stderr each. Defaults to 1MB.
+        """
+        self.jobs: int = max(1, jobs)
+        self.timeout: Optional[float] = timeout
+        self.output_limit: int = output_limit
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created on first use so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.jobs)
+        return self._semaphore
+
+    @staticmethod
+    def _kill(process: asyncio.subprocess.Process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def run(self,
+                  instruction: List[str],
+                  cwd: Optional[str] = None,
+                  stdin=None,
+                  timeout: Optional[float] = None,
+                  preexec_fn: Optional[Callable[[], None]] = None) -> TaskResult:
+        """Run an instruction, waiting for a free slot first
+
+        Args:
+            instruction (List[str]): instruction to run
+            cwd (Optional[str], optional): working directory of the process. Defaults to None.
+            stdin (optional): file object used as stdin. Defaults to None (/dev/null).
+            timeout (Optional[float], optional): timeout in seconds. Defaults to self.timeout.
+            preexec_fn (Optional[Callable[[], None]], optional): called in the child before exec. Defaults to None.
+
+        Returns:
+            TaskResult: Result
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        async with self.semaphore:
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(*instruction,
+                                                           cwd=cwd,
+                                                           stdin=stdin if stdin is not None else asyncio.subprocess.DEVNULL,
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE,
+                                                           start_new_session=True,
+                                                           preexec_fn=preexec_fn)
+            readers = asyncio.ensure_future(asyncio.gather(_read_capped(process.stdout, self.output_limit),
+                                                           _read_capped(process.stderr, self.output_limit)))
+            timed_out = False
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.gather(process.wait(), readers)), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                self._kill(process)
+                await process.wait()
+            except asyncio.CancelledError:
+                self._kill(process)
+                raise
+
+            try:
+                # A process that escaped the group may still hold the pipes
+                (stdout, dropped_stdout), (stderr, dropped_stderr) = await asyncio.wait_for(asyncio.shield(readers), 5)
+            except asyncio.TimeoutError:
+                readers.cancel()
+                stdout, dropped_stdout, stderr, dropped_stderr = b'', 0, b'', 0
+
+            return TaskResult(retcode=process.returncode,
+                              stdout=stdout,
+                              stderr=stderr,
+                              elapsed=time.perf_counter() - start,
+                              timed_out=timed_out,
+                              truncated=dropped_stdout + dropped_stderr)
@@ -0,0 +1,119 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+
+class Tracer:
+    """Timed spans of the stages and of each student, exported as Chrome trace events (open the trace in
+    chrome://tracing or https://ui.perfetto.dev). Stages are on the first lane, each student has its own lane
+    so that concurrent builds are shown side by side. A stage can also be profiled with cProfile.
+
+    Timestamps come from time.perf_counter(), which is system wide on Linux and macOS, so that spans
+    measured in worker processes can be added as well. A disabled tracer records nothing.
+    """
+
+    def __init__(self, path_to_trace: Optional[str] = None, path_to_profile: Optional[str] = None):
+        """
+        Args:
+            path_to_trace (Optional[str], optional): path to the trace (JSON). Defaults to None (no trace).
+            path_to_profile (Optional[str], optional): directory of the cProfile dumps, one <stage>.prof per stage. Defaults to None (no profile).
+        """
+        self.path_to_trace: Optional[str] = path_to_trace
+        self.path_to_profile: Optional[str] = path_to_profile
+        self.enabled: bool = path_to_trace is not None
+        self._origin: float = time.perf_counter()
+        self._pid: int = os.getpid()
+        self._events: List[Dict] = [{'ph': 'M', 'name': 'process_name', 'pid': self._pid, 'tid': 0, 'args': {'name': 'cppgrader'}},
+                                    {'ph': 'M', 'name': 'thread_name', 'pid': self._pid, 'tid': 0, 'args': {'name': 'stages'}}]
+        # student -> lane (tid) of the trace
+        self._lanes: Dict[str, int] = dict()
+        # Spans may be added from the threads of an executor
+        self._lock = threading.Lock()
+
+    def _lane(self, student: Optional[str]) -> int:
+        if student is None:
+            return 0
+        lane = self._lanes.get(student)
+        if lane is None:
+            lane = self._lanes[student] = len(self._lanes) + 1
+            self._events.append({'ph': 'M', 'name': 'thread_name', 'pid': self._pid, 'tid': lane, 'args': {'name': student}})
+        return lane
+
+    def add(self, name: str, start: float, elapsed: float, student: Optional[str] = None, category: str = 'stage', **args):
+        """Record a span that has already been measured
+
+        Args:
+            name (str): name of the span, e.g. extract, configure
+            start (float): time.perf_counter() at the start of the span
+            elapsed (float): duration in seconds
+            student (Optional[str], optional): student's name 5xxxxxxxxxxxNAME, None for the stage lane. Defaults to None.
+            category (str, optional): category of the span. Defaults to 'stage'.
+            **args: details shown with the span
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': self._pid, 'tid': self._lane(student),
+                                 'ts': (start - self._origin) * 1e6, 'dur': elapsed * 1e6, 'args': args})
+
+    @contextlib.contextmanager
+    def span(self, name: str, student: Optional[str] = None, category: str = 'stage') -> Iterator[Dict]:
+        """Time the body of a with statement
+
+        Args:
+            name (str): name of the span
+            student (Optional[str], optional): student's name 5xxxxxxxxxxxNAME, None for the stage lane. Defaults to None.
+            category (str, optional): category of the span. Defaults to 'stage'.
+
+        Yields:
+            Dict: details of the span, can be filled by the body, e.g. the return code
+        """
+        args: Dict = dict()
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, start, time.perf_counter() - start, student, category, **args)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[Dict]:
+        """Time a stage, and profile it if a profile directory is set
+
+        Args:
+            name (str): name of the stage, also the name of the profile <name>.prof
+
+        Yields:
+            Dict: details of the span
+        """
+        profiler = None
+        if self.path_to_profile is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            with self.span(name) as args:
+                yield args
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                os.makedirs(self.path_to_profile, exist_ok=True)
+                path_to_dump = os.path.join(self.path_to_profile, name + '.prof')
+                profiler.dump_stats(path_to_dump)
+                logging.info('Profile of {} saved to {}'.format(name, path_to_dump))
+
+    def save(self):
+        """Write the trace, nothing is written if the tracer is disabled
+        """
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path_to_trace)), exist_ok=True)
+        with self._lock, open(self.path_to_trace, 'w') as f:
+            json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f)
+        logging.info('Trace saved to {}'.format(self.path_to_trace))
@@ -1,4 +1,9 @@
 from .AutoBuilder import AutoBuilder
 from .AutoFilter import AutoFilter
 from .AutoReporter import AutoReporter
-from .ManualGrader import ManualGrader
\ No newline at end of file
+from .AutoTester import AutoTester
+from .ContentStore import ContentStore
+from .ManualGrader import ManualGrader
+from .Pipeline import Pipeline
+from .ResultStore import ResultStore
+from .Tracer import Tracer
@@ -0,0 +1,61 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import List
+
+# Directory under output_dir that holds the state of cppgrader (caches, manifests). It is hidden so that
+# it is never listed as a submission and it survives the override of output_dir
+STATE_DIR_NAME: str = '.cppgrader'
+# Files that are read by the builds, never written by them
+SOURCE_EXTENSIONS: List[str] = ['.c', '.cc', '.cpp', '.cxx', '.c++', '.h', '.hh', '.hpp', '.hxx', '.h++', '.inl', '.ipp', '.tpp', '.cmake', '.mk']
+BUILD_SCRIPTS: List[str] = ['CMakeLists.txt', 'Makefile', 'makefile', 'GNUmakefile']
+
+
+def is_source(filename: str) -> bool:
+    """Check if a file is a source, a header or a build script
+
+    Args:
+        filename (str): name of the file
+
+    Returns:
+        bool: True if the file is only read by the builds
+    """
+    return filename in BUILD_SCRIPTS or os.path.splitext(filename)[-1].lower() in SOURCE_EXTENSIONS
+
+
+def replace_file(path_to_src: str, path_to_dst: str):
+    """Copy a file with its metadata to a new file renamed over the destination. The destination is never
+    written in place, so that a file it shares its inode with (e.g. a hardlink of the content store) is not
+    modified
+
+    Args:
+        path_to_src (str): path to source
+        path_to_dst (str): path to destination
+    """
+    fd, path_to_tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path_to_dst)), prefix='.tmp-')
+    os.close(fd)
+    try:
+        shutil.copy2(path_to_src, path_to_tmp)
+        os.replace(path_to_tmp, path_to_dst)
+    except BaseException:
+        os.remove(path_to_tmp)
+        raise
+
+
+def hash_file(path_to_file: str, hasher=None, chunk_size: int = 1 << 20):
+    """Feed the content of a file to a hasher
+
+    Args:
+        path_to_file (str): path to file
+        hasher (optional): hashlib object to update. Defaults to a new sha1.
+        chunk_size (int, optional): size of read buffer. Defaults to 1MB.
+
+    Returns:
+        hashlib object
+    """
+    hasher = hasher if hasher is not None else hashlib.sha1()
+    with open(path_to_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher
@@ -1,14 +1,19 @@
 import os
 import os.path as osp
 import glob2
-from typing import List
+from typing import Counter, Dict, Iterator, List, Optional, Tuple
+import collections
+from array import array
 import argparse
 import difflib
-from io import StringIO
 import coloredlogs
 import logging
 import tqdm
 import re
+import multiprocessing
+
+from .fingerprint import FingerprintIndex
+from .preprocess import SourceFile, Vocabulary, preprocess
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(level='DEBUG')
@@ -40,6 +45,15 @@ def parse_args():
     parser.add_argument('--use_basename', type=bool, default=False)
     parser.add_argument('--path_depth', type=int, default=2)
     parser.add_argument('--ignore_pattern', type=str, default='\.\.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes comparing pairs')
+    parser.add_argument('--engine', type=str, choices=['fingerprint', 'exact'], default='exact',
+                        help='exact: diff all pairs, fingerprint: only diff pairs sharing winnowed k-gram fingerprints (faster, may miss pairs made of boilerplate)')
+    parser.add_argument('--normalize', action='store_true', default=False,
+                        help='Compare token normalized source: comments and whitespace stripped, identifiers and literals renamed')
+    parser.add_argument('--kgram', type=int, default=5, help='Length of k-grams of tokens')
+    parser.add_argument('--window', type=int, default=4, help='Size of winnowing window')
+    parser.add_argument('--max_df', type=float, default=0.2,
+                        help='Ignore fingerprints shared by more than this fraction of files')
     # parser.add_argument('--debug', action='store_true')
     # parser.add_argument('--verbose', action='store_true')
     # parser.add_argument('--quiet', action='store_true')
@@ -67,14 +81,254 @@ def html_comp(in_lines1: list, in_lines2: list, out_file: str):
         f.writelines(result)
 
 
-def context_comp(in_lines1: list, in_lines2: list, out_file: str = None):
-    d = difflib.context_diff(in_lines1, in_lines2)
-    buf = StringIO()
-    buf.writelines(d)
-    if out_file is not None and out_file != '':
-        with open(out_file, 'w') as f:
-            f.writelines(d)
-    return len(buf.getvalue()), buf
+# Pair = (index1, index2), Chunk = ('rows', first_row, last_row) | ('pairs', [Pair, ...])
+Pair = Tuple[int, int]
+Chunk = Tuple
+
+# Minimal length of a non-empty context diff: '*** \n--- \n***************\n*** 1 ****\n--- 1 ----\n'
+CONTEXT_DIFF_OVERHEAD = 48
+# Tiers of the comparison pipeline, in order
+TIERS = ['length', 'multiset', 'diff']
+
+# Shared by the worker processes, set once per process by _init_worker
+_worker_line_ids: Optional[List[array]] = None
+_worker_id_lengths: Optional[array] = None
+_worker_sizes: Optional[List[int]] = None
+_worker_counters: Optional[List[Counter[int]]] = None
+_worker_threshold: int = 0
+
+
+def _init_worker(file_line_ids: List[array], id_lengths: array, threshold: int):
+    """Initialize a worker process with the integer coded lines of all files
+
+    Args:
+        file_line_ids (List[array]): Line ids of each file
+        id_lengths (array): Length of the line of each id
+        threshold (int): Threshold in chars
+    """
+    global _worker_line_ids, _worker_id_lengths, _worker_sizes, _worker_counters, _worker_threshold
+    _worker_line_ids = file_line_ids
+    _worker_id_lengths = id_lengths
+    _worker_sizes = [sum(id_lengths[line_id] for line_id in line_ids) for line_ids in file_line_ids]
+    _worker_counters = [collections.Counter(line_ids) for line_ids in file_line_ids]
+    _worker_threshold = threshold
+
+
+def _format_range_context(start: int, stop: int) -> str:
+    """Same as difflib._format_range_context
+    """
+    beginning = start + 1
+    length = stop - start
+    if not length:
+        beginning -= 1
+    if length <= 1:
+        return '{}'.format(beginning)
+    return '{},{}'.format(beginning, beginning + length - 1)
+
+
+def context_diff_length(line_ids1: array, line_ids2: array, id_lengths: array, n: int = 3) -> int:
+    """Length of difflib.context_diff of two files, computed from their line ids without formatting the diff
+
+    Args:
+        line_ids1 (array): Line ids of file 1
+        line_ids2 (array): Line ids of file 2
+        id_lengths (array): Length of the line of each id
+        n (int, optional): Number of context lines. Defaults to 3.
+
+    Returns:
+        int: Number of chars of the diff
+    """
+    total = 0
+    for group in difflib.SequenceMatcher(None, line_ids1, line_ids2).get_grouped_opcodes(n):
+        if total == 0:
+            total += len('*** \n--- \n')
+        first, last = group[0], group[-1]
+        total += len('***************\n')
+        total += len('*** {} ****\n'.format(_format_range_context(first[1], last[2])))
+        if any(tag in ('replace', 'delete') for tag, _, _, _, _ in group):
+            for tag, i1, i2, _, _ in group:
+                if tag != 'insert':
+                    total += sum(id_lengths[line_id] for line_id in line_ids1[i1:i2]) + 2 * (i2 - i1)
+        total += len('--- {} ----\n'.format(_format_range_context(first[3], last[4])))
+        if any(tag in ('replace', 'insert') for tag, _, _, _, _ in group):
+            for tag, _, _, j1, j2 in group:
+                if tag != 'delete':
+                    total += sum(id_lengths[line_id] for line_id in line_ids2[j1:j2]) + 2 * (j2 - j1)
+    return total
+
+
+def length_bound(index1: int, index2: int) -> int:
+    """Lower bound of the context diff length from the number of chars and lines, like real_quick_ratio
+
+    Unmatched lines are printed with a 2-char prefix, there are at least |n1 - n2| of them and they hold at least
+    |chars1 - chars2| chars.
+
+    Returns:
+        int: Lower bound in chars
+    """
+    delta_chars = abs(_worker_sizes[index1] - _worker_sizes[index2])
+    delta_lines = abs(len(_worker_line_ids[index1]) - len(_worker_line_ids[index2]))
+    if delta_chars == 0 and delta_lines == 0:
+        return 0
+    return CONTEXT_DIFF_OVERHEAD + delta_chars + 2 * delta_lines
+
+
+def multiset_bound(index1: int, index2: int) -> int:
+    """Lower bound of the context diff length from the line multisets, like quick_ratio
+
+    A line can only be matched as many times as it appears in both files, the others are printed with a 2-char
+    prefix.
+
+    Returns:
+        int: Lower bound in chars
+    """
+    counter1, counter2 = _worker_counters[index1], _worker_counters[index2]
+    bound = 0
+    for line_id, count in counter1.items():
+        bound += (_worker_id_lengths[line_id] + 2) * max(0, count - counter2.get(line_id, 0))
+    for line_id, count in counter2.items():
+        bound += (_worker_id_lengths[line_id] + 2) * max(0, count - counter1.get(line_id, 0))
+    return bound + CONTEXT_DIFF_OVERHEAD if bound > 0 else 0
+
+
+def tiered_comp(index1: int, index2: int) -> Tuple[str, int]:
+    """Compare two files, the full diff is computed only if the cheap bounds can not reject the pair
+
+    Returns:
+        Tuple[str, int]: Tier that decided, length of diff (or its lower bound if rejected early)
+    """
+    bound = length_bound(index1, index2)
+    if bound >= _worker_threshold:
+        return 'length', bound
+    bound = multiset_bound(index1, index2)
+    if bound >= _worker_threshold:
+        return 'multiset', bound
+    return 'diff', context_diff_length(_worker_line_ids[index1], _worker_line_ids[index2], _worker_id_lengths)
+
+
+def _iter_chunk(chunk: Chunk) -> Iterator[Pair]:
+    if chunk[0] == 'rows':
+        num_files = len(_worker_line_ids)
+        for index1 in range(chunk[1], chunk[2]):
+            for index2 in range(index1 + 1, num_files):
+                yield index1, index2
+    else:
+        yield from chunk[1]
+
+
+def compare_chunk(chunk: Chunk) -> Tuple[Dict[str, int], List[Tuple[int, int, int]]]:
+    """Compare the pairs of a chunk in a worker
+
+    Args:
+        chunk (Chunk): Chunk of pairs
+
+    Returns:
+        Tuple[Dict[str, int], List[Tuple[int, int, int]]]: Number of pairs eliminated by each tier, (index1, index2,
+        num_chars) of the pairs under threshold
+    """
+    eliminated: Dict[str, int] = {tier: 0 for tier in TIERS}
+    flagged: List[Tuple[int, int, int]] = list()
+    for index1, index2 in _iter_chunk(chunk):
+        tier, num_chars = tiered_comp(index1, index2)
+        if num_chars < _worker_threshold:
+            flagged.append((index1, index2, num_chars))
+        else:
+            eliminated[tier] += 1
+    return eliminated, flagged
+
+
+def chunk_rows(num_files: int, num_chunks: int) -> List[Chunk]:
+    """Split the upper triangle of the pair matrix into row ranges holding about the same number of pairs
+
+    Args:
+        num_files (int): Number of files
+        num_chunks (int): Number of chunks wanted
+
+    Returns:
+        List[Chunk]: Chunks
+    """
+    total = num_files * (num_files - 1) // 2
+    target = max(1, total // max(1, num_chunks))
+    chunks: List[Chunk] = list()
+    first_row, acc = 0, 0
+    for row in range(num_files):
+        acc += num_files - 1 - row
+        if acc >= target:
+            chunks.append(('rows', first_row, row + 1))
+            first_row, acc = row + 1, 0
+    if first_row < num_files:
+        chunks.append(('rows', first_row, num_files))
+    return chunks
+
+
+def chunk_pairs(pairs: List[Pair], num_chunks: int) -> List[Chunk]:
+    """Split a list of pairs into chunks of equal size
+
+    Args:
+        pairs (List[Pair]): Pairs
+        num_chunks (int): Number of chunks wanted
+
+    Returns:
+        List[Chunk]: Chunks
+    """
+    size = max(1, -(-len(pairs) // max(1, num_chunks)))
+    return [('pairs', pairs[i:i + size]) for i in range(0, len(pairs), size)]
+
+
+def iter_results(chunks: List[Chunk], file_line_ids: List[array], id_lengths: array, threshold: int, workers: int) -> Iterator[Tuple[Dict[str, int], List[Tuple[int, int, int]]]]:
+    """Compare chunks, in a process pool if workers > 1. Results are yielded as soon as a chunk is done
+
+    Args:
+        chunks (List[Chunk]): Chunks
+        file_line_ids (List[array]): Line ids of each file
+        id_lengths (array): Length of the line of each id
+        threshold (int): Threshold in chars
+        workers (int): Number of processes
+
+    Yields:
+        Tuple[Dict[str, int], List[Tuple[int, int, int]]]: Results of compare_chunk
+    """
+    if workers <= 1:
+        _init_worker(file_line_ids, id_lengths, threshold)
+        yield from map(compare_chunk, chunks)
+    else:
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(file_line_ids, id_lengths, threshold)) as pool:
+            yield from pool.imap_unordered(compare_chunk, chunks)
+
+
+def iter_pairs_fingerprint(sources: List[SourceFile], args) -> Iterator[Tuple[int, int]]:
+    """Iterate over the pairs of files that share fingerprints
+
+    Args:
+        sources (List[SourceFile]): Preprocessed files
+        args: Arguments
+
+    Yields:
+        Tuple[int, int]: (index1, index2) with index1 < index2
+    """
+    index = FingerprintIndex(max_df=args.max_df)
+    for source in sources:
+        index.add(source, k=args.kgram, window=args.window)
+    return index.candidates(args.threshold)
+
+
+def report_path(file1: str, file2: str, args) -> str:
+    """Path of the html report of a pair
+
+    Args:
+        file1 (str): File name
+        file2 (str): File name
+        args: Arguments
+
+    Returns:
+        str: Path to report
+    """
+    if args.use_basename:
+        return osp.join(
+            args.output_dir, '{}-{}.html'.format(osp.basename(file1), osp.basename(file2)))
+    else:
+        return osp.join(args.output_dir, '.'.join(file1.split(
+            os.sep)[-args.path_depth:]) + '-' + '.'.join(file2.split(os.sep)[-args.path_depth:]) + '.html')
 
 
 def main():
@@ -90,35 +344,43 @@ def main():
         os.makedirs(args.output_dir)
 
     logging.info(f"Processing files in {args.base_dir}")
-    list_of_files = find_c_source_files(args.base_dir, ext=args.ext)
+    list_of_files = [f for f in find_c_source_files(args.base_dir, ext=args.ext)
+                     if (not len(re.findall(DEFAULT_IGNORE_PATTERNS, f)) > 0) and (not len(re.findall(args.ignore_pattern, f)) > 0)]
     logging.info(f"Reading {len(list_of_files)} files")
     file_contents = read_files(list_of_files)
-    num_files = len(file_contents)
+    num_files = len(list_of_files)
+
+    # Preprocess once per file, the integer coded representation is shared by all comparisons
+    token_vocabulary, line_vocabulary = Vocabulary(), Vocabulary()
+    sources = [preprocess(file_contents[file], token_vocabulary, line_vocabulary, normalize=args.normalize)
+               for file in tqdm.tqdm(list_of_files, desc='Preprocessing')]
+    id_lengths = array('i', map(len, line_vocabulary.codes.keys()))
+    file_line_ids = [source.line_ids for source in sources]
+    # Several chunks per worker so that the load stays balanced
+    num_chunks = max(1, args.workers) * 8
 
-    with tqdm.tqdm(total=num_files) as pbar:
-        for index1 in range(num_files):
-            pbar.set_description(f"Processing file {list_of_files[index1]}")
-            for index2 in range(index1+1, num_files):
+    if args.engine == 'fingerprint':
+        pairs = list(iter_pairs_fingerprint(sources, args))
+        logging.info(f"Comparing {len(pairs)} candidate pairs out of {num_files * (num_files - 1) // 2}")
+        total, chunks = len(pairs), chunk_pairs(pairs, num_chunks)
+    else:
+        total, chunks = num_files * (num_files - 1) // 2, chunk_rows(num_files, num_chunks)
+
+    eliminated: Dict[str, int] = {tier: 0 for tier in TIERS}
+    with tqdm.tqdm(total=total) as pbar:
+        for chunk_eliminated, flagged in iter_results(chunks, file_line_ids, id_lengths, args.threshold, args.workers):
+            for index1, index2, num_chars in flagged:
                 file1 = list_of_files[index1]
                 file2 = list_of_files[index2]
-                if (not len(re.findall(DEFAULT_IGNORE_PATTERNS, file1)) > 0) and (not len(re.findall(DEFAULT_IGNORE_PATTERNS, file2)) > 0):
-                    if (not len(re.findall(args.ignore_pattern, file1)) > 0) and (not len(re.findall(args.ignore_pattern, file2)) > 0):
-                        num_chars, _ = context_comp(file_contents[file1].split(
-                            '\n'), file_contents[file2].split('\n'))
-
-                        if num_chars < args.threshold:
-                            logging.warning('{} and {} are {} chars different'.format(
-                                file1, file2, num_chars))
-                            if args.use_basename:
-                                report_name = osp.join(
-                                    args.output_dir, '{}-{}.html'.format(osp.basename(file1), osp.basename(file2)))
-                            else:
-                                report_name = osp.join(args.output_dir, '.'.join(file1.split(
-                                    os.sep)[-args.path_depth:]) + '-' + '.'.join(file2.split(os.sep)[-args.path_depth:]) + '.html')
-                            html_comp(file_contents[file1].split('\n'),
-                                      file_contents[file2].split('\n'),
-                                      report_name)
-            pbar.update()
+                pbar.set_description(f"Processing file {file1}")
+                logging.warning('{} and {} are {} chars different'.format(
+                    file1, file2, num_chars))
+                html_comp(sources[index1].lines, sources[index2].lines, report_path(file1, file2, args))
+            for tier in TIERS:
+                eliminated[tier] += chunk_eliminated[tier]
+            pbar.update(sum(chunk_eliminated.values()) + len(flagged))
+
+    logging.info('Pairs eliminated by tier: {}'.format(', '.join(['{}={}'.format(tier, eliminated[tier]) for tier in TIERS])))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,146 @@
+import zlib
+import bisect
+from array import array
+from typing import Dict, Iterator, List, Set, Tuple
+
+from .preprocess import SourceFile
+
+
+def kgram_hashes(tokens: array, k: int) -> List[int]:
+    """Hash every k-gram of tokens, the hash is stable across processes
+
+    Args:
+        tokens (array): Integer coded tokens
+        k (int): Length of k-gram
+
+    Returns:
+        List[int]: Hashes
+    """
+    data = tokens.tobytes()
+    width = k * tokens.itemsize
+    return [zlib.crc32(data[i:i + width]) for i in range(0, len(data) - width + 1, tokens.itemsize)]
+
+
+def winnow(hashes: List[int], window: int) -> Set[int]:
+    """Select fingerprints with the winnowing algorithm: the rightmost minimal hash of every window
+
+    Args:
+        hashes (List[int]): k-gram hashes
+        window (int): Size of window
+
+    Returns:
+        Set[int]: Fingerprints
+    """
+    if len(hashes) == 0:
+        return set()
+    if len(hashes) <= window:
+        return {min(hashes)}
+    fingerprints: Set[int] = set()
+    for start in range(len(hashes) - window + 1):
+        section = hashes[start:start + window]
+        fingerprints.add(min(section))
+    return fingerprints
+
+
+def fingerprint(tokens: array, k: int = 5, window: int = 4) -> Set[int]:
+    """Compute the fingerprints of a source file
+
+    Args:
+        tokens (array): Integer coded tokens
+        k (int, optional): Length of k-gram. Defaults to 5.
+        window (int, optional): Size of winnowing window. Defaults to 4.
+
+    Returns:
+        Set[int]: Fingerprints
+    """
+    return winnow(kgram_hashes(tokens, k), window)
+
+
+class FingerprintIndex:
+    """Inverted index from fingerprint to files, used to find the pairs of files worth comparing
+    """
+
+    def __init__(self, max_df: float = 0.2, min_df_cutoff: int = 10):
+        """
+        Args:
+            max_df (float, optional): Fingerprints shared by more than this fraction of files are boilerplate
+                and ignored. Defaults to 0.2.
+            min_df_cutoff (int, optional): Fingerprints shared by at most this number of files are never ignored.
+                Defaults to 10.
+        """
+        self.max_df: float = max_df
+        self.min_df_cutoff: int = min_df_cutoff
+        self.postings: Dict[int, List[int]] = dict()
+        self.lengths: List[int] = list()
+        self.digests: List[int] = list()
+
+    def add(self, source: SourceFile, k: int = 5, window: int = 4) -> int:
+        """Add a file to the index
+
+        Args:
+            source (SourceFile): Preprocessed source
+            k (int, optional): Length of k-gram. Defaults to 5.
+            window (int, optional): Size of winnowing window. Defaults to 4.
+
+        Returns:
+            int: Index of the file
+        """
+        index = len(self.lengths)
+        for fp in fingerprint(source.tokens, k, window):
+            self.postings.setdefault(fp, []).append(index)
+        self.lengths.append(source.size)
+        self.digests.append(source.digest)
+        return index
+
+    def candidates(self, threshold: int) -> Iterator[Tuple[int, int]]:
+        """List the pairs of files that may be less than threshold chars different
+
+        A pair is a candidate if both files share a fingerprint that is not boilerplate, or if they are identical.
+        Files without any fingerprint left (too short or only boilerplate) are compared to every file of
+        similar length.
+
+        This is a heuristic, not a bound: two files made of the same boilerplate and a few different lines
+        share no fingerprint left after the boilerplate is ignored, and are not listed although their diff
+        may be under threshold. Use the exact engine when no pair may be missed.
+
+        Args:
+            threshold (int): Threshold in chars
+
+        Yields:
+            Tuple[int, int]: (index1, index2) with index1 < index2, in ascending order
+        """
+        num_files = len(self.lengths)
+        cutoff = max(self.min_df_cutoff, int(self.max_df * num_files))
+        pairs: Set[Tuple[int, int]] = set()
+        indexed: Set[int] = set()
+
+        for files in self.postings.values():
+            if len(files) > cutoff:
+                continue
+            indexed.update(files)
+            for position, index1 in enumerate(files):
+                for index2 in files[position + 1:]:
+                    pairs.add((index1, index2))
+
+        # Identical files are always reported
+        groups: Dict[Tuple[int, int], List[int]] = dict()
+        for index in range(num_files):
+            groups.setdefault((self.digests[index], self.lengths[index]), []).append(index)
+        for files in groups.values():
+            for position, index1 in enumerate(files):
+                for index2 in files[position + 1:]:
+                    pairs.add((index1, index2))
+
+        # Orphan files are compared by length, the diff is at least as long as the difference of lengths
+        by_length = sorted(range(num_files), key=lambda i: self.lengths[i])
+        sorted_lengths = [self.lengths[i] for i in by_length]
+        for index1 in range(num_files):
+            if index1 in indexed:
+                continue
+            low = bisect.bisect_left(sorted_lengths, self.lengths[index1] - threshold)
+            high = bisect.bisect_right(sorted_lengths, self.lengths[index1] + threshold)
+            for index2 in by_length[low:high]:
+                if index2 != index1:
+                    pairs.add((min(index1, index2), max(index1, index2)))
+
+        return iter(sorted(pairs))
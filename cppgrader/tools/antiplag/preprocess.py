@@ -0,0 +1,125 @@
+import re
+import zlib
+from array import array
+from typing import Dict, List, NamedTuple, Set
+
+# Tokens of C/C++ source, comments are matched so that they can be dropped
+TOKEN_PATTERN = re.compile(r'''
+    (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+   |(?P<string>"(?:\\.|[^"\\\n])*")
+   |(?P<char>'(?:\\.|[^'\\\n])*')
+   |(?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+   |(?P<ident>[A-Za-z_]\w*)
+   |(?P<op>::|->\*?|\+\+|--|<<=?|>>=?|[<>=!+\-*/%&|^]=|&&|\|\||\.\.\.|\.\*|\#\#|\S)
+''', re.S | re.X)
+
+# Identifiers that are kept as is, the others are mapped to a canonical token
+KEYWORDS: Set[str] = {
+    'alignas', 'alignof', 'and', 'and_eq', 'asm', 'auto', 'bitand', 'bitor', 'bool', 'break', 'case', 'catch',
+    'char', 'char16_t', 'char32_t', 'class', 'compl', 'const', 'constexpr', 'const_cast', 'continue', 'decltype',
+    'default', 'delete', 'do', 'double', 'dynamic_cast', 'else', 'enum', 'explicit', 'export', 'extern', 'false',
+    'float', 'for', 'friend', 'goto', 'if', 'inline', 'int', 'long', 'mutable', 'namespace', 'new', 'noexcept',
+    'not', 'not_eq', 'nullptr', 'operator', 'or', 'or_eq', 'private', 'protected', 'public', 'register',
+    'reinterpret_cast', 'return', 'short', 'signed', 'sizeof', 'static', 'static_assert', 'static_cast', 'struct',
+    'switch', 'template', 'this', 'throw', 'true', 'try', 'typedef', 'typeid', 'typename', 'union', 'unsigned',
+    'using', 'virtual', 'void', 'volatile', 'wchar_t', 'while', 'xor', 'xor_eq',
+    # Preprocessor directives
+    'include', 'define', 'undef', 'ifdef', 'ifndef', 'elif', 'endif', 'pragma', 'error',
+}
+
+# Canonical tokens of identifiers and literals
+CANONICAL_TOKENS: Dict[str, str] = {'ident': 'I', 'number': 'N', 'string': 'S', 'char': 'C'}
+
+
+class Vocabulary:
+    """Map strings (tokens, lines) to consecutive integers
+    """
+
+    def __init__(self):
+        self.codes: Dict[str, int] = dict()
+
+    def __call__(self, item: str) -> int:
+        code = self.codes.get(item)
+        if code is None:
+            code = self.codes[item] = len(self.codes)
+        return code
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+class SourceFile(NamedTuple):
+    """Representation of a source file, computed once and reused by all comparisons
+    """
+    lines: List[str]  # Raw lines, used by the html report
+    line_ids: array  # Integer code of each compared line
+    line_lengths: array  # Length of each compared line
+    tokens: array  # Integer code of each normalized token
+    digest: int  # Checksum of compared lines
+
+    @property
+    def size(self) -> int:
+        """Number of chars of compared lines
+        """
+        return sum(self.line_lengths)
+
+
+def tokenize(content: str) -> List[str]:
+    """Tokenize C/C++ source, comments and whitespace are stripped, identifiers and literals are normalized
+
+    Args:
+        content (str): Source code
+
+    Returns:
+        List[str]: Normalized tokens
+    """
+    return [token for _, token in _iter_tokens(content)]
+
+
+def _iter_tokens(content: str):
+    """Iterate over normalized tokens and their line number
+    """
+    lineno, position = 0, 0
+    for match in TOKEN_PATTERN.finditer(content):
+        kind = match.lastgroup
+        lineno += content.count('\n', position, match.start())
+        position = match.start()
+        if kind == 'comment':
+            continue
+        if kind == 'op' or (kind == 'ident' and match.group() in KEYWORDS):
+            yield lineno, match.group()
+        else:
+            yield lineno, CANONICAL_TOKENS[kind]
+
+
+def preprocess(content: str, token_vocabulary: Vocabulary, line_vocabulary: Vocabulary, normalize: bool = False) -> SourceFile:
+    """Build the representation of a source file
+
+    Args:
+        content (str): Source code
+        token_vocabulary (Vocabulary): Vocabulary of tokens, shared by all files
+        line_vocabulary (Vocabulary): Vocabulary of lines, shared by all files
+        normalize (bool, optional): Compare normalized lines (one line of space separated tokens per line of source,
+            empty lines dropped) instead of raw lines. Defaults to False.
+
+    Returns:
+        SourceFile: Representation
+    """
+    lines = content.split('\n')
+    tokens = array('i')
+    if normalize:
+        normalized_lines: List[List[str]] = [list() for _ in lines]
+        for lineno, token in _iter_tokens(content):
+            tokens.append(token_vocabulary(token))
+            normalized_lines[lineno].append(token)
+        compared_lines = [' '.join(line) for line in normalized_lines if len(line) > 0]
+    else:
+        tokens.extend(map(token_vocabulary, tokenize(content)))
+        compared_lines = lines
+
+    line_ids = array('i', map(line_vocabulary, compared_lines))
+    return SourceFile(lines=lines,
+                      line_ids=line_ids,
+                      line_lengths=array('i', map(len, compared_lines)),
+                      tokens=tokens,
+                      digest=zlib.crc32(line_ids.tobytes()))
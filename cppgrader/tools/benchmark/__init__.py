@@ -0,0 +1 @@
+from .benchmark import main as main
\ No newline at end of file
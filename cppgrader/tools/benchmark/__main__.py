@@ -0,0 +1,3 @@
+if __name__ == '__main__':
+    from cppgrader.tools.benchmark import main
+    main()
\ No newline at end of file
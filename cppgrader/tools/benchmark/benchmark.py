@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import os.path as osp
+import platform
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+import coloredlogs
+import logging
+
+from ...app import __version__
+from .generator import generate_submissions
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(level='INFO')
+
+STAGES: List[str] = ['startup', 'filter', 'builder', 'reporter', 'antiplag']
+# The import time is the best of this number of runs
+STARTUP_RUNS: int = 3
+# 'import time: <self us> | <cumulative us> | <indentation><module>' printed by python -X importtime
+IMPORTTIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$', re.MULTILINE)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=100, help='Number of synthetic students')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the generator')
+    parser.add_argument('--duplicate_ratio', type=float, default=0.3, help='Fraction of near-duplicate solutions')
+    parser.add_argument('--broken_ratio', type=float, default=0.1, help='Fraction of submissions that do not compile')
+    parser.add_argument('--stages', type=str, default=','.join(STAGES), help='Stages to run, comma separated in {}'.format(','.join(STAGES)))
+    parser.add_argument('--work_dir', type=str, default=None, help='Directory of the generated submissions and outputs, default to a temporary directory')
+    parser.add_argument('--app_args', type=str, default='', help='Extra arguments passed to every cppgrader app, e.g. "-j 8 --native_build"')
+    parser.add_argument('--antiplag_args', type=str, default='', help='Extra arguments passed to antiplag')
+    parser.add_argument('--output', type=str, default='./benchmark.json', help='Path to the result (JSON)')
+    parser.add_argument('--baseline', type=str, default=None, help='Result of a previous run to compare with')
+    parser.add_argument('--startup_budget', type=float, default=100, help='Fail if importing the CLI takes longer than this number of ms, 0 for no limit')
+    return parser.parse_args()
+
+
+def run_stage(instruction: List[str], cwd: str) -> Dict:
+    """Run a stage in its own process
+
+    Args:
+        instruction (List[str]): instruction to run
+        cwd (str): working directory
+
+    Returns:
+        Dict: returncode, seconds, peak_rss_mb (the largest of the stage and of its children, e.g. compilers)
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(instruction, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status >> 8
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        logging.warning('{} exited with {}:\n{}'.format(' '.join(instruction), process.returncode, str(stderr[-2048:], encoding='UTF-8', errors='replace')))
+    # ru_maxrss is in KB on Linux
+    return {'returncode': process.returncode, 'seconds': seconds, 'peak_rss_mb': rusage.ru_maxrss / 1024}
+
+
+def measure_import_time(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """Measure the time to import a module and its parent packages with python -X importtime, the startup of
+    the interpreter is excluded
+
+    Args:
+        module (str): module to import, e.g. cppgrader.app
+
+    Returns:
+        Tuple[float, List[Tuple[str, float]]]: import time in ms, the 5 modules that take the longest to import
+            themselves (name, ms)
+    """
+    ret = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    parts = module.split('.')
+    roots = set(['.'.join(parts[:i + 1]) for i in range(len(parts))])
+    total = 0.0
+    modules: List[Tuple[str, float]] = list()
+    pending: List[Tuple[str, float]] = list()
+    # A module is printed after its imports, at the indentation of its depth
+    for match in IMPORTTIME_PATTERN.finditer(str(ret.stderr, encoding='UTF-8', errors='replace')):
+        self_us, cumulative_us, indentation, name = int(match.group(1)), int(match.group(2)), match.group(3), match.group(4)
+        pending.append((name, self_us / 1000))
+        if len(indentation) == 0:
+            if name in roots:
+                total += cumulative_us / 1000
+                modules += pending
+            pending = list()
+    if ret.returncode != 0 or not roots.issubset([name for name, _ in modules]):
+        logging.warning('Could not measure the import of {}'.format(module))
+    return total, sorted(modules, key=lambda item: -item[1])[:5]
+
+
+def stage_instruction(stage: str, path_to_submissions: str, path_to_output: str, path_to_antiplag: str, args) -> List[str]:
+    if stage == 'startup':
+        return [sys.executable, '-m', 'cppgrader.app', '--help']
+    if stage == 'antiplag':
+        return [sys.executable, '-m', 'cppgrader.tools.antiplag', '--base_dir', path_to_output, '--output_dir', path_to_antiplag] + shlex.split(args.antiplag_args)
+    extra = ['--keep_output'] if stage != 'filter' else []
+    return [sys.executable, '-m', 'cppgrader.app', '-a', stage, '-s', path_to_submissions, '-o', path_to_output] + extra + shlex.split(args.app_args)
+
+
+def compare(result: Dict, baseline: Dict):
+    """Log the ratio of the time and memory of each stage to a baseline
+
+    Args:
+        result (Dict): result of this run
+        baseline (Dict): result of a previous run
+    """
+    if result['params']['students'] != baseline['params']['students']:
+        logging.warning('The baseline has {} students, this run has {}'.format(baseline['params']['students'], result['params']['students']))
+    for stage, metrics in result['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        previous = baseline['stages'][stage]
+        if 'import_ms' in metrics and 'import_ms' in previous:
+            logging.info('{:>10}: import x{:.2f} ({:.1f}ms -> {:.1f}ms)'.format(
+                stage, metrics['import_ms'] / max(previous['import_ms'], 1e-9), previous['import_ms'], metrics['import_ms']))
+        logging.info('{:>10}: time x{:.2f} ({:.2f}s -> {:.2f}s), peak memory x{:.2f} ({:.1f}MB -> {:.1f}MB)'.format(
+            stage, metrics['seconds'] / max(previous['seconds'], 1e-9), previous['seconds'], metrics['seconds'],
+            metrics['peak_rss_mb'] / max(previous['peak_rss_mb'], 1e-9), previous['peak_rss_mb'], metrics['peak_rss_mb']))
+
+
+def main():
+    args = parse_args()
+    stages = [stage for stage in args.stages.split(',') if stage != '']
+    for stage in stages:
+        if stage not in STAGES:
+            logging.error('Unknown stage {}'.format(stage))
+            sys.exit(1)
+
+    work_dir: str = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='cppgrader-benchmark-')
+    path_to_submissions = osp.join(work_dir, 'submissions')
+    path_to_output = osp.join(work_dir, 'output')
+    path_to_antiplag = osp.join(work_dir, 'antiplag_output')
+    for path in [path_to_submissions, path_to_output, path_to_antiplag]:
+        shutil.rmtree(path, ignore_errors=True)
+
+    start = time.perf_counter()
+    generate_submissions(path_to_submissions, args.students, args.seed, args.duplicate_ratio, args.broken_ratio)
+    logging.info('Generated {} students in {:.2f}s under {}'.format(args.students, time.perf_counter() - start, path_to_submissions))
+
+    result: Dict = {'version': __version__,
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpu_count': os.cpu_count(),
+                    'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'params': {'students': args.students, 'seed': args.seed, 'duplicate_ratio': args.duplicate_ratio,
+                               'broken_ratio': args.broken_ratio, 'app_args': args.app_args, 'antiplag_args': args.antiplag_args},
+                    'stages': dict()}
+    for stage in stages:
+        # Reports are written in the working directory
+        metrics = run_stage(stage_instruction(stage, path_to_submissions, path_to_output, path_to_antiplag, args), work_dir)
+        if stage == 'startup':
+            # The CLI is called many times per assignment by scripts, its imports are measured alone
+            import_ms, heaviest = min([measure_import_time('cppgrader.app') for _ in range(STARTUP_RUNS)], key=lambda item: item[0])
+            metrics['import_ms'] = import_ms
+            metrics['heaviest_imports'] = heaviest
+            logging.info('{:>10}: {:.2f}s, import {:.1f}ms (heaviest: {}), peak memory {:.1f}MB'.format(
+                stage, metrics['seconds'], import_ms, ', '.join(['{} {:.1f}ms'.format(name, ms) for name, ms in heaviest]), metrics['peak_rss_mb']))
+        else:
+            metrics['students_per_second'] = args.students / max(metrics['seconds'], 1e-9)
+            logging.info('{:>10}: {:.2f}s, {:.1f} students/s, peak memory {:.1f}MB'.format(
+                stage, metrics['seconds'], metrics['students_per_second'], metrics['peak_rss_mb']))
+        result['stages'][stage] = metrics
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    logging.info('Result saved to {}'.format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            compare(result, json.load(f))
+    if args.work_dir is None:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    startup = result['stages'].get('startup')
+    if startup is not None and args.startup_budget > 0 and startup['import_ms'] > args.startup_budget:
+        logging.error('Importing the CLI takes {:.1f}ms, over the budget of {:.1f}ms'.format(startup['import_ms'], args.startup_budget))
+        sys.exit(1)
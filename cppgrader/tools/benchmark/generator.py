@@ -0,0 +1,182 @@
+import os
+import random
+import string
+import zipfile
+from typing import Dict, List
+
+# Layouts of a submission, with their weights
+LAYOUTS: Dict[str, int] = {'zip_cmake': 4, 'zip_make': 2, 'zip_nested': 2, 'plain': 2}
+
+UTILS_H = '''#pragma once
+#include <vector>
+
+int sum(const std::vector<int> &values);
+int maximum(const std::vector<int> &values);
+'''
+
+UTILS_CPP = '''#include "utils.h"
+
+int sum(const std::vector<int> &values) {
+    int total = 0;
+    for (int value : values) {
+        total += value;
+    }
+    return total;
+}
+
+int maximum(const std::vector<int> &values) {
+    int best = values.empty() ? 0 : values[0];
+    for (int value : values) {
+        if (value > best) {
+            best = value;
+        }
+    }
+    return best;
+}
+'''
+
+MAIN_CPP = '''#include <iostream>
+#include <vector>
+#include <algorithm>
+#include "utils.h"
+
+int {helper}(const std::vector<int> &{values}) {{
+    int {count} = 0;
+    for (size_t {index} = 0; {index} < {values}.size(); ++{index}) {{
+        if ({values}[{index}] % {modulo} == 0) {{
+            {count}++;
+        }}
+    }}
+    return {count};
+}}
+
+int main() {{
+    std::vector<int> {values};
+    int {value};
+    while (std::cin >> {value}) {{
+        {values}.push_back({value});
+    }}
+    std::sort({values}.begin(), {values}.end());
+    std::cout << sum({values}) << " " << maximum({values}) << " " << {helper}({values}) << std::endl;
+    return 0;
+}}
+'''
+
+CMAKELISTS = '''cmake_minimum_required(VERSION 3.5)
+project(homework CXX)
+set(CMAKE_CXX_STANDARD 14)
+include_directories(include)
+add_executable(main src/main.cpp src/utils.cpp)
+'''
+
+MAKEFILE = '''main: main.cpp utils.cpp utils.h
+\tg++ -std=c++14 -I. main.cpp utils.cpp -o main
+'''
+
+
+def _identifier(rng: random.Random) -> str:
+    return rng.choice(string.ascii_lowercase) + ''.join(rng.choice(string.ascii_lowercase + string.digits) for _ in range(rng.randint(3, 9)))
+
+
+def generate_solution(rng: random.Random) -> Dict[str, str]:
+    """Generate the identifiers of an original solution
+
+    Args:
+        rng (random.Random): random generator
+
+    Returns:
+        Dict[str, str]: parameters of MAIN_CPP
+    """
+    return {'helper': _identifier(rng), 'values': _identifier(rng), 'count': _identifier(rng),
+            'index': _identifier(rng), 'value': _identifier(rng), 'modulo': str(rng.randint(2, 9))}
+
+
+def render_solution(rng: random.Random, solution: Dict[str, str], mutate: bool, broken: bool) -> str:
+    """Render main.cpp of a solution
+
+    Args:
+        rng (random.Random): random generator
+        solution (Dict[str, str]): parameters of MAIN_CPP
+        mutate (bool): rename an identifier and add comments, a near-duplicate of the solution
+        broken (bool): add a syntax error
+
+    Returns:
+        str: content of main.cpp
+    """
+    solution = dict(solution)
+    if mutate:
+        solution[rng.choice(['helper', 'count', 'index'])] = _identifier(rng)
+    lines = MAIN_CPP.format(**solution).split('\n')
+    if mutate:
+        for _ in range(rng.randint(1, 3)):
+            lines.insert(rng.randint(0, len(lines)), '// {}'.format(' '.join(_identifier(rng) for _ in range(4))))
+    if broken:
+        lines.insert(len(lines) - 3, '    return {value} +;'.format(**solution))
+    return '\n'.join(lines)
+
+
+def _student_name(rng: random.Random, index: int) -> str:
+    # 5xxxxxxxxxxxNAME
+    return '5{:011d}{}'.format(index, ''.join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(3, 8))))
+
+
+def _write_zip(path_to_archive: str, members: Dict[str, str]):
+    with zipfile.ZipFile(path_to_archive, 'w', zipfile.ZIP_DEFLATED) as f:
+        for name, content in members.items():
+            f.writestr(name, content)
+
+
+def generate_submissions(path_to_submissions: str,
+                         num_students: int,
+                         seed: int = 0,
+                         duplicate_ratio: float = 0.3,
+                         broken_ratio: float = 0.1) -> List[str]:
+    """Generate a Canvas submission directory: 5xxxxxxxxxxxNAME_<id>_<id>_<filename>, zip archives with CMake,
+    Makefile or nested layouts and __MACOSX junk, or separate plain files
+
+    Args:
+        path_to_submissions (str): submission directory, created if missing
+        num_students (int): number of students
+        seed (int, optional): random seed, the same seed generates the same submissions. Defaults to 0.
+        duplicate_ratio (float, optional): fraction of students submitting a near-duplicate of another solution. Defaults to 0.3.
+        broken_ratio (float, optional): fraction of submissions that do not compile. Defaults to 0.1.
+
+    Returns:
+        List[str]: names of the students
+    """
+    rng = random.Random(seed)
+    os.makedirs(path_to_submissions, exist_ok=True)
+    layouts = [layout for layout, weight in LAYOUTS.items() for _ in range(weight)]
+    solutions: List[Dict[str, str]] = list()
+    students: List[str] = list()
+
+    for index in range(num_students):
+        student = _student_name(rng, index)
+        students.append(student)
+        mutate = len(solutions) > 0 and rng.random() < duplicate_ratio
+        if mutate:
+            solution = rng.choice(solutions)
+        else:
+            solution = generate_solution(rng)
+            solutions.append(solution)
+        main_cpp = render_solution(rng, solution, mutate, rng.random() < broken_ratio)
+        prefix = '{}_{}_{}_'.format(student, rng.randint(100000, 999999), rng.randint(1000000, 9999999))
+
+        layout = rng.choice(layouts)
+        if layout == 'zip_cmake':
+            _write_zip(os.path.join(path_to_submissions, prefix + 'homework.zip'),
+                       {'homework/CMakeLists.txt': CMAKELISTS, 'homework/src/main.cpp': main_cpp, 'homework/src/utils.cpp': UTILS_CPP,
+                        'homework/include/utils.h': UTILS_H, '__MACOSX/homework/src/._main.cpp': '\0' * 64})
+        elif layout == 'zip_make':
+            _write_zip(os.path.join(path_to_submissions, prefix + 'homework.zip'),
+                       {'Makefile': MAKEFILE, 'main.cpp': main_cpp, 'utils.cpp': UTILS_CPP, 'utils.h': UTILS_H})
+        elif layout == 'zip_nested':
+            _write_zip(os.path.join(path_to_submissions, prefix + 'homework.zip'),
+                       {'homework/code/src/main.cpp': main_cpp, 'homework/code/src/utils.cpp': UTILS_CPP,
+                        'homework/code/include/utils.h': UTILS_H, 'homework/README.md': '# Homework\n',
+                        '__MACOSX/homework/code/src/._main.cpp': '\0' * 64})
+        else:
+            for filename, content in [('main.cpp', main_cpp), ('utils.cpp', UTILS_CPP), ('utils.h', UTILS_H)]:
+                with open(os.path.join(path_to_submissions, prefix + filename), 'w') as f:
+                    f.write(content)
+    return students
@@ -1,4 +1,4 @@
-from setuptools import setup
+from setuptools import find_packages, setup
 
 requirements = ['rarfile==4.0', 'tqdm==4.56.0', 'replit==1.2.11', 'typing-extensions==3.7.4.3','coloredlogs==15.0.1']
 
@@ -10,7 +10,7 @@ setup(name="canvas-cppgrader",
       description="A toolkit to grade C/C++ submissions from canvas",
       long_description=open('README.rst').read(),
       license="MIT Licence",
-      packages=["cppgrader", "cppgrader/components", "cppgrader/tools"],
-      python_requires=">=3.6",
+      packages=find_packages(include=["cppgrader", "cppgrader.*"]),
+      python_requires=">=3.7",
       install_requires=requirements,
       entrypoints={'console_scripts': ['cppgrader = cppgrader.app:main']})
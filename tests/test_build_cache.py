@@ -0,0 +1,30 @@
+import os
+
+from cppgrader.app import build_parser
+from cppgrader.components.AutoBuilder import AutoBuilder
+
+# Hangs on the first build only, the files it writes are not sources so the cache key does not change
+COMMAND = 'if [ -e started ]; then echo built > main; else touch started; sleep 5; fi'
+
+
+def make_builder(path_to_output: str) -> AutoBuilder:
+    args = build_parser().parse_args(['-o', path_to_output, '-c', COMMAND, '--build_cache', '--build_timeout', '0.5'])
+    return AutoBuilder(args, shell_executable='/bin/sh')
+
+
+def test_timed_out_build_is_not_cached(tmp_path):
+    path_to_task = tmp_path / '500000000001ALICE'
+    path_to_task.mkdir()
+    (path_to_task / 'main.cpp').write_text('int main() { return 0; }\n')
+
+    builder = make_builder(str(tmp_path))
+    builder.run()
+    assert builder.compiler_output['500000000001ALICE'][0] != 0
+    assert '500000000001ALICE' in builder.timed_out
+    assert len(builder.build_cache.index) == 0
+
+    builder = make_builder(str(tmp_path))
+    builder.run()
+    assert builder.build_cache.hits == 0
+    assert builder.compiler_output['500000000001ALICE'][0] == 0
+    assert os.path.isfile(path_to_task / 'main')
@@ -0,0 +1,15 @@
+import inspect
+
+import cppgrader
+import cppgrader.components
+from cppgrader.components import AutoBuilder, AutoFilter, AutoReporter, AutoTester, ContentStore, ManualGrader, Pipeline, ResultStore, Tracer
+
+COMPONENTS = ['AutoBuilder', 'AutoFilter', 'AutoReporter', 'AutoTester', 'ContentStore', 'ManualGrader', 'Pipeline', 'ResultStore', 'Tracer']
+
+
+def test_components_are_classes():
+    imported = [AutoBuilder, AutoFilter, AutoReporter, AutoTester, ContentStore, ManualGrader, Pipeline, ResultStore, Tracer]
+    for name, component in zip(COMPONENTS, imported):
+        assert inspect.isclass(component), name
+        assert getattr(cppgrader.components, name) is component
+        assert getattr(cppgrader, name) is component